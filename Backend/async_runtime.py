@@ -0,0 +1,167 @@
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import (
+    READINGS, SCHEDULE_LAG_SECONDS, SCHEDULE_OVERRUNS, TICK_SECONDS,
+    UPLOAD_ERRORS, UPLOAD_REJECTIONS, UPLOAD_SECONDS, UPLOADED_READINGS,
+)
+from sim_clock import DEFAULT_SLOT_WIDTH, phase_offsets
+from sim_log import log
+
+# --- Motor asyncio ---
+# Los dispositivos no tienen hilo propio: se agrupan por fase (ranuras de `slot_width`
+# segundos dentro del intervalo, como en `sim_clock.TimingWheel`) y cada ranura es una
+# corrutina. En cada tick la ranura genera las lecturas de sus dispositivos en un executor
+# (rutas y GPS son CPU) y las sube con un cliente HTTP asíncrono de concurrencia acotada,
+# sin esperar las respuestas para seguir con el calendario.
+DEFAULT_MAX_CONNECTIONS = 100 # POST simultáneos a ThingSpeak
+DEFAULT_CPU_WORKERS = 2 # hilos del executor que genera las lecturas
+# Lecturas en vuelo (enviándose o esperando conexión) por conexión antes de frenar los ticks
+PENDING_PER_CONNECTION = 10
+
+
+def _require_aiohttp():
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("El motor asyncio requiere aiohttp (pip install aiohttp).") from e
+    return aiohttp
+
+
+class AsyncThingSpeakClient:
+    """
+    Equivalente asíncrono de `send_to_thingspeak`: un POST a update.json por lectura sobre
+    una sesión aiohttp con a lo sumo `max_connections` conexiones abiertas.
+    """
+
+    def __init__(self, base_url, write_api_key, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=10):
+        self.aiohttp = _require_aiohttp()
+        self.url = f"{base_url.rstrip('/')}/update.json"
+        self.write_api_key = write_api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        aiohttp = self.aiohttp
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def send(self, update):
+        """Sube una lectura de `make_update`. Devuelve True si ThingSpeak la aceptó."""
+        payload = {'api_key': self.write_api_key}
+        payload.update((f'field{k}', str(update[f'field{k}'])) for k in range(1, 9))
+        device_id, trip_id = update['field7'], update['field8']
+        try:
+            with UPLOAD_SECONDS.labels('single').time():
+                async with self.session.post(self.url, data=payload) as response:
+                    response.raise_for_status()
+                    text = await response.text()
+        except (self.aiohttp.ClientError, asyncio.TimeoutError) as e:
+            UPLOAD_ERRORS.labels('single').inc()
+            log.error(f"❌ [Dev:{device_id}] Error de conexión con ThingSpeak: {e!r}")
+            return False
+        if text == "0":
+            UPLOAD_REJECTIONS.labels('single').inc()
+            log.warning(f"❌ [Dev:{device_id}] Error: ThingSpeak rechazó la actualización (demasiado rápido).")
+            return False
+        UPLOADED_READINGS.labels('single').inc()
+        log.info(f"✅ [Dev:{device_id}/Viaje:{trip_id}] Datos enviados. ID Entrada: {text}. "
+                 f"Pos:({update['field3']:.5f},{update['field4']:.5f})")
+        return True
+
+
+def _readings(devices, chile_time):
+    """Lecturas de un grupo de dispositivos (corre en el executor)."""
+    updates = []
+    for device in devices:
+        try:
+            with TICK_SECONDS.labels('asyncio').time():
+                updates.append(device.reading(chile_time))
+        except Exception as e:
+            log.exception(f"\n💥 [Dev:{device.device_id}] Ocurrió un error inesperado en el tick: {e}")
+    return updates
+
+
+class AsyncSimulation:
+    """
+    Corre `devices` (objetos con `reading(chile_time)` y `device_id`) cada `interval`
+    segundos en el event loop. Las lecturas van a `sink.submit` si hay un destino por lotes
+    (uplink, spool o archivos) o, si no, a `client.send` (`AsyncThingSpeakClient`).
+    """
+
+    def __init__(self, devices, interval, clock, sink=None, client=None, slot_width=DEFAULT_SLOT_WIDTH,
+                 cpu_workers=DEFAULT_CPU_WORKERS, max_pending=None):
+        if sink is None and client is None:
+            raise ValueError("AsyncSimulation necesita un `sink` o un `client`")
+        self.interval = interval
+        self.clock = clock
+        self.sink = sink
+        self.client = client
+        self.num_slots = max(1, int(round(interval / slot_width)))
+        self.slot_width = interval / self.num_slots
+        # Dispositivos de cada ranura, con las mismas fases parejas que la rueda de tiempo
+        groups = {}
+        for device, phase in zip(devices, phase_offsets(len(devices), interval)):
+            groups.setdefault(int(phase / self.slot_width) % self.num_slots, []).append(device)
+        self.groups = sorted(groups.items())
+        self.cpu_workers = cpu_workers
+        connections = client.max_connections if client is not None else DEFAULT_MAX_CONNECTIONS
+        self.max_pending = max_pending or connections * PENDING_PER_CONNECTION
+        self._pending = None
+        self._uploads = set()
+
+    async def run(self):
+        """Corre hasta que se cancele la tarea (o CTRL+C en `asyncio.run`)."""
+        self._pending = asyncio.Semaphore(self.max_pending)
+        executor = ThreadPoolExecutor(self.cpu_workers, thread_name_prefix="readings")
+        start = asyncio.get_running_loop().time()
+        try:
+            await asyncio.gather(*(self._run_slot(slot, devices, start, executor) for slot, devices in self.groups))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if self._uploads:
+                await asyncio.gather(*self._uploads, return_exceptions=True)
+
+    async def _run_slot(self, slot, devices, start, executor):
+        loop = asyncio.get_running_loop()
+        lag_histogram = SCHEDULE_LAG_SECONDS.labels('asyncio')
+        offset = slot * self.slot_width
+        cycle = 0
+        while True:
+            due = start + offset + cycle * self.interval
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > self.interval:
+                # Más de un intervalo atrasado: se saltan las vueltas perdidas en vez de recuperarlas en ráfaga
+                SCHEDULE_OVERRUNS.labels('late').inc(len(devices))
+                cycle += math.floor(-delay / self.interval)
+                due = start + offset + cycle * self.interval
+            lag = max(0.0, loop.time() - due)
+            lag_histogram.observe(lag)
+
+            updates = await loop.run_in_executor(executor, _readings, devices, self.clock.now())
+            READINGS.labels('asyncio').inc(len(updates))
+            for update in updates:
+                await self._publish(update)
+            cycle += 1
+
+    async def _publish(self, update):
+        if self.client is None:
+            self.sink.submit(update)
+            return
+        # Con demasiadas lecturas en vuelo la ranura espera aquí (y se nota como atraso)
+        await self._pending.acquire()
+        task = asyncio.create_task(self.client.send(update))
+        self._uploads.add(task)
+        task.add_done_callback(self._upload_done)
+
+    def _upload_done(self, task):
+        self._uploads.discard(task)
+        self._pending.release()
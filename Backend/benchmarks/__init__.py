@@ -0,0 +1,10 @@
+# --- Benchmarks del Simulador ---
+# Mide los caminos calientes del simulador (tick de la flota y de `Device`, generación de
+# rutas, proyección y envío a ThingSpeak) sin red: usa el grafo de prueba de `fixtures/` y
+# un uplink simulado. Desde Backend/:
+#
+#   python -m benchmarks                                  # flotas de 1, 100, 10k y 100k
+#   python -m benchmarks --sizes 1,100 --output base.json
+#   python -m benchmarks --compare base.json              # compara contra una corrida guardada
+#
+# Ver scenarios.py (qué se mide) y compare.py (comparación contra una línea base).
@@ -0,0 +1,129 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.compare import DEFAULT_TOLERANCE, compare_results, format_comparison
+from benchmarks.scenarios import SCENARIOS, measure
+from graph_store import DEFAULT_FIXTURE_PATH
+
+DEFAULT_SIZES = "1,100,10000,100000"
+# El motor por dispositivo es un objeto (y en vivo un hilo) por dispositivo: con flotas
+# grandes un tick tarda minutos, así que por defecto sólo se mide hasta este tamaño
+DEFAULT_DEVICE_MAX = 1000
+
+
+def run_scenario(name, kwargs, isolated=True):
+    """
+    Corre un escenario, por defecto en un proceso nuevo: así el pico de memoria (RSS) es
+    el del escenario y no arrastra lo que dejaron los anteriores.
+    """
+    if not isolated:
+        return measure(name, kwargs)
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as executor:
+        return executor.submit(measure, name, kwargs).result()
+
+
+def plan(args):
+    """Lista de (clave del resultado, escenario, argumentos) según la línea de comandos."""
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    only = set(args.only.split(",")) if args.only else set(SCENARIOS)
+    common = {'fixture_path': args.fixture}
+    runs = []
+    for n in sizes:
+        if 'fleet' in only:
+            runs.append((f"fleet/{n}", 'fleet', dict(common, num_devices=n, ticks=args.ticks, seed=args.seed)))
+        if 'devices' in only and n <= args.device_max:
+            runs.append((f"devices/{n}", 'devices', dict(common, num_devices=n, ticks=args.ticks, seed=args.seed)))
+    if 'device_ops' in only:
+        runs.append(("device_ops", 'device_ops', dict(common, seed=args.seed)))
+    if 'routes' in only:
+        runs.append(("routes", 'routes', dict(common, seed=args.seed)))
+    if 'stations' in only:
+        runs.append(("stations", 'stations', dict(common, seed=args.seed)))
+    if 'projection' in only:
+        runs.append(("projection", 'projection', common))
+    if 'uplink' in only:
+        runs.append(("uplink", 'uplink', common))
+    return runs
+
+
+def environment_info(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'fixture': os.path.basename(args.fixture),
+        'ticks': args.ticks,
+        'seed': args.seed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks del simulador sobre el grafo de prueba y un uplink simulado.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Tamaños de flota separados por coma (por defecto {DEFAULT_SIZES}).")
+    parser.add_argument("--ticks", type=int, default=20, help="Ticks medidos por flota, sin contar el primero (por defecto 20).")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de rutas y lecturas (por defecto 0).")
+    parser.add_argument("--device-max", type=int, default=DEFAULT_DEVICE_MAX,
+                        help=f"Tamaño máximo de flota para el motor por dispositivo (por defecto {DEFAULT_DEVICE_MAX}).")
+    parser.add_argument("--only", default="", help=f"Escenarios a correr, separados por coma ({', '.join(SCENARIOS)}).")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE_PATH, help="Grafo de prueba (JSON) a usar.")
+    parser.add_argument("--output", help="Archivo donde guardar los resultados (JSON); si no, se imprimen.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Resultados guardados contra los que comparar.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Cambio relativo tolerado antes de contar una regresión (por defecto {DEFAULT_TOLERANCE}).")
+    parser.add_argument("--in-process", action="store_true", help="Corre todo en este proceso (el pico de RSS se acumula).")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.only.split(",")) - set(SCENARIOS) if args.only else set()
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report = {'environment': environment_info(args), 'results': {}}
+    for key, name, kwargs in plan(args):
+        print(f"⏱️  [Bench] {key}...", file=sys.stderr, flush=True)
+        started = time.perf_counter()
+        report['results'][key] = run_scenario(name, kwargs, isolated=not args.in_process)
+        print(f"   listo en {time.perf_counter() - started:.1f}s", file=sys.stderr, flush=True)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"💾 [Bench] Resultados guardados en {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if baseline is not None:
+        rows = compare_results(baseline, report, args.tolerance)
+        print(format_comparison(rows), file=sys.stderr)
+        regressions = [row for row in rows if row[-1] == "regression"]
+        if regressions:
+            print(f"❌ [Bench] {len(regressions)} regresiones (tolerancia {args.tolerance:.0%}).", file=sys.stderr)
+            return 1
+        print("✅ [Bench] Sin regresiones.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
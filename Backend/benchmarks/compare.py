@@ -0,0 +1,51 @@
+# --- Comparación Contra una Línea Base ---
+# Se comparan sólo las métricas con dirección conocida (ver la convención en scenarios.py)
+# presentes en ambas corridas. Un cambio peor que `tolerance` (relativo) es una regresión.
+DEFAULT_TOLERANCE = 0.10
+HIGHER_IS_BETTER = ('_per_sec', 'hit_rate')
+LOWER_IS_BETTER = ('_ms', '_s', '_mb', '_bytes')
+
+
+def metric_direction(name):
+    """+1 si la métrica mejora al subir, -1 si mejora al bajar, 0 si no se compara."""
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """
+    Filas (escenario, métrica, base, actual, cambio relativo, estado) para las métricas
+    comparables. `estado` es "regression", "improvement" u "ok".
+    """
+    rows = []
+    base_results = baseline.get('results', {})
+    for scenario, metrics in current.get('results', {}).items():
+        base_metrics = base_results.get(scenario)
+        if not base_metrics:
+            continue
+        for name, value in metrics.items():
+            direction = metric_direction(name)
+            base = base_metrics.get(name)
+            if not direction or not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+                continue
+            change = (value - base) / abs(base)
+            if change * direction < -tolerance:
+                status = "regression"
+            elif change * direction > tolerance:
+                status = "improvement"
+            else:
+                status = "ok"
+            rows.append((scenario, name, base, value, change, status))
+    return rows
+
+
+def format_comparison(rows):
+    """Tabla de texto con las filas de `compare_results`."""
+    marks = {"regression": "❌", "improvement": "✅", "ok": "  "}
+    lines = [f"   {'escenario':<22} {'métrica':<38} {'base':>12} {'actual':>12} {'cambio':>8}"]
+    for scenario, name, base, value, change, status in rows:
+        lines.append(f"{marks[status]} {scenario:<22} {name:<38} {base:>12.4g} {value:>12.4g} {change:>+8.1%}")
+    return "\n".join(lines)
@@ -0,0 +1,408 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from contraction import ContractionHierarchy, load_hierarchy
+from csr_graph import CSRGraph
+from energy_model import DEFAULT_ELEVATION_PATH, annotate_graph
+from fleet import Fleet
+from graph_store import DEFAULT_CACHE_DIR, DEFAULT_FIXTURE_PATH, load_street_graph
+from projection import unproject_coords
+from routing import RouteService
+from sim_clock import VirtualClock, parse_start_time
+from sim_model import UPDATE_INTERVAL, calculate_temperature
+from spatial_index import TripSampler
+from speed_model import SpeedModel
+from stations import StationNetwork, spread_stations
+from thingspeak_stub import ThingSpeakStub
+from uplink import MAX_BULK_UPDATES, ThingSpeakUplink, make_update
+
+# --- Escenarios de Benchmark ---
+# Cada escenario es una función que arma lo que necesita, mide y devuelve un diccionario de
+# métricas. Convención de nombres (la usa compare.py): `*_per_sec` y `*hit_rate` son mejores
+# cuanto más altos; `*_ms`, `*_s`, `*_mb` y `*_bytes` cuanto más bajos. Todo corre en tiempo virtual
+# desde una hora fija, así que con la misma semilla se mide siempre el mismo trabajo.
+BENCH_START_TIME = "2024-03-01T08:00"
+BENCH_PLACE = "benchmark"
+BENCH_CHANNEL_ID = "bench"
+BENCH_API_KEY = "bench"
+# Dispositivos creados aparte para medir la memoria por dispositivo en reposo
+IDLE_MEMORY_SAMPLE = 10000
+
+
+def peak_rss_mb():
+    """Memoria residente máxima del proceso hasta ahora (MB)."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: no hay `resource`, pero sí psutil (requirements.txt)
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo informa en KB y macOS en bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def latency_summary(seconds, prefix='tick'):
+    """Media, p50 y p99 (ms) de una lista de duraciones en segundos, y su tasa por segundo."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if len(ms) == 0:
+        return {}
+    mean = float(ms.mean())
+    return {
+        f'{prefix}_mean_ms': mean,
+        f'{prefix}_p50_ms': float(np.percentile(ms, 50)),
+        f'{prefix}_p99_ms': float(np.percentile(ms, 99)),
+        f'{prefix}s_per_sec': 1000 / mean if mean > 0 else 0.0,
+    }
+
+
+class MockUplink:
+    """Destino de lecturas con la interfaz de `ThingSpeakUplink` que sólo las cuenta."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def start(self):
+        return self
+
+    def submit(self, update):
+        self.submitted += 1
+
+    def pending(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def load_graph(fixture_path=DEFAULT_FIXTURE_PATH, cache_dir=DEFAULT_CACHE_DIR):
+    """Grafo de prueba (vía el caché en disco, como el simulador) y su sorteador de viajes."""
+    street_graph = load_street_graph(BENCH_PLACE, fixture_path=fixture_path, cache_dir=cache_dir)
+    graph = CSRGraph.from_street_graph(street_graph)
+    annotate_graph(street_graph, graph, DEFAULT_ELEVATION_PATH)
+    return street_graph, graph, TripSampler(graph)
+
+
+def import_simulator(fixture_path, base_url, workdir):
+    """
+    Importa data4.py apuntando al fixture y a `base_url` (el stub), con API keys de mentira y
+    los IDs de viaje en `workdir`. Las variables se fijan antes de importar porque data4 las
+    lee al cargarse (y `load_dotenv` no pisa las ya definidas: nunca se usa el canal real).
+    Los mensajes del simulador (ver sim_log.py) quedan en un buffer y no en la consola.
+    """
+    os.environ.update({
+        'VITE_THINGSPEAK_WRITE_API_KEY': BENCH_API_KEY,
+        'VITE_THINGSPEAK_READ_API_KEY': BENCH_API_KEY,
+        'VITE_THINGSPEAK_CHANNEL_ID': BENCH_CHANNEL_ID,
+        'THINGSPEAK_BASE_URL': base_url,
+        'SIM_SINK': 'thingspeak',
+        'SIM_GRAPH_FIXTURE': fixture_path,
+        'SIM_TRIP_ID_PATH': os.path.join(workdir, 'trip_ids.sqlite3'),
+        'SIM_HUB_NODES': '',
+        'SIM_TRAJECTORY_ENCODING': 'standalone',
+    })
+    with contextlib.redirect_stdout(io.StringIO()):
+        import data4
+    return data4
+
+
+def _publish_fleet_tick(fleet, sink, chile_time):
+    # Lo mismo que `data4.publish_fleet_tick` y los procesos de sharding.py, sin tocar la red
+    tick = fleet.step(chile_time)
+    created_at = chile_time.isoformat()
+    for i, encoded in enumerate(fleet.encoded_trajectories(tick)):
+        sink.submit(make_update(float(tick.temperature[i]), float(tick.battery[i]), float(tick.lat[i]),
+                                float(tick.lon[i]), float(tick.speed[i]), encoded, int(tick.device_id[i]),
+                                int(tick.trip_id[i]), created_at))
+
+
+# --- Motor Vectorizado (fleet.py) ---
+def bench_fleet(num_devices, ticks=20, seed=0, fixture_path=DEFAULT_FIXTURE_PATH):
+    """Ticks de un `Fleet` de `num_devices` publicando a un uplink simulado."""
+    street_graph, graph, trips = load_graph(fixture_path)
+    started = time.perf_counter()
+    speed_model = SpeedModel(street_graph)
+    # Como data4.py por defecto: rutas más rápidas a la hora de salida, con la jerarquía del caché
+    route_service = RouteService(graph, trips=trips, weight='time', hierarchy=load_hierarchy(street_graph, graph),
+                                 speed_model=speed_model)
+    fleet = Fleet.from_graph(graph, street_graph.nodes_proj, num_devices, seed=seed, route_service=route_service,
+                             speed_model=speed_model)
+    setup = time.perf_counter() - started
+
+    # Se cuentan y cronometran las rutas que pide la flota
+    provider = fleet.route_provider
+    routes = {'count': 0, 'seconds': 0.0}
+
+    def timed_provider(i, rng):
+        t0 = time.perf_counter()
+        route = provider(i, rng)
+        routes['seconds'] += time.perf_counter() - t0
+        routes['count'] += 1
+        return route
+
+    fleet.route_provider = timed_provider
+    sink = MockUplink()
+    clock = VirtualClock(parse_start_time(BENCH_START_TIME))
+    latencies = []
+    first_tick = 0.0
+    # El primer tick asigna la ruta inicial de todos: se informa aparte
+    for t in range(ticks + 1):
+        t0 = time.perf_counter()
+        _publish_fleet_tick(fleet, sink, clock.now())
+        elapsed = time.perf_counter() - t0
+        if t == 0:
+            first_tick = elapsed
+        else:
+            latencies.append(elapsed)
+        clock.advance(UPDATE_INTERVAL)
+
+    result = {'devices': num_devices, 'ticks': ticks, 'setup_s': setup, 'first_tick_ms': first_tick * 1000}
+    result.update(latency_summary(latencies))
+    result['device_updates_per_sec'] = num_devices * result.get('ticks_per_sec', 0.0)
+    result['routes_generated'] = routes['count']
+    result['route_generation_per_sec'] = routes['count'] / routes['seconds'] if routes['seconds'] else 0.0
+    result['route_cache'] = route_service.stats()
+    result['route_cache_hit_rate'] = result['route_cache']['hit_rate']
+    result['readings_published'] = sink.submitted
+    return result
+
+
+# --- Motor por Dispositivo (data4.Device) ---
+def idle_device_bytes(device_class, count, seed=0):
+    """Bytes asignados por dispositivo recién creado (sin ticks), medidos con tracemalloc."""
+    tracemalloc.start()
+    try:
+        devices = [device_class(i + 1, seed=seed + i) for i in range(count)]
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del devices
+    return allocated / count if count else 0.0
+
+
+def bench_devices(num_devices, ticks=20, seed=0, fixture_path=DEFAULT_FIXTURE_PATH):
+    """Ticks de `num_devices` objetos `Device` de data4.py, en un solo hilo y tiempo virtual."""
+    with tempfile.TemporaryDirectory() as workdir:
+        data4 = import_simulator(fixture_path, "http://127.0.0.1:9", workdir)
+        data4.sink = sink = MockUplink()
+        started = time.perf_counter()
+        devices = [data4.Device(i + 1, seed=seed + i) for i in range(num_devices)]
+        setup = time.perf_counter() - started
+        idle_bytes = idle_device_bytes(data4.Device, min(num_devices, IDLE_MEMORY_SAMPLE), seed)
+        clock = VirtualClock(parse_start_time(BENCH_START_TIME))
+        latencies = []
+        first_tick = 0.0
+        for t in range(ticks + 1):
+            now = clock.now()
+            t0 = time.perf_counter()
+            for device in devices:
+                device.tick(now)
+            elapsed = time.perf_counter() - t0
+            if t == 0:
+                first_tick = elapsed
+            else:
+                latencies.append(elapsed)
+            clock.advance(UPDATE_INTERVAL)
+        data4.trip_ids.close()
+
+    result = {'devices': num_devices, 'ticks': ticks, 'setup_s': setup, 'first_tick_ms': first_tick * 1000,
+              'idle_device_bytes': idle_bytes}
+    result.update(latency_summary(latencies))
+    result['device_updates_per_sec'] = num_devices * result.get('ticks_per_sec', 0.0)
+    result['route_cache'] = data4.route_service.stats()
+    result['route_cache_hit_rate'] = result['route_cache']['hit_rate']
+    result['readings_published'] = sink.submitted
+    return result
+
+
+def bench_device_ops(calls=5000, seed=0, fixture_path=DEFAULT_FIXTURE_PATH):
+    """Llamadas por segundo a cada paso de `Device.tick` por separado, sobre un dispositivo."""
+    with tempfile.TemporaryDirectory() as workdir:
+        data4 = import_simulator(fixture_path, "http://127.0.0.1:9", workdir)
+        device = data4.Device(1, seed=seed)
+        now = parse_start_time(BENCH_START_TIME)
+        rng = random.Random(seed)
+        result = {'calls': calls}
+        steps = (
+            ('update_gps_and_speed_on_streets', lambda: device.update_gps_and_speed_on_streets(now)),
+            ('update_battery', device.update_battery),
+            ('calculate_temperature', lambda: calculate_temperature(now, rng)),
+        )
+        for name, step in steps:
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                step()
+            result[f'{name}_per_sec'] = calls / (time.perf_counter() - t0)
+        data4.trip_ids.close()
+    return result
+
+
+# --- Rutas ---
+def bench_routes(count=2000, seed=0, fixture_path=DEFAULT_FIXTURE_PATH):
+    """
+    Generación de rutas aleatorias con `RouteService`: primero con el caché vacío y luego
+    repitiendo los mismos viajes (todo aciertos). Aparte, A* puro sobre los mismos pares y la
+    jerarquía de contracción: su preproceso, una personalización por tiempo de viaje y las
+    consultas (camino completo) sobre los mismos pares.
+    """
+    street_graph, graph, trips = load_graph(fixture_path)
+    nodes = street_graph.nodes_proj
+    result = {'routes': count}
+
+    service = RouteService(graph, trips=trips)
+    t0 = time.perf_counter()
+    rng = random.Random(seed)
+    for _ in range(count):
+        service.random_route(rng, nodes)
+    result['cold_routes_per_sec'] = count / (time.perf_counter() - t0)
+    cold = service.stats()
+    result['cold_hit_rate'] = cold['hit_rate']
+
+    t0 = time.perf_counter()
+    rng = random.Random(seed)
+    for _ in range(count):
+        service.random_route(rng, nodes)
+    result['warm_routes_per_sec'] = count / (time.perf_counter() - t0)
+    result['route_cache'] = service.stats()
+
+    rng = random.Random(seed)
+    pairs = [trips.random_trip(rng, nodes) for _ in range(count)]
+    t0 = time.perf_counter()
+    for origin, destination in pairs:
+        graph.shortest_route(origin, destination)
+    result['shortest_routes_per_sec'] = count / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    hierarchy = ContractionHierarchy.build(graph)
+    result['hierarchy_build_ms'] = (time.perf_counter() - t0) * 1000
+    speed_model = SpeedModel(street_graph)
+    t0 = time.perf_counter()
+    metric = hierarchy.customize(speed_model.edge_travel_time(graph.weights, speed_model.bucket(parse_start_time(BENCH_START_TIME)),
+                                                              graph.edge_ref))
+    result['hierarchy_customize_ms'] = (time.perf_counter() - t0) * 1000
+    index_pairs = [(graph.index_of(origin), graph.index_of(destination)) for origin, destination in pairs]
+    t0 = time.perf_counter()
+    for source, target in index_pairs:
+        metric.shortest_path(source, target)
+    result['hierarchy_paths_per_sec'] = count / (time.perf_counter() - t0)
+    result['hierarchy'] = hierarchy.stats()
+    return result
+
+
+# --- Estaciones de Carga ---
+def bench_stations(events=5000, num_stations=8, seed=0, fixture_path=DEFAULT_FIXTURE_PATH):
+    """
+    Campo de distancias a las estaciones (un Dijkstra multi-fuente) y despacho por lotes de
+    `events` dispositivos con batería baja en posiciones al azar, frío y con el caché de rutas
+    lleno. Aparte, la alternativa sin campo: un Dijkstra completo por dispositivo.
+    """
+    _, graph, trips = load_graph(fixture_path)
+    stations = spread_stations(graph, num_stations, trips.component)
+    result = {'events': events, 'stations': len(stations), 'nodes': graph.num_nodes}
+
+    t0 = time.perf_counter()
+    network = StationNetwork(graph, stations, grid=trips.grid)
+    result['distance_field_ms'] = (time.perf_counter() - t0) * 1000
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(graph.x.min(), graph.x.max(), events)
+    y = rng.uniform(graph.y.min(), graph.y.max(), events)
+    t0 = time.perf_counter()
+    network.dispatch(x, y)
+    result['cold_dispatches_per_sec'] = events / (time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    network.dispatch(x, y)
+    result['warm_dispatches_per_sec'] = events / (time.perf_counter() - t0)
+
+    nodes = network.locate(x, y)
+    targets = set(network.station_index.tolist())
+    searches = min(events, 500)
+    t0 = time.perf_counter()
+    for node in nodes[:searches].tolist():
+        dist, _ = graph.dijkstra(node)
+        min((dist.get(t, np.inf) for t in targets), default=np.inf)
+    result['per_device_searches_per_sec'] = searches / (time.perf_counter() - t0)
+    result['station_network'] = network.stats()
+    return result
+
+
+# --- Proyección ---
+def bench_projection(points=100_000, single_calls=5000, fixture_path=DEFAULT_FIXTURE_PATH):
+    """Desproyección por lotes (puntos/s) y de a un punto (llamadas/s, como un tick de `Device`)."""
+    _, graph, _ = load_graph(fixture_path)
+    coords = np.resize(np.asarray(graph.geom_xy, dtype=np.float64), (points, 2))
+    unproject_coords(coords[:1], graph.crs) # crea el Transformer fuera de la medición
+    result = {'points': points}
+
+    t0 = time.perf_counter()
+    unproject_coords(coords, graph.crs)
+    result['batch_points_per_sec'] = points / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for k in range(single_calls):
+        unproject_coords(coords[k:k + 1], graph.crs)
+    result['single_calls_per_sec'] = single_calls / (time.perf_counter() - t0)
+    return result
+
+
+# --- Envío a ThingSpeak (contra thingspeak_stub.py) ---
+def bench_uplink(single_posts=200, bulk_readings=20_000, fixture_path=DEFAULT_FIXTURE_PATH):
+    """
+    `data4.send_to_thingspeak` (un POST por lectura) y `ThingSpeakUplink` (bulk_update en
+    lotes de 960) contra el stub local. Mide el costo del cliente y del HTTP local, no la red.
+    """
+    stub = ThingSpeakStub().start()
+    result = {'single_posts': single_posts, 'bulk_readings': bulk_readings}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            data4 = import_simulator(fixture_path, stub.base_url, workdir)
+            t0 = time.perf_counter()
+            for k in range(single_posts):
+                data4.send_to_thingspeak(BENCH_API_KEY, 20.0, 90.0, -33.04, -71.6, 4.2, "", 1, k + 1)
+            result['single_posts_per_sec'] = single_posts / (time.perf_counter() - t0)
+
+            uplink = ThingSpeakUplink(BENCH_CHANNEL_ID, BENCH_API_KEY, base_url=stub.base_url,
+                                      batch_size=MAX_BULK_UPDATES, flush_interval=0)
+            created_at = parse_start_time(BENCH_START_TIME).isoformat()
+            t0 = time.perf_counter()
+            for k in range(bulk_readings):
+                uplink.submit(make_update(20.0, 90.0, -33.04, -71.6, 4.2, "", 1, k + 1, created_at))
+            # El stub no limita la frecuencia: sin intervalo entre POSTs se mide sólo el cliente
+            while uplink.pending():
+                uplink.flush()
+            result['bulk_readings_per_sec'] = bulk_readings / (time.perf_counter() - t0)
+            result['bulk_requests'] = uplink.requests
+            data4.trip_ids.close()
+        result['stub_entries'] = len(stub.entries)
+    finally:
+        stub.stop()
+    return result
+
+
+SCENARIOS = {
+    'fleet': bench_fleet,
+    'devices': bench_devices,
+    'device_ops': bench_device_ops,
+    'routes': bench_routes,
+    'stations': bench_stations,
+    'projection': bench_projection,
+    'uplink': bench_uplink,
+}
+
+
+def measure(name, kwargs):
+    """Corre el escenario `name` y agrega el pico de memoria del proceso."""
+    result = SCENARIOS[name](**kwargs)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from sim_log import log
+
+# --- Exportación a Archivos Columnares (Parquet / Arrow IPC) ---
+# Alternativa a ThingSpeak para generar historia de la flota sin red: las lecturas se juntan
+# en memoria y se escriben por lotes en archivos particionados sólo por fecha:
+#   <root>/date=YYYY-MM-DD/part-<pid>-<inicio>-<n>.parquet
+# `device_id` es una columna más (cada lote va ordenado por dispositivo, así los grupos de
+# filas quedan acotados por dispositivo). Cada fecha mantiene un único archivo abierto, que
+# recibe un grupo de filas por lote y se "rota" a uno nuevo al llegar a `max_rows_per_file`
+# filas o al cerrarse por exceder `max_open_files` fechas abiertas.
+DEFAULT_EXPORT_DIR = os.path.join(os.path.dirname(__file__), 'exports')
+DEFAULT_FLUSH_ROWS = 50_000
+DEFAULT_MAX_ROWS_PER_FILE = 1_000_000
+DEFAULT_MAX_OPEN_FILES = 4
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+# Campos de `uplink.make_update` -> columnas del archivo
+COLUMNS = (('field1', 'temperature'), ('field2', 'battery'), ('field3', 'lat'), ('field4', 'lon'),
+           ('field5', 'speed'), ('field6', 'trajectory'), ('field7', 'device_id'), ('field8', 'trip_id'))
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("La exportación columnar requiere pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+
+def _micros(when):
+    """`datetime` con zona horaria -> microsegundos desde 1970 (UTC), sin pasar por float."""
+    return (when - EPOCH) // timedelta(microseconds=1)
+
+
+class ColumnarSink:
+    """
+    Destino de lecturas con la misma interfaz que `ThingSpeakUplink` (`submit`, `flush`,
+    `stop`, `pending`): recibe los diccionarios de `make_update` y los escribe como columnas
+    tipadas en Parquet (`fmt='parquet'`, comprimido con zstd) o Arrow IPC (`fmt='arrow'`).
+    `submit_columns` recibe un tick completo como arrays, sin armar un diccionario por lectura.
+    """
+
+    def __init__(self, root=DEFAULT_EXPORT_DIR, fmt='parquet', flush_rows=DEFAULT_FLUSH_ROWS,
+                 max_rows_per_file=DEFAULT_MAX_ROWS_PER_FILE, max_open_files=DEFAULT_MAX_OPEN_FILES):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato desconocido {fmt!r}; usa uno de {sorted(FORMATS)}")
+        self.pa = _require_pyarrow()
+        self.root = root
+        self.fmt = fmt
+        self.flush_rows = flush_rows
+        self.max_rows_per_file = max_rows_per_file
+        self.max_open_files = max_open_files
+        pa = self.pa
+        self.schema = pa.schema([
+            ('created_at', pa.timestamp('us', tz='UTC')),
+            ('temperature', pa.float64()), ('battery', pa.float64()),
+            ('lat', pa.float64()), ('lon', pa.float64()), ('speed', pa.float64()),
+            ('trajectory', pa.string()), ('device_id', pa.int32()), ('trip_id', pa.int64()),
+        ])
+        self._lock = threading.Lock()
+        self._rows = [] # lecturas sueltas (diccionarios de `make_update`)
+        self._chunks = [] # ticks completos: (fecha, tabla)
+        self._chunk_rows = 0
+        self._writers = OrderedDict() # fecha -> [writer, filas escritas]
+        self._file_seq = 0
+        self._session = f"{os.getpid()}-{int(time.time())}"
+        self.rows_written = 0
+        self.files_written = 0
+
+    def start(self):
+        return self
+
+    def submit(self, update):
+        with self._lock:
+            self._rows.append(update)
+            if self.pending() >= self.flush_rows:
+                self._flush_locked()
+
+    def submit_columns(self, created_at, temperature, battery, lat, lon, speed, trajectory, device_id, trip_id):
+        """
+        Lecturas de un tick como arrays (uno por columna, `trajectory` una lista de strings),
+        todas con la misma hora `created_at` (`datetime` con zona horaria). Los arrays se copian:
+        pyarrow los envolvería sin copiar y la flota los reescribe en el tick siguiente.
+        """
+        pa = self.pa
+        n = len(device_id)
+        columns = [pa.array(np.full(n, _micros(created_at), dtype=np.int64), type=self.schema.field('created_at').type)]
+        for name, values in (('temperature', temperature), ('battery', battery), ('lat', lat), ('lon', lon),
+                             ('speed', speed), ('trajectory', trajectory), ('device_id', device_id), ('trip_id', trip_id)):
+            if isinstance(values, np.ndarray):
+                values = values.copy()
+            columns.append(pa.array(values, type=self.schema.field(name).type))
+        table = pa.Table.from_arrays(columns, schema=self.schema)
+        # La fecha de la partición es la fecha local de la lectura (como la ve el dashboard)
+        date = created_at.date().isoformat()
+        with self._lock:
+            self._chunks.append((date, table))
+            self._chunk_rows += n
+            if self.pending() >= self.flush_rows:
+                self._flush_locked()
+
+    def pending(self):
+        return len(self._rows) + self._chunk_rows
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def stop(self):
+        """Escribe lo pendiente y cierra todos los archivos abiertos."""
+        with self._lock:
+            self._flush_locked()
+            while self._writers:
+                _, (writer, _) = self._writers.popitem(last=False)
+                writer.close()
+        log.info(f"💾 [Export] {self.rows_written} lecturas en {self.files_written} archivos {self.fmt} bajo {self.root}.")
+
+    def _rows_to_table(self, rows):
+        pa = self.pa
+        stamps = [row['created_at'] for row in rows]
+        # Las lecturas de un lote comparten pocas horas distintas: se interpreta cada una una sola vez
+        micros = {stamp: _micros(datetime.fromisoformat(stamp)) for stamp in set(stamps)}
+        columns = [pa.array(np.fromiter((micros[stamp] for stamp in stamps), dtype=np.int64, count=len(stamps)),
+                            type=self.schema.field('created_at').type)]
+        for field, name in COLUMNS:
+            columns.append(pa.array([row[field] for row in rows], type=self.schema.field(name).type))
+        return pa.Table.from_arrays(columns, schema=self.schema), np.array([stamp[:10] for stamp in stamps])
+
+    def _flush_locked(self):
+        rows, self._rows = self._rows, []
+        chunks, self._chunks, self._chunk_rows = self._chunks, [], 0
+        tables, dates = [], []
+        for date, table in chunks:
+            tables.append(table)
+            dates.append(np.full(len(table), date))
+        if rows:
+            table, row_dates = self._rows_to_table(rows)
+            tables.append(table)
+            dates.append(row_dates)
+        if not tables:
+            return
+        table = self.pa.concat_tables(tables)
+        dates = np.concatenate(dates)
+        devices = table.column('device_id').to_numpy()
+        order = np.lexsort((devices, dates))
+        table = table.take(order)
+        dates = dates[order]
+        # Tramos contiguos con la misma fecha: un grupo de filas por fecha y por lote
+        change = np.flatnonzero(dates[1:] != dates[:-1]) + 1
+        bounds = np.concatenate(([0], change, [len(dates)]))
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            self._write_partition(str(dates[a]), table.slice(a, b - a))
+        self.rows_written += len(dates)
+
+    def _write_partition(self, date, table):
+        entry = self._writers.get(date)
+        if entry is not None and entry[1] >= self.max_rows_per_file:
+            self._writers.pop(date)[0].close()
+            entry = None
+        if entry is None:
+            if len(self._writers) >= self.max_open_files:
+                _, (oldest, _) = self._writers.popitem(last=False)
+                oldest.close()
+            entry = self._writers[date] = [self._open_writer(date), 0]
+        self._writers.move_to_end(date)
+        entry[0].write_table(table)
+        entry[1] += len(table)
+
+    def _open_writer(self, date):
+        directory = os.path.join(self.root, f"date={date}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self._session}-{self._file_seq:05d}{FORMATS[self.fmt]}")
+        self._file_seq += 1
+        self.files_written += 1
+        if self.fmt == 'parquet':
+            return self.pa.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        return self.pa.ipc.new_file(path, self.schema)
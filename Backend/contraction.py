@@ -0,0 +1,446 @@
+import argparse
+import os
+
+import numpy as np
+
+from graph_store import DEFAULT_CACHE_DIR, read_meta
+
+# --- Jerarquía de Contracción Personalizable (CCH) ---
+# Índice para buscar caminos sin recorrer la ciudad en cada consulta. Se arma en dos etapas:
+# 1. Preproceso (sólo depende de la forma del grafo, se guarda junto a su caché): los nodos se
+#    ordenan por disección anidada geométrica (los separadores de cada región van al final) y
+#    se "contraen" en ese orden, agregando atajos entre los vecinos superiores de cada nodo. De
+#    ahí salen los arcos de la jerarquía, los triángulos entre ellos y el árbol de eliminación.
+# 2. Personalización (una por métrica: largo, energía o tiempo de viaje de una franja horaria):
+#    se cargan los pesos de las aristas en los arcos y se recorren los triángulos por niveles
+#    del árbol, con operaciones vectorizadas. Luego cada nodo guarda su distancia hacia y desde
+#    cada uno de sus ancestros en el árbol (etiquetas alineadas por profundidad).
+# Una consulta (origen, destino) es el mínimo de la suma de dos etiquetas sobre los ancestros
+# comunes; el camino se reconstruye siguiendo los arcos de las etiquetas y desarmando atajos.
+HIERARCHY_VERSION = 1
+HIERARCHY_FILE = 'hierarchy.npz'
+# Las regiones de hasta este número de nodos no se siguen dividiendo
+LEAF_SIZE = 32
+# Direcciones de corte que se prueban en cada disección: los dos ejes y las dos diagonales
+CUT_DIRECTIONS = ((1.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, -1.0))
+
+# Arrays que componen una jerarquía en disco
+HIERARCHY_ARRAYS = ('rank', 'parent', 'depth', 'label_offsets', 'chain', 'arc_indptr', 'arc_low', 'arc_high',
+                    'tri_a', 'tri_b', 'tri_target', 'level_offsets', 'edge_slot')
+
+
+# --- Orden de Contracción ---
+def undirected_edges(graph):
+    """Pares (u, v) con u < v de las aristas de un `CSRGraph`, sin repetir ni lazos."""
+    u = np.repeat(np.arange(graph.num_nodes, dtype=np.int64), np.diff(graph.indptr))
+    v = np.asarray(graph.indices, dtype=np.int64)
+    lo, hi = np.minimum(u, v), np.maximum(u, v)
+    keys = np.unique((lo * graph.num_nodes + hi)[lo != hi])
+    return keys // graph.num_nodes, keys % graph.num_nodes
+
+
+def dissection_order(x, y, edge_u, edge_v, leaf_size=LEAF_SIZE):
+    """
+    Orden de contracción (primero el que se contrae primero) por disección anidada: cada
+    región se corta por la mediana en la dirección de `CUT_DIRECTIONS` que deja el separador
+    más chico (los nodos de un lado con vecinos al otro). Se ordenan las dos mitades y al
+    final el separador. No depende de los pesos: sirve para cualquier métrica.
+    """
+    n = len(x)
+    side = np.zeros(n, dtype=bool)
+    local = np.zeros(n, dtype=np.int64)
+    order = []
+
+    def dissect(nodes, eu, ev):
+        if len(nodes) <= leaf_size:
+            # Dentro de una hoja, primero los de menor grado
+            local[nodes] = np.arange(len(nodes))
+            degree = np.bincount(local[eu], minlength=len(nodes)) + np.bincount(local[ev], minlength=len(nodes))
+            order.append(nodes[np.argsort(degree, kind='stable')])
+            return
+        best = None
+        for a, b in CUT_DIRECTIONS:
+            left = np.zeros(len(nodes), dtype=bool)
+            left[np.argsort(a * x[nodes] + b * y[nodes], kind='stable')[:len(nodes) // 2]] = True
+            side[nodes] = left
+            crossing = side[eu] != side[ev]
+            left_end = np.where(side[eu], eu, ev)[crossing]
+            right_end = np.where(side[eu], ev, eu)[crossing]
+            separator = min(np.unique(left_end), np.unique(right_end), key=len)
+            if best is None or len(separator) < len(best[1]):
+                best = (left, separator)
+        left, separator = best
+        side[nodes] = left
+        in_separator = np.zeros(n, dtype=bool)
+        in_separator[separator] = True
+        keep = ~in_separator[eu] & ~in_separator[ev]
+        on_left = keep & side[eu]
+        on_right = keep & ~side[eu]
+        rest = ~in_separator[nodes]
+        left_nodes, right_nodes = nodes[left & rest], nodes[~left & rest]
+        # Las aristas que quedan unen nodos del mismo lado (el separador corta a todas las demás)
+        left_edges, right_edges = (eu[on_left], ev[on_left]), (eu[on_right], ev[on_right])
+        dissect(left_nodes, *left_edges)
+        dissect(right_nodes, *right_edges)
+        order.append(separator)
+
+    dissect(np.arange(n, dtype=np.int64), np.asarray(edge_u, dtype=np.int64), np.asarray(edge_v, dtype=np.int64))
+    return np.concatenate(order) if order else np.zeros(0, dtype=np.int64)
+
+
+# --- Jerarquía ---
+class ContractionHierarchy:
+    """
+    Topología de una CCH sobre un `CSRGraph` (ver el comentario del módulo). El arco a une
+    `arc_low[a]` con `arc_high[a]` (de mayor rango); sus pesos viven en dos posiciones,
+    2a (subiendo, de low a high) y 2a + 1 (bajando). Los arcos que salen hacia arriba del
+    nodo x son `arc_indptr[x]:arc_indptr[x + 1]`, ordenados por rango: el primero lleva a
+    su padre en el árbol de eliminación. El triángulo t dice que el arco `tri_target[t]`
+    puede recorrerse pasando por el nodo de abajo de los arcos `tri_a[t]` y `tri_b[t]`.
+    `chain[label_offsets[x]:label_offsets[x + 1]]` son los ancestros de x por profundidad
+    (x al final) y `edge_slot[k]` la posición del peso de la arista k del CSR (-1 si es un lazo).
+    """
+
+    def __init__(self, rank, parent, depth, label_offsets, chain, arc_indptr, arc_low, arc_high,
+                 tri_a, tri_b, tri_target, level_offsets, edge_slot):
+        self.rank = rank
+        self.parent = parent
+        self.depth = depth
+        self.label_offsets = label_offsets
+        self.chain = chain
+        self.arc_indptr = arc_indptr
+        self.arc_low = arc_low
+        self.arc_high = arc_high
+        self.tri_a = tri_a
+        self.tri_b = tri_b
+        self.tri_target = tri_target
+        self.level_offsets = level_offsets
+        self.edge_slot = edge_slot
+        # Nodos agrupados por profundidad: las etiquetas se calculan de la raíz hacia abajo
+        self.depth_order = np.argsort(depth, kind='stable')
+        self.depth_offsets = np.searchsorted(depth[self.depth_order], np.arange(int(depth.max(initial=0)) + 2))
+        self._arc_high_list = arc_high.tolist()
+        self._arc_low_list = arc_low.tolist()
+
+    @classmethod
+    def build(cls, graph, leaf_size=LEAF_SIZE):
+        """Ordena y contrae los nodos de un `CSRGraph` (el preproceso: puede tardar)."""
+        n = graph.num_nodes
+        edge_u, edge_v = undirected_edges(graph)
+        order = dissection_order(np.asarray(graph.x), np.asarray(graph.y), edge_u, edge_v, leaf_size)
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+
+        # Contracción simbólica: los vecinos superiores de cada nodo pasan a su padre (el de menor rango)
+        upper = [set() for _ in range(n)]
+        low = np.where(rank[edge_u] < rank[edge_v], edge_u, edge_v)
+        high = np.where(rank[edge_u] < rank[edge_v], edge_v, edge_u)
+        for a, b in zip(low.tolist(), high.tolist()):
+            upper[a].add(b)
+        rank_list = rank.tolist()
+        for node in order.tolist():
+            neighbors = upper[node]
+            if len(neighbors) > 1:
+                parent_node = min(neighbors, key=rank_list.__getitem__)
+                upper[parent_node].update(neighbors)
+                upper[parent_node].discard(parent_node)
+
+        counts = np.array([len(s) for s in upper], dtype=np.int64)
+        arc_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=arc_indptr[1:])
+        arc_high = np.array([v for s in upper for v in sorted(s, key=rank_list.__getitem__)], dtype=np.int32)
+        arc_low = np.repeat(np.arange(n, dtype=np.int32), counts)
+        arc_keys = arc_low.astype(np.int64) * n + arc_high
+        key_order = np.argsort(arc_keys)
+
+        def arc_of(lo, hi):
+            return key_order[np.searchsorted(arc_keys[key_order], lo * n + hi)]
+
+        parent = np.full(n, -1, dtype=np.int32)
+        parent[counts > 0] = arc_high[arc_indptr[:-1][counts > 0]]
+
+        # Triángulos: para cada par (u, v) de vecinos superiores de x, el arco u-v pasa por x
+        tri_a, tri_b = [], []
+        pairs = {}
+        for node in np.flatnonzero(counts > 1).tolist():
+            k = int(counts[node])
+            if k not in pairs:
+                pairs[k] = np.triu_indices(k, 1)
+            i, j = pairs[k]
+            tri_a.append(arc_indptr[node] + i)
+            tri_b.append(arc_indptr[node] + j)
+        tri_a = np.concatenate(tri_a) if tri_a else np.zeros(0, dtype=np.int64)
+        tri_b = np.concatenate(tri_b) if tri_b else np.zeros(0, dtype=np.int64)
+        tri_target = arc_of(arc_high[tri_a].astype(np.int64), arc_high[tri_b].astype(np.int64))
+
+        # Profundidad (desde la raíz) y altura (desde las hojas) en el árbol de eliminación
+        depth = np.zeros(n, dtype=np.int32)
+        height = np.zeros(n, dtype=np.int32)
+        parent_list = parent.tolist()
+        height_list = height.tolist()
+        for node in order.tolist():
+            p = parent_list[node]
+            if p >= 0 and height_list[node] + 1 > height_list[p]:
+                height_list[p] = height_list[node] + 1
+        depth_list = depth.tolist()
+        for node in order[::-1].tolist():
+            p = parent_list[node]
+            depth_list[node] = depth_list[p] + 1 if p >= 0 else 0
+        depth, height = np.array(depth_list, dtype=np.int32), np.array(height_list, dtype=np.int32)
+
+        label_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(depth.astype(np.int64) + 1, out=label_offsets[1:])
+        chain = np.empty(int(label_offsets[-1]), dtype=np.int32)
+        for node in order[::-1].tolist():
+            start, d = label_offsets[node], depth_list[node]
+            p = parent_list[node]
+            if p >= 0:
+                chain[start:start + d] = chain[label_offsets[p]:label_offsets[p] + d]
+            chain[start + d] = node
+
+        # Un arco sólo depende de triángulos cuyo nodo de abajo tiene menor altura: por niveles
+        level = height[arc_low[tri_target]]
+        by_level = np.argsort(level, kind='stable')
+        tri_a, tri_b, tri_target = tri_a[by_level], tri_b[by_level], tri_target[by_level]
+        level_offsets = np.searchsorted(level[by_level], np.arange(int(height.max(initial=0)) + 2))
+
+        # Posición del peso de cada arista del CSR: subiendo si sale del nodo de menor rango
+        u = np.repeat(np.arange(n, dtype=np.int64), np.diff(graph.indptr))
+        v = np.asarray(graph.indices, dtype=np.int64)
+        edge_slot = np.full(len(v), -1, dtype=np.int64)
+        real = u != v
+        going_up = rank[u] < rank[v]
+        lo, hi = np.where(going_up, u, v)[real], np.where(going_up, v, u)[real]
+        edge_slot[real] = 2 * arc_of(lo, hi) + ~going_up[real]
+
+        return cls(rank, parent, depth, label_offsets, chain, arc_indptr, arc_low, arc_high,
+                   tri_a.astype(np.int32), tri_b.astype(np.int32), tri_target.astype(np.int32),
+                   level_offsets, edge_slot)
+
+    @property
+    def num_nodes(self):
+        return len(self.rank)
+
+    @property
+    def num_arcs(self):
+        return len(self.arc_high)
+
+    @property
+    def num_triangles(self):
+        return len(self.tri_target)
+
+    @property
+    def max_depth(self):
+        return int(self.depth.max(initial=0))
+
+    @property
+    def label_size(self):
+        """Entradas de etiqueta por dirección (suma de las profundidades más uno)."""
+        return len(self.chain)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in HIERARCHY_ARRAYS)
+
+    def customize(self, edge_weights):
+        """Métrica (`HierarchyMetric`) con los pesos de cada arista del CSR (inf = prohibida)."""
+        return HierarchyMetric(self, edge_weights)
+
+    def stats(self):
+        return {
+            'nodes': self.num_nodes,
+            'arcs': self.num_arcs,
+            'triangles': self.num_triangles,
+            'max_depth': self.max_depth,
+            'mean_label_size': self.label_size / max(self.num_nodes, 1),
+            'mb': self.nbytes / 1e6,
+        }
+
+    def save(self, path, graph_stamp):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, graph_stamp=np.array(graph_stamp), **{name: getattr(self, name) for name in HIERARCHY_ARRAYS})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, graph_stamp):
+        """Jerarquía guardada con `save`, o `None` si no existe o es de otra versión del grafo."""
+        try:
+            with np.load(path) as data:
+                if str(data['graph_stamp']) != graph_stamp:
+                    return None
+                return cls(*(data[name] for name in HIERARCHY_ARRAYS))
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+class HierarchyMetric:
+    """
+    Una `ContractionHierarchy` personalizada con un juego de pesos. `weight[s]` es el costo de
+    la posición s (2·arco subiendo, 2·arco + 1 bajando) y `via[s]` el triángulo por el que se
+    alcanza (-1 si es una arista original). `up[label_offsets[x] + d]` es el costo de x a su
+    ancestor de profundidad d y `down[...]` el de ese ancestor a x; `up_arc`/`down_arc` el
+    primer arco de esos caminos. Es de solo lectura: se puede consultar desde varios hilos.
+    """
+
+    def __init__(self, hierarchy, edge_weights):
+        self.hierarchy = hierarchy
+        self.weight, self.via = self._customize(np.asarray(edge_weights, dtype=np.float64))
+        self.up, self.up_arc = self._labels(0)
+        self.down, self.down_arc = self._labels(1)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.weight, self.via, self.up, self.up_arc, self.down, self.down_arc))
+
+    def _customize(self, edge_weights):
+        h = self.hierarchy
+        weight = np.full(2 * h.num_arcs, np.inf)
+        via = np.full(2 * h.num_arcs, -1, dtype=np.int32)
+        real = h.edge_slot >= 0
+        np.minimum.at(weight, h.edge_slot[real], edge_weights[real])
+        a2, b2, c2 = 2 * h.tri_a.astype(np.int64), 2 * h.tri_b.astype(np.int64), 2 * h.tri_target.astype(np.int64)
+        for lo, hi in zip(h.level_offsets[:-1].tolist(), h.level_offsets[1:].tolist()):
+            if lo == hi:
+                continue
+            a, b, c = a2[lo:hi], b2[lo:hi], c2[lo:hi]
+            # Subiendo u -> v = u -> x (bajando por a) + x -> v (subiendo por b); bajando, al revés
+            slots = np.concatenate((c, c + 1))
+            cand = np.concatenate((weight[a + 1] + weight[b], weight[b + 1] + weight[a]))
+            np.minimum.at(weight, slots, cand)
+            won = (cand == weight[slots]) & np.isfinite(cand)
+            tri = np.arange(lo, hi, dtype=np.int32)
+            via[slots[won]] = np.concatenate((tri, tri))[won]
+        # Los arcos que ganó una arista original no pasan por ningún triángulo
+        direct = np.full(2 * h.num_arcs, np.inf)
+        direct[h.edge_slot[real]] = edge_weights[real]
+        via[direct <= weight] = -1
+        return weight, via
+
+    def _labels(self, direction):
+        """Etiquetas hacia los ancestros (`direction` 0) o desde ellos (1), de la raíz hacia abajo."""
+        h = self.hierarchy
+        label = np.full(h.label_size, np.inf, dtype=np.float32)
+        first_arc = np.full(h.label_size, -1, dtype=np.int32)
+        label[h.label_offsets[:-1] + h.depth] = 0.0
+        arc_weight = self.weight[direction::2].astype(np.float32)
+        for lo, hi in zip(h.depth_offsets[1:-1].tolist(), h.depth_offsets[2:].tolist()):
+            nodes = h.depth_order[lo:hi]
+            counts = h.arc_indptr[nodes + 1] - h.arc_indptr[nodes]
+            arcs = np.repeat(h.arc_indptr[nodes] - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) \
+                + np.arange(counts.sum())
+            heads = h.arc_high[arcs]
+            # Cada arco x -> y aporta a las entradas de x de los ancestros de y (profundidad <= la de y)
+            lengths = h.depth[heads].astype(np.int64) + 1
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            inner = np.arange(lengths.sum()) - np.repeat(starts, lengths)
+            dst = np.repeat(h.label_offsets[h.arc_low[arcs]], lengths) + inner
+            src = np.repeat(h.label_offsets[heads], lengths) + inner
+            cand = np.repeat(arc_weight[arcs], lengths) + label[src]
+            np.minimum.at(label, dst, cand)
+            won = (cand == label[dst]) & np.isfinite(cand)
+            first_arc[dst[won]] = np.repeat(arcs, lengths)[won]
+        return label, first_arc
+
+    def _meeting(self, source, target):
+        """(costo, profundidad del ancestro común por donde pasa el camino), o (inf, -1)."""
+        h = self.hierarchy
+        so, to = h.label_offsets[source], h.label_offsets[target]
+        m = min(h.depth[source], h.depth[target]) + 1
+        common = int(np.count_nonzero(h.chain[so:so + m] == h.chain[to:to + m]))
+        if common == 0:
+            return np.inf, -1
+        total = self.up[so:so + common] + self.down[to:to + common]
+        k = int(np.argmin(total))
+        return float(total[k]), k
+
+    def distance(self, source, target):
+        """Costo del camino más corto entre dos índices internos (inf si no hay)."""
+        return self._meeting(source, target)[0]
+
+    def shortest_path(self, source, target):
+        """Camino más corto (lista de índices internos) entre dos índices internos, o `None`."""
+        if source == target:
+            return [source]
+        cost, k = self._meeting(source, target)
+        if not np.isfinite(cost):
+            return None
+        h = self.hierarchy
+        offsets, depth, high = h.label_offsets, h.depth, h._arc_high_list
+        slots = []
+        node = source
+        while depth[node] > k:
+            arc = int(self.up_arc[offsets[node] + k])
+            slots.append(2 * arc)
+            node = high[arc]
+        down_slots = []
+        node = target
+        while depth[node] > k:
+            arc = int(self.down_arc[offsets[node] + k])
+            down_slots.append(2 * arc + 1)
+            node = high[arc]
+        slots.extend(reversed(down_slots))
+        return self._unpack(source, slots)
+
+    def _unpack(self, source, slots):
+        """Desarma los atajos: nodos del camino que recorre la secuencia de posiciones `slots`."""
+        h = self.hierarchy
+        via, tri_a, tri_b = self.via, h.tri_a, h.tri_b
+        low, high = h._arc_low_list, h._arc_high_list
+        path = [source]
+        stack = slots[::-1]
+        while stack:
+            slot = stack.pop()
+            t = int(via[slot])
+            if t < 0:
+                arc = slot >> 1
+                path.append(low[arc] if slot & 1 else high[arc])
+                continue
+            a, b = 2 * int(tri_a[t]), 2 * int(tri_b[t])
+            if slot & 1:
+                # Bajando v -> u: v -> x (bajando por b) y luego x -> u (subiendo por a)
+                stack.append(a)
+                stack.append(b + 1)
+            else:
+                # Subiendo u -> v: u -> x (bajando por a) y luego x -> v (subiendo por b)
+                stack.append(b)
+                stack.append(a + 1)
+        return path
+
+
+def load_hierarchy(street_graph, graph, rebuild=False):
+    """`ContractionHierarchy` del grafo, desde su caché en disco o construida (y guardada)."""
+    meta = read_meta(street_graph.path) if getattr(street_graph, 'path', None) else None
+    path = os.path.join(street_graph.path, HIERARCHY_FILE) if meta else None
+    stamp = f"{meta['key']}:{meta['created']}:v{HIERARCHY_VERSION}" if meta else ''
+    if path and not rebuild:
+        hierarchy = ContractionHierarchy.load(path, stamp)
+        if hierarchy is not None and len(hierarchy.edge_slot) == graph.num_edges:
+            return hierarchy
+    hierarchy = ContractionHierarchy.build(graph)
+    if path:
+        hierarchy.save(path, stamp)
+    return hierarchy
+
+
+if __name__ == "__main__":
+    import time
+
+    from csr_graph import CSRGraph
+    from graph_store import load_street_graph
+
+    parser = argparse.ArgumentParser(description="Preprocesa la jerarquía de contracción del grafo y la guarda junto a su caché.")
+    parser.add_argument("--place", default="Valparaiso, Region de Valparaiso, Chile", help="Lugar de OpenStreetMap.")
+    parser.add_argument("--fixture", default=os.getenv("SIM_GRAPH_FIXTURE"), help="Grafo local (fixture JSON) en vez del lugar.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directorio del caché de grafos.")
+    parser.add_argument("--rebuild", action="store_true", help="La reconstruye aunque ya esté en el caché.")
+    args = parser.parse_args()
+
+    street_graph = load_street_graph(args.place, network_type='drive', cache_dir=args.cache_dir, fixture_path=args.fixture)
+    graph = CSRGraph.from_street_graph(street_graph)
+    t0 = time.perf_counter()
+    hierarchy = load_hierarchy(street_graph, graph, rebuild=args.rebuild)
+    stats = hierarchy.stats()
+    print(f"🏗️  Jerarquía lista en {time.perf_counter() - t0:.1f} s: {stats['nodes']} nodos, {stats['arcs']} arcos, "
+          f"{stats['triangles']} triángulos, profundidad máx. {stats['max_depth']} ({stats['mb']:.1f} MB) "
+          f"en {os.path.join(street_graph.path, HIERARCHY_FILE)}")
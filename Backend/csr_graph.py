@@ -0,0 +1,347 @@
+import heapq
+import math
+
+import numpy as np
+
+# Las longitudes OSM son geodésicas y la proyección UTM escala distancias en ~0.9996;
+# se rebaja la heurística de A* para que siga siendo admisible.
+ASTAR_HEURISTIC_FACTOR = 0.99
+
+
+class CSRGraph:
+    """
+    Red de calles en formato CSR (compressed sparse row) para buscar rutas sin networkx.
+
+    Las aristas salientes del nodo i son `indices[indptr[i]:indptr[i + 1]]`, con su peso
+    en `weights` y su arista de origen en `edge_ref` (índice sobre los arrays del
+    `StreetGraph`). Entre aristas paralelas se conserva sólo la más corta. Las geometrías
+    viven en un único buffer `geom_xy` indexado por `geom_offsets`. Con `set_edge_energy`
+    cada arista tiene además su energía (Wh), que puede usarse como peso de las búsquedas.
+    """
+
+    def __init__(self, node_ids, x, y, indptr, indices, weights, edge_ref, has_geom, geom_offsets, geom_xy, crs):
+        self.node_ids = node_ids
+        self.x = x
+        self.y = y
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.edge_ref = edge_ref
+        self.has_geom = has_geom
+        self.geom_offsets = geom_offsets
+        self.geom_xy = geom_xy
+        self.crs = crs
+        self.energy = None
+        self._node_index = None
+        self._adjacency = None
+        self._energy_weights = None
+
+    @classmethod
+    def from_street_graph(cls, street_graph, csr=None):
+        """
+        Construye el CSR a partir de los arrays planos de `graph_store.StreetGraph`. `csr` son
+        (indptr, indices, weights, edge_ref) ya calculados (ver `csr_arrays`), por ejemplo
+        mapeados desde el disco: así no se vuelven a ordenar las aristas.
+        """
+        indptr, indices, weights, edge_ref = csr if csr is not None else cls._build_csr(street_graph)
+        return cls(
+            node_ids=np.asarray(street_graph.node_ids),
+            x=np.asarray(street_graph.node_x),
+            y=np.asarray(street_graph.node_y),
+            indptr=indptr,
+            indices=indices,
+            weights=weights,
+            edge_ref=edge_ref,
+            has_geom=np.asarray(street_graph.edge_has_geom),
+            geom_offsets=np.asarray(street_graph.edge_geom_offsets),
+            geom_xy=np.asarray(street_graph.geom_xy),
+            crs=street_graph.crs,
+        )
+
+    @staticmethod
+    def _build_csr(street_graph):
+        u = np.asarray(street_graph.edge_u, dtype=np.int64)
+        v = np.asarray(street_graph.edge_v, dtype=np.int64)
+        length = np.asarray(street_graph.edge_length)
+
+        # Ordena por (u, v, longitud) y deja la primera de cada par: la arista paralela más corta
+        order = np.lexsort((length, v, u))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (u[order][1:] != u[order][:-1]) | (v[order][1:] != v[order][:-1])
+        kept = order[first]
+
+        n = street_graph.num_nodes
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u[kept], minlength=n), out=indptr[1:])
+        return indptr, v[kept].astype(np.int32), length[kept].astype(np.float64), kept.astype(np.int32)
+
+    def csr_arrays(self):
+        """(indptr, indices, weights, edge_ref), lo que `from_street_graph` recibe como `csr`."""
+        return self.indptr, self.indices, self.weights, self.edge_ref
+
+    @classmethod
+    def from_networkx(cls, G_proj):
+        from graph_store import from_networkx
+        return cls.from_street_graph(from_networkx(G_proj))
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        """Memoria ocupada por los arrays del grafo (bytes)."""
+        arrays = (self.node_ids, self.x, self.y, self.indptr, self.indices, self.weights,
+                  self.edge_ref, self.has_geom, self.geom_offsets, self.geom_xy)
+        return sum(a.nbytes for a in arrays)
+
+    def set_edge_energy(self, edge_energy_wh):
+        """Energía de cada arista del `StreetGraph` (ver energy_model.annotate_edges)."""
+        self.energy = np.asarray(edge_energy_wh, dtype=np.float64)[self.edge_ref]
+        self._energy_weights = None
+
+    def index_of(self, osmid):
+        if self._node_index is None:
+            self._node_index = {int(n): i for i, n in enumerate(self.node_ids.tolist())}
+        return self._node_index[int(osmid)]
+
+    def _adj(self):
+        # Listas de Python: el bucle de Dijkstra es más rápido sobre listas que sobre arrays
+        if self._adjacency is None:
+            self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist(),
+                               self.x.tolist(), self.y.tolist())
+        return self._adjacency
+
+    def _weights(self, weight):
+        """Pesos de las aristas como lista: 'length' (metros) o 'energy' (Wh)."""
+        if weight == 'length':
+            return self._adj()[2]
+        if weight != 'energy':
+            raise ValueError(f"Peso desconocido: {weight!r} (se espera 'length' o 'energy')")
+        if self.energy is None:
+            raise ValueError("El grafo no tiene energía por arista (ver CSRGraph.set_edge_energy)")
+        if self._energy_weights is None:
+            self._energy_weights = self.energy.tolist()
+        return self._energy_weights
+
+    # --- Búsqueda de Caminos ---
+    def dijkstra(self, source, target=None, weight='length'):
+        """
+        Dijkstra desde el índice `source`. Devuelve (dist, pred) como diccionarios sobre
+        índices internos; con `target` se detiene al fijar ese nodo.
+        """
+        indptr, indices, _, _, _ = self._adj()
+        weights = self._weights(weight)
+        dist = {source: 0.0}
+        pred = {source: -1}
+        done = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            if node == target:
+                break
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = indices[k]
+                nd = d + weights[k]
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    pred[nxt] = node
+                    heapq.heappush(heap, (nd, nxt))
+        return dist, pred
+
+    def astar(self, source, target):
+        """A* con heurística euclidiana sobre coordenadas proyectadas. Devuelve el camino o `None`."""
+        indptr, indices, weights, xs, ys = self._adj()
+        tx, ty = xs[target], ys[target]
+        factor = ASTAR_HEURISTIC_FACTOR
+        dist = {source: 0.0}
+        pred = {source: -1}
+        done = set()
+        heap = [(math.hypot(xs[source] - tx, ys[source] - ty) * factor, source)]
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            if node == target:
+                return self.tree_path(pred, target)
+            done.add(node)
+            d = dist[node]
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = indices[k]
+                nd = d + weights[k]
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    pred[nxt] = node
+                    heapq.heappush(heap, (nd + math.hypot(xs[nxt] - tx, ys[nxt] - ty) * factor, nxt))
+        return None
+
+    @staticmethod
+    def tree_path(pred, target):
+        """Reconstruye el camino hasta `target` desde un árbol de predecesores, o `None`."""
+        if target not in pred:
+            return None
+        path = [target]
+        while pred[path[-1]] != -1:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return path
+
+    def shortest_path(self, origin_node, destination_node, weight='length'):
+        """
+        Camino más corto (lista de índices internos) entre dos IDs OSM, o `None`. Por
+        largo se usa A*; por energía, Dijkstra (la distancia no acota la energía por debajo).
+        """
+        source, target = self.index_of(origin_node), self.index_of(destination_node)
+        if weight == 'length':
+            return self.astar(source, target)
+        _, pred = self.dijkstra(source, target, weight=weight)
+        return self.tree_path(pred, target)
+
+    def strongly_connected_components(self):
+        """
+        Componente fuertemente conexa de cada nodo (Tarjan iterativo). Dos nodos de la misma
+        componente siempre tienen camino entre sí, en ambos sentidos.
+        """
+        indptr, indices, _, _, _ = self._adj()
+        n = self.num_nodes
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        labels = np.full(n, -1, dtype=np.int32)
+        stack = []
+        counter = 0
+        num_components = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            # Pila de llamadas explícita: (nodo, próxima arista a revisar)
+            work = [(root, indptr[root])]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                node, k = work[-1]
+                if k < indptr[node + 1]:
+                    work[-1] = (node, k + 1)
+                    nxt = indices[k]
+                    if index[nxt] == -1:
+                        index[nxt] = low[nxt] = counter
+                        counter += 1
+                        stack.append(nxt)
+                        on_stack[nxt] = True
+                        work.append((nxt, indptr[nxt]))
+                    elif on_stack[nxt] and index[nxt] < low[node]:
+                        low[node] = index[nxt]
+                    continue
+                work.pop()
+                if work and low[node] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[node]
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        labels[member] = num_components
+                        if member == node:
+                            break
+                    num_components += 1
+        return labels
+
+    # --- Geometría ---
+    def hop_edges(self, path):
+        """
+        Arista (posición en el CSR) usada en cada tramo de un camino de índices internos. Los
+        vecinos de cada fila están ordenados, así que se buscan todos los tramos a la vez con
+        una bisección dentro de la fila de su nodo de origen.
+        """
+        path = np.asarray(path, dtype=np.int64)
+        target = path[1:]
+        lo, hi = self.indptr[path[:-1]], self.indptr[path[:-1] + 1]
+        last = len(self.indices) - 1
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            right = active & (self.indices[np.minimum(mid, last)] < target)
+            lo = np.where(right, mid + 1, lo)
+            hi = np.where(active & ~right, mid, hi)
+        if len(lo) and (lo.max() > last or np.any(self.indices[np.minimum(lo, last)] != target)):
+            raise ValueError("El camino usa un tramo que no es una arista del grafo.")
+        return lo
+
+    def hop_geometry(self, hops, with_edge_start=True):
+        """
+        Posiciones en `geom_xy` de los puntos de cada tramo (aristas del CSR `hops`) y cuántos
+        aporta cada uno. Las aristas con geometría aportan sus puntos (sin el primero si
+        `with_edge_start` es falso); las demás, sólo el nodo destino.
+        """
+        refs = self.edge_ref[hops]
+        ends = self.geom_offsets[refs + 1]
+        starts = np.where(self.has_geom[refs], self.geom_offsets[refs] + (0 if with_edge_start else 1), ends - 1)
+        counts = ends - starts
+        gather = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(counts.sum())
+        return gather, counts
+
+    def path_geometry(self, path, hops=None):
+        """
+        Geometría (N, 2) de un camino: aristas con geometría aportan todos sus puntos, las
+        demás sólo el nodo destino. `hops` son las aristas del camino (`hop_edges(path)`) si
+        ya se calcularon.
+        """
+        if len(path) < 2:
+            return np.empty((0, 2), dtype=np.float64)
+        gather, _ = self.hop_geometry(self.hop_edges(path) if hops is None else hops)
+        return self.geom_xy[gather]
+
+    def path_energy(self, path, with_start=False, hops=None):
+        """
+        Energía acumulada (Wh) en cada punto de `path_geometry(path)` o, con `with_start`, de
+        la geometría que empieza en el nodo inicial y omite el primer punto de cada arista
+        (la de `trajectories.match_trajectory`). La energía de cada arista se reparte a lo
+        largo de sus puntos según la distancia. `None` si el grafo no tiene energía. `hops`
+        como en `path_geometry`.
+        """
+        if self.energy is None:
+            return None
+        if len(path) < 2:
+            return np.zeros(1 if with_start else 0)
+        if hops is None:
+            hops = self.hop_edges(path)
+        gather, counts = self.hop_geometry(hops, with_edge_start=not with_start)
+        coords = self.geom_xy[gather]
+        hop = np.repeat(np.arange(len(hops)), counts)
+        if with_start:
+            coords = np.vstack(([self.x[path[0]], self.y[path[0]]], coords))
+            hop = np.concatenate(([0], hop))
+        segment = np.zeros(len(coords))
+        segment[1:] = np.hypot(*np.diff(coords, axis=0).T)
+        hop_length = np.bincount(hop, weights=segment, minlength=len(hops))
+        density = np.divide(self.energy[hops], hop_length, out=np.zeros(len(hops)), where=hop_length > 0)
+        return np.cumsum(segment * density[hop])
+
+    def path_edges(self, path, with_start=False, hops=None):
+        """
+        Arista de la calle (índice en el `StreetGraph`) del tramo que termina en cada punto de
+        `path_geometry(path)` o, con `with_start`, de la geometría de `path_energy(..., with_start=True)`.
+        `hops` como en `path_geometry`.
+        """
+        if len(path) < 2:
+            return np.full(1 if with_start else 0, -1, dtype=np.int32)
+        if hops is None:
+            hops = self.hop_edges(path)
+        _, counts = self.hop_geometry(hops, with_edge_start=not with_start)
+        edges = np.repeat(self.edge_ref[hops], counts).astype(np.int32)
+        return np.concatenate(([edges[0]], edges)) if with_start else edges
+
+    def shortest_route(self, origin_node, destination_node, weight='length'):
+        """Geometría de la ruta más corta entre dos IDs OSM, o `None` si no hay camino."""
+        path = self.shortest_path(origin_node, destination_node, weight)
+        return self.path_geometry(path) if path is not None else None
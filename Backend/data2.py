@@ -8,10 +8,11 @@ import os
 from dotenv import load_dotenv
 
 # ### NUEVO: Importaciones para el movimiento en calles reales ###
-import osmnx as ox
-import networkx as nx
 import polyline # Para codificar la trayectoria
-from shapely.geometry import Point # Importamos Point para ser explícitos
+from graph_store import load_street_graph
+from csr_graph import CSRGraph
+from routing import RouteService
+from projection import unproject_coords
 
 # --- Cargar variables de entorno ---
 dotenv_path = os.path.join(os.path.dirname(__file__), '../.env')
@@ -27,12 +28,17 @@ if THINGSPEAK_WRITE_API_KEY is None:
     print("🛑 ¡ERROR CRÍTICO! La variable de entorno para THINGSPEAK_WRITE_API_KEY no se encontró.")
     exit()
 
-# ### NUEVO: Configuración de OSMnx para el mapa de calles ###
-print("🌍 Descargando red de calles de Santiago desde OpenStreetMap...")
-G = ox.graph_from_place("Santiago, Región Metropolitana, Chile", network_type='drive')
-G_proj = ox.project_graph(G)
-nodes_proj = list(G_proj.nodes())
-print("✅ Red de calles lista.")
+# --- Red de Calles (Recurso Compartido, cacheada en disco) ---
+GRAPH_PLACE = "Santiago, Región Metropolitana, Chile"
+# Si se define, se usa un grafo local (fixture JSON) y no se descarga nada de OpenStreetMap
+GRAPH_FIXTURE = os.getenv("SIM_GRAPH_FIXTURE")
+print("🌍 Cargando red de calles (caché local u OpenStreetMap)...")
+street_graph = load_street_graph(GRAPH_PLACE, network_type='drive', fixture_path=GRAPH_FIXTURE)
+# Rutas sobre el grafo en arrays (CSR), sin armar un grafo de networkx
+graph = CSRGraph.from_street_graph(street_graph)
+route_service = RouteService(graph)
+nodes_proj = street_graph.nodes_proj
+print(f"✅ Red de calles lista ({street_graph.num_nodes} nodos, {street_graph.num_edges} aristas).")
 
 
 # --- Configuración de Simulación ---
@@ -55,7 +61,7 @@ current_lon = 0.0
 current_speed_mps = 0.0
 current_battery = INITIAL_BATTERY
 battery_state = "DISCHARGING"
-current_route = []
+current_route = None
 current_edge_point_index = 0
 
 # --- Funciones Auxiliares ---
@@ -75,82 +81,34 @@ def update_gps_and_speed_on_streets():
     global current_lat, current_lon, current_speed_mps
     global current_route, current_edge_point_index
 
-    if not current_route or current_edge_point_index >= len(current_route) - 1:
+    if current_route is None or current_edge_point_index >= current_route.last_index:
         print("🗺️ Generando nueva ruta...")
         origin_node = random.choice(nodes_proj)
         destination_node = random.choice(nodes_proj)
         while origin_node == destination_node:
             destination_node = random.choice(nodes_proj)
         
-        try:
-            route_nodes = nx.shortest_path(G_proj, origin_node, destination_node, weight='length')
-            current_route = []
-            for u, v in zip(route_nodes[:-1], route_nodes[1:]):
-                edge_data = G_proj.get_edge_data(u, v)
-                edge = min(edge_data.values(), key=lambda d: d['length'])
-                if 'geometry' in edge:
-                    points = list(edge['geometry'].coords)
-                    current_route.extend(points)
-                else:
-                    current_route.append((G_proj.nodes[v]['x'], G_proj.nodes[v]['y']))
-            
-            current_edge_point_index = 0
-            
-            start_point_proj = current_route[0]
-            
-            # ### CORRECCIÓN FINAL ### Usamos geom= en lugar de geometry=
-            unprojected_point = ox.projection.project_geometry(geom=Point(start_point_proj), crs=G_proj.graph['crs'], to_latlong=True)[0]
-            
-            start_lon, start_lat = unprojected_point.x, unprojected_point.y
-            current_lat, current_lon = start_lat, start_lon
-            print(f"🚦 Ruta generada. Inicio en: ({current_lat:.5f}, {current_lon:.5f})")
-
-        except nx.NetworkXNoPath:
+        current_route = route_service.route(origin_node, destination_node)
+        if current_route is None:
             print("⚠️ No se encontró ruta. Se intentará de nuevo en el próximo ciclo.")
             return current_lat, current_lon, 0, []
+        current_edge_point_index = 0
+
+        start_lat, start_lon = unproject_coords(current_route.coords[0], graph.crs)[0]
+        current_lat, current_lon = float(start_lat), float(start_lon)
+        print(f"🚦 Ruta generada. Inicio en: ({current_lat:.5f}, {current_lon:.5f})")
 
     max_speed_mps = MAX_SPEED_KMH * 1000 / 3600
     current_speed_mps = random.uniform(0.5 * max_speed_mps, max_speed_mps)
     distance_to_travel_m = current_speed_mps * UPDATE_INTERVAL
     
-    trajectory_points_proj = []
-    
-    if current_route:
-        start_point = current_route[current_edge_point_index]
-        trajectory_points_proj.append(start_point)
-
-    while distance_to_travel_m > 0 and current_edge_point_index < len(current_route) - 1:
-        p1 = current_route[current_edge_point_index]
-        p2 = current_route[current_edge_point_index + 1]
-        
-        segment_dist = math.sqrt((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)
-        
-        if distance_to_travel_m >= segment_dist:
-            distance_to_travel_m -= segment_dist
-            current_edge_point_index += 1
-            trajectory_points_proj.append(p2)
-        else:
-            ratio = distance_to_travel_m / segment_dist
-            final_x = p1[0] + ratio * (p2[0] - p1[0])
-            final_y = p1[1] + ratio * (p2[1] - p1[1])
-            trajectory_points_proj.append((final_x, final_y))
-            distance_to_travel_m = 0
+    current_edge_point_index, trajectory_points_proj = current_route.advance(current_edge_point_index, distance_to_travel_m)
 
-    if current_edge_point_index >= len(current_route) - 1:
+    if current_edge_point_index >= current_route.last_index:
         print("🏁 Ruta completada.")
 
-    trajectory_latlon = []
-    if len(trajectory_points_proj) > 1:
-        from shapely.geometry import LineString
-        line_proj = LineString(trajectory_points_proj)
-        # ### CORRECCIÓN FINAL ### Usamos geom= en lugar de geometry=
-        line_unproj = ox.projection.project_geometry(geom=line_proj, crs=G_proj.graph['crs'], to_latlong=True)[0]
-        trajectory_latlon = [(round(lat, 6), round(lon, 6)) for lon, lat in line_unproj.coords]
-    elif len(trajectory_points_proj) == 1:
-        # ### CORRECCIÓN FINAL ### Usamos geom= en lugar de geometry=
-        point_unproj = ox.projection.project_geometry(geom=Point(trajectory_points_proj[0]), crs=G_proj.graph['crs'], to_latlong=True)[0]
-        trajectory_latlon = [(round(point_unproj.y, 6), round(point_unproj.x, 6))]
-
+    trajectory_latlon = [(round(float(lat), 6), round(float(lon), 6))
+                         for lat, lon in unproject_coords(trajectory_points_proj, graph.crs)]
 
     if trajectory_latlon:
         current_lat, current_lon = trajectory_latlon[-1]
@@ -10,10 +10,11 @@ import threading
 import traceback
 
 # ### Importaciones para el movimiento en calles reales ###
-import osmnx as ox
-import networkx as nx
 import polyline
-from shapely.geometry import Point, LineString
+from graph_store import load_street_graph
+from csr_graph import CSRGraph
+from routing import RouteService
+from projection import unproject_coords
 
 # --- Cargar variables de entorno ---
 dotenv_path = os.path.join(os.path.dirname(__file__), '../.env')
@@ -36,12 +37,17 @@ if not all([THINGSPEAK_WRITE_API_KEY, THINGSPEAK_READ_API_KEY, THINGSPEAK_CHANNE
     print("   - THINGSPEAK_CHANNEL_ID")
     exit()
 
-# --- Descarga de Red de Calles (Recurso Compartido) ---
-print("🌍 Descargando red de calles de Santiago desde OpenStreetMap...")
-G = ox.graph_from_place("Santiago, Región Metropolitana, Chile", network_type='drive')
-G_proj = ox.project_graph(G)
-nodes_proj = list(G_proj.nodes())
-print("✅ Red de calles lista.")
+# --- Red de Calles (Recurso Compartido, cacheada en disco) ---
+GRAPH_PLACE = "Santiago, Región Metropolitana, Chile"
+# Si se define, se usa un grafo local (fixture JSON) y no se descarga nada de OpenStreetMap
+GRAPH_FIXTURE = os.getenv("SIM_GRAPH_FIXTURE")
+print("🌍 Cargando red de calles (caché local u OpenStreetMap)...")
+street_graph = load_street_graph(GRAPH_PLACE, network_type='drive', fixture_path=GRAPH_FIXTURE)
+# Rutas sobre el grafo en arrays (CSR), sin armar un grafo de networkx
+graph = CSRGraph.from_street_graph(street_graph)
+route_service = RouteService(graph)
+nodes_proj = street_graph.nodes_proj
+print(f"✅ Red de calles lista ({street_graph.num_nodes} nodos, {street_graph.num_edges} aristas).")
 
 
 # --- Configuración de Simulación (Constantes Globales) ---
@@ -141,22 +147,21 @@ def send_to_thingspeak(api_key, temp, bat, lat, lon, speed, trajectory_str, devi
 
 # --- Clase para gestionar el estado y la lógica de cada dispositivo ---
 class Device:
-    def __init__(self, device_id, graph, projected_graph, projected_nodes):
+    def __init__(self, device_id, routes, projected_nodes):
         self.device_id = device_id
-        self.G = graph
-        self.G_proj = projected_graph
+        self.routes = routes
         self.nodes_proj = projected_nodes
         self.lat = 0.0
         self.lon = 0.0
         self.speed_mps = 0.0
         self.battery = INITIAL_BATTERY
         self.battery_state = "DISCHARGING"
-        self.route = []
+        self.route = None
         self.edge_point_index = 0
         self.trip_id = 0
 
     def update_gps_and_speed_on_streets(self):
-        if not self.route or self.edge_point_index >= len(self.route) - 1:
+        if self.route is None or self.edge_point_index >= self.route.last_index:
             with print_lock:
                 print(f"🗺️  [Dev:{self.device_id}] Generando nueva ruta...")
             self.trip_id = get_new_trip_id()
@@ -164,59 +169,25 @@ class Device:
             destination_node = random.choice(self.nodes_proj)
             while origin_node == destination_node:
                 destination_node = random.choice(self.nodes_proj)
-            try:
-                route_nodes = nx.shortest_path(self.G_proj, origin_node, destination_node, weight='length')
-                self.route = []
-                for u, v in zip(route_nodes[:-1], route_nodes[1:]):
-                    edge_data = self.G_proj.get_edge_data(u, v)
-                    edge = min(edge_data.values(), key=lambda d: d['length'])
-                    if 'geometry' in edge:
-                        self.route.extend(list(edge['geometry'].coords))
-                    else:
-                        self.route.append((self.G_proj.nodes[v]['x'], self.G_proj.nodes[v]['y']))
-                self.edge_point_index = 0
-                start_point_proj = self.route[0]
-                unprojected_point = ox.projection.project_geometry(geom=Point(start_point_proj), crs=self.G_proj.graph['crs'], to_latlong=True)[0]
-                start_lon, start_lat = unprojected_point.x, unprojected_point.y
-                self.lat, self.lon = start_lat, start_lon
-                with print_lock:
-                    print(f"🚦 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta generada. Inicio en: ({self.lat:.5f}, {self.lon:.5f})")
-            except nx.NetworkXNoPath:
+            self.route = self.routes.route(origin_node, destination_node)
+            if self.route is None:
                 with print_lock:
                     print(f"⚠️ [Dev:{self.device_id}] No se encontró ruta. Reintentando...")
                 return self.lat, self.lon, 0, []
+            self.edge_point_index = 0
+            start_lat, start_lon = unproject_coords(self.route.coords[0], self.routes.graph.crs)[0]
+            self.lat, self.lon = float(start_lat), float(start_lon)
+            with print_lock:
+                print(f"🚦 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta generada. Inicio en: ({self.lat:.5f}, {self.lon:.5f})")
         max_speed_mps = MAX_SPEED_KMH * 1000 / 3600
         self.speed_mps = random.uniform(0.5 * max_speed_mps, max_speed_mps)
         distance_to_travel_m = self.speed_mps * UPDATE_INTERVAL
-        trajectory_points_proj = []
-        if self.route:
-            start_point = self.route[self.edge_point_index]
-            trajectory_points_proj.append(start_point)
-        while distance_to_travel_m > 0 and self.edge_point_index < len(self.route) - 1:
-            p1 = self.route[self.edge_point_index]
-            p2 = self.route[self.edge_point_index + 1]
-            segment_dist = math.sqrt((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)
-            if distance_to_travel_m >= segment_dist:
-                distance_to_travel_m -= segment_dist
-                self.edge_point_index += 1
-                trajectory_points_proj.append(p2)
-            else:
-                ratio = distance_to_travel_m / segment_dist
-                final_x = p1[0] + ratio * (p2[0] - p1[0])
-                final_y = p1[1] + ratio * (p2[1] - p1[1])
-                trajectory_points_proj.append((final_x, final_y))
-                distance_to_travel_m = 0
-        if self.edge_point_index >= len(self.route) - 1:
+        self.edge_point_index, trajectory_points_proj = self.route.advance(self.edge_point_index, distance_to_travel_m)
+        if self.edge_point_index >= self.route.last_index:
             with print_lock:
                 print(f"🏁 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta completada.")
-        trajectory_latlon = []
-        if len(trajectory_points_proj) > 1:
-            line_proj = LineString(trajectory_points_proj)
-            line_unproj = ox.projection.project_geometry(geom=line_proj, crs=self.G_proj.graph['crs'], to_latlong=True)[0]
-            trajectory_latlon = [(round(lat, 6), round(lon, 6)) for lon, lat in line_unproj.coords]
-        elif len(trajectory_points_proj) == 1:
-            point_unproj = ox.projection.project_geometry(geom=Point(trajectory_points_proj[0]), crs=self.G_proj.graph['crs'], to_latlong=True)[0]
-            trajectory_latlon = [(round(point_unproj.y, 6), round(point_unproj.x, 6))]
+        trajectory_latlon = [(round(float(lat), 6), round(float(lon), 6))
+                             for lat, lon in unproject_coords(trajectory_points_proj, self.routes.graph.crs)]
         if trajectory_latlon:
             self.lat, self.lon = trajectory_latlon[-1]
         return round(self.lat, 6), round(self.lon, 6), round(self.speed_mps, 2), trajectory_latlon
@@ -274,7 +245,7 @@ if __name__ == "__main__":
     print(f"   Desfase entre dispositivos: {STAGGER_DELAY} segundos.")
     print("   Presiona CTRL+C para detener.")
 
-    devices = [Device(device_id=i+1, graph=G, projected_graph=G_proj, projected_nodes=nodes_proj) for i in range(NUM_DEVICES)]
+    devices = [Device(device_id=i+1, routes=route_service, projected_nodes=nodes_proj) for i in range(NUM_DEVICES)]
     threads = []
 
     for i, device in enumerate(devices):
@@ -1,106 +1,203 @@
 import requests
 import random
 import time
-import math
-from datetime import datetime
-import pytz
 import os
 from dotenv import load_dotenv
 import threading
-import traceback
+import argparse
+import asyncio
 
 # ### Importaciones para el movimiento en calles reales ###
-import osmnx as ox
-import networkx as nx
-import polyline
-from shapely.geometry import Point, LineString
+import numpy as np
+from graph_store import load_street_graph
+from csr_graph import CSRGraph
+from fleet import Fleet
+from routing import RouteService
+from trajectories import PredefinedTrajectories
+from spatial_index import DEFAULT_TRIP_MIN_DISTANCE, DEFAULT_TRIP_MAX_DISTANCE, TripSampler
+from stations import DEFAULT_NUM_STATIONS, StationNetwork, spread_stations
+from contraction import load_hierarchy
+from speed_model import NUM_BUCKETS, SpeedModel
+from projection import unproject_coords
+from polyline_codec import TrajectoryEncoder
+from uplink import (
+    THINGSPEAK_BASE_URL, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL, DEFAULT_MAX_BATCHES_PER_FLUSH,
+    ThingSpeakUplink, make_update,
+)
+from spool import ReadingSpool
+from columnar_sink import DEFAULT_EXPORT_DIR, ColumnarSink
+from sim_clock import (
+    DEFAULT_SLOT_WIDTH, DEFAULT_WHEEL_WORKERS, TimingWheel, WallClock, VirtualClock, VirtualScheduler,
+    parse_start_time, phase_offsets,
+)
+from sharding import ShardedSimulation
+from async_runtime import DEFAULT_CPU_WORKERS, DEFAULT_MAX_CONNECTIONS, AsyncSimulation, AsyncThingSpeakClient
+from feed_mirror import DEFAULT_MIRROR_PATH, FeedMirror
+from trip_ids import DEFAULT_TRIP_ID_PATH, DEFAULT_BLOCK_SIZE, TripIdAllocator
+from sim_log import log, start_logging, stop_logging
+from metrics import (
+    DEFAULT_METRICS_PORT, READINGS, SCHEDULE_LAG_SECONDS, SCHEDULE_OVERRUNS, SPOOL_DEPTH, TICK_SECONDS,
+    UPLOAD_ERRORS, UPLOAD_REJECTIONS, UPLOAD_SECONDS, UPLOADED_READINGS, MetricsServer,
+)
+from sim_model import (
+    UPDATE_INTERVAL, MAX_SPEED_KMH, INITIAL_BATTERY, LOW_BATTERY_THRESHOLD, BATTERY_CHARGE_RATE, SPEED_JITTER,
+    calculate_temperature, get_chile_current_time,
+)
+from energy_model import annotate_graph, battery_drain
 
 # --- Cargar variables de entorno ---
 dotenv_path = os.path.join(os.path.dirname(__file__), '../.env')
 load_dotenv(dotenv_path)
 
+# --- Mensajes y Métricas ---
+# Los mensajes de los hilos se escriben desde una cola (ver sim_log.py), sin un lock global
+start_logging()
+# Métricas en formato Prometheus en http://127.0.0.1:<puerto>/metrics (ver metrics.py); "0" las desactiva
+METRICS_PORT = int(os.getenv("SIM_METRICS_PORT", str(DEFAULT_METRICS_PORT)) or "0")
+
 # --- Configuración ThingSpeak ---
 THINGSPEAK_WRITE_API_KEY = os.getenv("VITE_THINGSPEAK_WRITE_API_KEY")
-THINGSPEAK_API_URL = "https://api.thingspeak.com/update.json"
-UPDATE_INTERVAL = 60 # segundos
+# Se puede apuntar a un servidor local (ver thingspeak_stub.py) para pruebas sin red
+THINGSPEAK_BASE_URL = os.getenv("THINGSPEAK_BASE_URL", THINGSPEAK_BASE_URL)
+THINGSPEAK_API_URL = f"{THINGSPEAK_BASE_URL}/update.json"
+
+# --- Configuración del Envío ---
+# "single": un POST por lectura (update.json). "bulk": lecturas agrupadas en bulk_update.json.
+UPLINK_MODE = os.getenv("SIM_UPLINK", "single")
+UPLINK_BATCH_SIZE = int(os.getenv("SIM_UPLINK_BATCH_SIZE", str(DEFAULT_BATCH_SIZE)))
+UPLINK_FLUSH_INTERVAL = float(os.getenv("SIM_UPLINK_FLUSH_INTERVAL", str(DEFAULT_FLUSH_INTERVAL)))
+UPLINK_MAX_BATCHES = int(os.getenv("SIM_UPLINK_MAX_BATCHES", str(DEFAULT_MAX_BATCHES_PER_FLUSH)))
+# Si se define, cada lectura se guarda en un spool en disco antes de subirse (implica envío por lotes)
+SPOOL_PATH = os.getenv("SIM_SPOOL_PATH")
+# --- Destino de las Lecturas ---
+# "thingspeak": se suben al canal (según SIM_UPLINK). "parquet" / "arrow": se escriben en
+# archivos columnares bajo SIM_EXPORT_DIR sin usar la red (ver columnar_sink.py).
+SINK_KIND = os.getenv("SIM_SINK", "thingspeak")
+EXPORT_DIR = os.getenv("SIM_EXPORT_DIR", DEFAULT_EXPORT_DIR)
+# Codificación de field6: "standalone" (cada lectura trae una Polyline independiente) o
+# "continuous" (cada lectura continúa la del tick anterior del mismo viaje; concatenar los
+# field6 de un viaje, en orden, da la Polyline del viaje completo)
+CONTINUOUS_TRAJECTORIES = os.getenv("SIM_TRAJECTORY_ENCODING", "standalone") == "continuous"
+sink = None # Se crea en el bucle principal: uplink por lotes, spool o exportación columnar
 
 # --- NUEVO: Configuración de Lectura de ThingSpeak ---
 THINGSPEAK_READ_API_KEY = os.getenv("VITE_THINGSPEAK_READ_API_KEY")
 THINGSPEAK_CHANNEL_ID = os.getenv("VITE_THINGSPEAK_CHANNEL_ID")
 
 # --- Verificación de las API Keys ---
-if not all([THINGSPEAK_WRITE_API_KEY, THINGSPEAK_READ_API_KEY, THINGSPEAK_CHANNEL_ID]):
+# (exportando a archivos no se usa ThingSpeak y no hacen falta)
+if SINK_KIND == "thingspeak" and not all([THINGSPEAK_WRITE_API_KEY, THINGSPEAK_READ_API_KEY, THINGSPEAK_CHANNEL_ID]):
     print("🛑 ¡ERROR CRÍTICO! Revisa tu archivo .env. Faltan una o más de estas variables:")
     print("   - THINGSPEAK_WRITE_API_KEY")
     print("   - VITE_THINGSPEAK_READ_API_KEY")
     print("   - THINGSPEAK_CHANNEL_ID")
     exit()
 
-# --- Descarga de Red de Calles (Recurso Compartido) ---
-print("🌍 Descargando red de calles de Santiago desde OpenStreetMap...")
-G = ox.graph_from_place("Valparaiso, Region de Valparaiso, Chile", network_type='drive')
-G_proj = ox.project_graph(G)
-nodes_proj = list(G_proj.nodes())
-print("✅ Red de calles lista.")
-
-
-# --- Configuración de Simulación (Constantes Globaless) ---
-MAX_SPEED_KMH = 25.0
-INITIAL_BATTERY = 100.0
-LOW_BATTERY_THRESHOLD = 10.0
-BATTERY_CHARGE_RATE = 2.5
-ALPHA_WEIBULL_DISCHARGE = 0.25
-BETA_WEIBULL_DISCHARGE = 1.6
-EXTRA_DISCHARGE_MAX_SPEED_FACTOR = 0.5
-CHILE_TZ = pytz.timezone('America/Santiago')
-MIN_TEMP_DAY = 12.0
-MAX_TEMP_DAY = 26.0
-PEAK_TEMP_HOUR = 14.0
-TEMP_STD_DEV = 1.0
-
-# --- Gestión de IDs de Viaje y Bloqueo para Prints ---
-trip_id_counter = 1 # Se inicializará correctamente desde la API
-trip_id_lock = threading.Lock()
-print_lock = threading.Lock()
+# --- Red de Calles (Recurso Compartido, cacheada en disco) ---
+GRAPH_PLACE = "Valparaiso, Region de Valparaiso, Chile"
+# Si se define, se usa un grafo local (fixture JSON) y no se descarga nada de OpenStreetMap
+GRAPH_FIXTURE = os.getenv("SIM_GRAPH_FIXTURE")
+print("🌍 Cargando red de calles (caché local u OpenStreetMap)...")
+street_graph = load_street_graph(GRAPH_PLACE, network_type='drive', fixture_path=GRAPH_FIXTURE)
+graph = CSRGraph.from_street_graph(street_graph)
+nodes_proj = street_graph.nodes_proj
+print(f"✅ Red de calles lista ({street_graph.num_nodes} nodos, {street_graph.num_edges} aristas).")
+
+# --- Energía por Arista (pendiente + superficie, ver energy_model.py) ---
+# Grilla de elevación local (JSON, .npz o GeoTIFF); sin ella se asume terreno plano
+ELEVATION_PATH = os.getenv("SIM_ELEVATION", "")
+# "time" (ruta más rápida a la hora de salida), "length" (más corta) o "energy" (de menor consumo)
+ROUTE_WEIGHT = os.getenv("SIM_ROUTE_WEIGHT", "time")
+edge_energy = annotate_graph(street_graph, graph, ELEVATION_PATH or None)
+print(f"⛰️  Energía por arista lista ({'elevación: ' + ELEVATION_PATH if ELEVATION_PATH else 'terreno plano'}, "
+      f"pendiente máx. {abs(edge_energy.grade).max() * 100:.1f}%).")
+
+# --- Velocidades por Arista y Franja Horaria (maxspeed + semáforos + congestión, ver speed_model.py) ---
+speed_model = SpeedModel(street_graph)
+print(f"🚦 Tablas de velocidad listas ({NUM_BUCKETS} franjas, {speed_model.num_signals} aristas con espera en intersección).")
+
+# --- Jerarquía de Contracción (índice de rutas, ver contraction.py) ---
+# Se preprocesa una vez por grafo y queda junto a su caché (`python contraction.py` la arma por
+# adelantado). Sin ella (SIM_ROUTE_HIERARCHY=0) cada ruta es un A* o Dijkstra sobre la ciudad
+# y no se puede rutear por tiempo de viaje
+USE_ROUTE_HIERARCHY = os.getenv("SIM_ROUTE_HIERARCHY", "1") not in ("", "0")
+if ROUTE_WEIGHT == "time" and not USE_ROUTE_HIERARCHY:
+    print("⚠️  SIM_ROUTE_HIERARCHY=0: sin jerarquía no se rutea por tiempo de viaje; se usan rutas más cortas (length).")
+    ROUTE_WEIGHT = "length"
+route_hierarchy = None
+if USE_ROUTE_HIERARCHY:
+    route_hierarchy = load_hierarchy(street_graph, graph)
+    hierarchy_stats = route_hierarchy.stats()
+    print(f"🏗️  Jerarquía de rutas lista ({hierarchy_stats['arcs']} arcos, profundidad máx. {hierarchy_stats['max_depth']}).")
+
+# --- Servicio de Rutas (caché LRU + rutas precalculadas entre hubs) ---
+ROUTE_CACHE_SIZE = int(os.getenv("SIM_ROUTE_CACHE_SIZE", "4096"))
+# IDs OSM de hubs (estacionamientos/docks) separados por coma; si se definen, los viajes van entre hubs
+ROUTE_HUB_NODES = [int(n) for n in os.getenv("SIM_HUB_NODES", "").split(",") if n.strip()]
+# Viajes aleatorios: destino a esta distancia en línea recta del origen (metros), en su misma componente
+TRIP_MIN_DISTANCE = float(os.getenv("SIM_TRIP_MIN_DISTANCE", str(DEFAULT_TRIP_MIN_DISTANCE)))
+TRIP_MAX_DISTANCE = float(os.getenv("SIM_TRIP_MAX_DISTANCE", str(DEFAULT_TRIP_MAX_DISTANCE)))
+trip_sampler = TripSampler(graph, min_distance=TRIP_MIN_DISTANCE, max_distance=TRIP_MAX_DISTANCE)
+route_service = RouteService(graph, cache_size=ROUTE_CACHE_SIZE, hubs=ROUTE_HUB_NODES, trips=trip_sampler,
+                             weight=ROUTE_WEIGHT, hierarchy=route_hierarchy, speed_model=speed_model)
+if ROUTE_HUB_NODES and ROUTE_WEIGHT == "time":
+    print(f"✅ {len(route_service.hubs)} hubs: sus rutas se precalculan por franja horaria, al personalizar cada una.")
+elif ROUTE_HUB_NODES:
+    print(f"✅ Rutas precalculadas entre {len(route_service.hubs)} hubs.")
+
+# --- Estaciones de Carga (ver stations.py) ---
+# IDs OSM separados por coma; si no se definen se usan los hubs o, si tampoco hay, SIM_NUM_STATIONS
+# nodos repartidos por el mapa. Sin estaciones (SIM_NUM_STATIONS=0) la batería se carga donde se esté
+STATION_NODES = [int(n) for n in os.getenv("SIM_STATION_NODES", "").split(",") if n.strip()]
+NUM_STATIONS = int(os.getenv("SIM_NUM_STATIONS", str(DEFAULT_NUM_STATIONS)))
+STATION_NODES = STATION_NODES or ROUTE_HUB_NODES or spread_stations(graph, NUM_STATIONS, trip_sampler.component)
+station_network = None
+if STATION_NODES:
+    station_network = StationNetwork(graph, STATION_NODES, weight=ROUTE_WEIGHT, grid=trip_sampler.grid)
+    print(f"🔌 {station_network.num_stations} estaciones de carga "
+          f"(alcanzables desde el {station_network.stats()['reachable_nodes']:.0%} de los nodos).")
+
+
+# --- Gestión de IDs de Viaje ---
+# El último ID usado se guarda en disco (ver trip_ids.py): arrancar no requiere consultar
+# ThingSpeak y varios procesos pueden compartir el mismo archivo sin repetir IDs.
+TRIP_ID_PATH = os.getenv("SIM_TRIP_ID_PATH", DEFAULT_TRIP_ID_PATH)
+TRIP_ID_BLOCK_SIZE = int(os.getenv("SIM_TRIP_ID_BLOCK_SIZE", str(DEFAULT_BLOCK_SIZE)))
+# Si se define, al iniciar se busca el último ID en el canal y se ajusta el contador local
+# (siempre se hace la primera vez, cuando el contador local está en 0)
+RECONCILE_TRIP_IDS = os.getenv("SIM_RECONCILE_TRIP_IDS", "") not in ("", "0")
+# Espejo local de los feeds del canal que usa la reconciliación (y feed_mirror.py para los viajes)
+FEED_MIRROR_PATH = os.getenv("SIM_FEED_MIRROR_PATH", DEFAULT_MIRROR_PATH)
+trip_ids = TripIdAllocator(TRIP_ID_PATH, block_size=TRIP_ID_BLOCK_SIZE)
+
+# --- Reloj de Simulación (ver sim_clock.py) ---
+# Por defecto la hora real; en el bucle principal se cambia por un reloj virtual si se pide
+# --speedup o --as-fast-as-possible (o SIM_SPEEDUP = factor / "max").
+clock = WallClock()
 
 def get_new_trip_id():
     """Genera un ID de viaje único de forma segura para los hilos."""
-    global trip_id_counter
-    with trip_id_lock:
-        trip_id = trip_id_counter
-        trip_id_counter += 1
-        return trip_id
+    return trip_ids.next_id()
 
-# --- NUEVO: Función para leer el último ID de viaje desde ThingSpeak ---
+# --- Reconciliación (opcional) del último ID de viaje con ThingSpeak ---
 def get_latest_trip_id_from_thingspeak(channel_id, api_key):
-    """Consulta la API de ThingSpeak para encontrar el ID de viaje más alto utilizado."""
+    """
+    Busca el ID de viaje más alto utilizado en el canal. Las entradas se guardan en un
+    espejo local (ver feed_mirror.py): cada consulta sólo baja las que llegaron desde la anterior.
+    """
     print("🔍 Consultando ThingSpeak para obtener el último ID de viaje utilizado...")
-    # Leemos específicamente el campo 8 para ser más eficientes
-    url = f"https://api.thingspeak.com/channels/{channel_id}/fields/8.json"
-    params = {'api_key': api_key, 'results': 8000} # Máximo de resultados por petición
+    mirror = FeedMirror(channel_id, api_key, path=FEED_MIRROR_PATH, base_url=THINGSPEAK_BASE_URL,
+                        continuous=CONTINUOUS_TRAJECTORIES)
     try:
-        response = requests.get(url, params=params, timeout=20)
-        response.raise_for_status()
-        data = response.json()
-        feeds = data.get('feeds', [])
-
-        if not feeds:
-            print("📊 El canal está vacío o no tiene datos en field8. Empezando los viajes desde el ID 1.")
-            return 0
-
-        max_trip_id = 0
-        for feed in feeds:
-            trip_id_str = feed.get('field8')
-            if trip_id_str and trip_id_str.isdigit():
-                trip_id = int(trip_id_str)
-                if trip_id > max_trip_id:
-                    max_trip_id = trip_id
-        
+        new_entries = mirror.sync()
+        max_trip_id = mirror.latest_trip_id()
+        print(f"🔄 Espejo local del canal al día ({new_entries} entradas nuevas, última: {mirror.last_entry_id()}).")
+
         if max_trip_id > 0:
             print(f"✅ Último ID de viaje encontrado en el canal: {max_trip_id}")
         else:
-              print("📊 No se encontraron IDs de viaje válidos. Empezando desde el ID 1.")
-        
+            print("📊 El canal está vacío o no tiene IDs de viaje válidos. Empezando los viajes desde el ID 1.")
+
         return max_trip_id
 
     except requests.exceptions.RequestException as e:
@@ -110,182 +207,190 @@ def get_latest_trip_id_from_thingspeak(channel_id, api_key):
     except ValueError:
         print("❌ Error crítico: La respuesta de ThingSpeak no es un JSON válido.")
         exit()
+    finally:
+        mirror.close()
 
 
 # --- Funciones Auxiliares Globales ---
-def get_chile_current_time():
-    return datetime.now(CHILE_TZ)
-
-def calculate_temperature(chile_time):
-    hour_float = chile_time.hour + chile_time.minute / 60.0
-    mean_daily_temp = (MIN_TEMP_DAY + MAX_TEMP_DAY) / 2.0
-    amplitude = (MAX_TEMP_DAY - MIN_TEMP_DAY) / 2.0
-    temp_cycle = math.cos(2 * math.pi * (hour_float - PEAK_TEMP_HOUR) / 24.0)
-    target_temp = mean_daily_temp + amplitude * temp_cycle
-    simulated_temp = random.gauss(target_temp, TEMP_STD_DEV)
-    return round(simulated_temp, 2)
-
 def send_to_thingspeak(api_key, temp, bat, lat, lon, speed, trajectory_str, device_id, trip_id):
     payload = {'api_key': api_key, 'field1': temp, 'field2': bat, 'field3': lat, 'field4': lon, 'field5': speed, 'field6': trajectory_str, 'field7': device_id, 'field8': trip_id}
     try:
-        response = requests.post(THINGSPEAK_API_URL, data=payload, timeout=10)
+        with UPLOAD_SECONDS.labels('single').time():
+            response = requests.post(THINGSPEAK_API_URL, data=payload, timeout=10)
         response.raise_for_status()
-        with print_lock:
-            if response.text == "0":
-                print(f"❌ [Dev:{device_id}] Error: ThingSpeak rechazó la actualización (demasiado rápido).")
-            else:
-                print(f"✅ [Dev:{device_id}/Viaje:{trip_id}] Datos enviados. ID Entrada: {response.text}. Pos:({lat:.5f},{lon:.5f})")
+        if response.text == "0":
+            UPLOAD_REJECTIONS.labels('single').inc()
+            log.warning(f"❌ [Dev:{device_id}] Error: ThingSpeak rechazó la actualización (demasiado rápido).")
+        else:
+            UPLOADED_READINGS.labels('single').inc()
+            log.info(f"✅ [Dev:{device_id}/Viaje:{trip_id}] Datos enviados. ID Entrada: {response.text}. Pos:({lat:.5f},{lon:.5f})")
     except requests.exceptions.RequestException as e:
-        with print_lock:
-            print(f"❌ [Dev:{device_id}] Error de conexión con ThingSpeak: {e}")
+        UPLOAD_ERRORS.labels('single').inc()
+        log.error(f"❌ [Dev:{device_id}] Error de conexión con ThingSpeak: {e}")
+
+def publish_reading(temp, bat, lat, lon, speed, trajectory_str, device_id, trip_id, chile_time):
+    """Entrega una lectura al destino configurado (`sink`), o la envía directamente a ThingSpeak."""
+    publish_update(make_update(temp, bat, lat, lon, speed, trajectory_str, device_id, trip_id, chile_time.isoformat()))
+
+def publish_update(update):
+    """Como `publish_reading`, para una lectura ya armada con `make_update`."""
+    if sink is not None:
+        sink.submit(update)
+    else:
+        send_to_thingspeak(THINGSPEAK_WRITE_API_KEY, *(update[f'field{k}'] for k in range(1, 9)))
+
+def track_schedule_lag(engine, scheduled):
+    """
+    Registra cuánto se atrasó el tick programado para `scheduled` (time.monotonic). Si el
+    atraso supera un intervalo, los ticks perdidos no se recuperan en ráfaga: devuelve la
+    hora actual como nueva referencia del calendario.
+    """
+    now = time.monotonic()
+    lag = max(0.0, now - scheduled)
+    SCHEDULE_LAG_SECONDS.labels(engine).observe(lag)
+    return now if lag > UPDATE_INTERVAL else scheduled
+
+# --- Contexto Compartido de los Dispositivos ---
+class DeviceContext:
+    """
+    Recursos de solo lectura comunes a todos los dispositivos: la red de calles, los nodos
+    de origen de los viajes, las estaciones de carga, las tablas de velocidad y las
+    trayectorias predefinidas (se asignan en el bucle principal). Los dispositivos los leen
+    de aquí en vez de guardar una referencia cada uno.
+    """
+
+    __slots__ = ('graph', 'nodes_proj', 'stations', 'speed_model', 'predefined')
+
+    def __init__(self, graph, nodes_proj, stations=None, speed_model=None, predefined=None):
+        self.graph = graph
+        self.nodes_proj = nodes_proj
+        self.stations = stations
+        self.speed_model = speed_model
+        self.predefined = predefined
+
+device_context = DeviceContext(graph, nodes_proj, station_network, speed_model)
+# En modo "standalone" el codificador no guarda estado y lo comparten todos los dispositivos
+standalone_encoder = TrajectoryEncoder(0)
 
 # --- Clase para gestionar el estado y la lógica de cada dispositivo ---
 class Device:
-    def __init__(self, device_id, graph, projected_graph, projected_nodes, predefined_trajectory_encoded=None):
+    """
+    Estado de un dispositivo en `__slots__` (sin `__dict__`). Lo que pesa se crea recién en
+    el primer tick: el generador aleatorio (~2.5 KB) y, en modo continuo, el codificador de
+    trayectorias. La ruta es una `Route` compartida del caché de `route_service`.
+    """
+
+    __slots__ = ('device_id', 'seed', '_rng', 'lat', 'lon', 'speed_mps', 'battery', 'battery_state',
+                 'route', 'edge_point_index', 'tick_energy', 'station', 'trip_id', 'predefined', '_encoder')
+
+    def __init__(self, device_id, predefined=False, seed=None):
         self.device_id = device_id
-        self.G = graph
-        self.G_proj = projected_graph
-        self.nodes_proj = projected_nodes
+        # Generador propio: con semilla, la secuencia de rutas y lecturas del dispositivo es reproducible
+        self.seed = seed
+        self._rng = None
         self.lat = 0.0
         self.lon = 0.0
         self.speed_mps = 0.0
         self.battery = INITIAL_BATTERY
         self.battery_state = "DISCHARGING"
-        self.route = []
+        self.route = None
         self.edge_point_index = 0
+        # Energía (Wh) gastada en el último tick, según el perfil de energía de la ruta
+        self.tick_energy = 0.0
+        # Estación a la que va ("TO_STATION") o en la que está cargando ("CHARGING"); -1 si ninguna
+        self.station = -1
         self.trip_id = 0
-        self.predefined_trajectory_encoded = predefined_trajectory_encoded
-        self.predefined_trajectory_coords = []
-        if self.predefined_trajectory_encoded:
-            # Decodificar la trayectoria predefinida a coordenadas lat/lon
-            self.predefined_trajectory_coords = polyline.decode(self.predefined_trajectory_encoded, precision=5)
-            # Invertir a lon/lat para que coincida con el formato de OpenStreetMapX (x, y) que es (lon, lat)
-            self.predefined_trajectory_proj = [ox.projection.project_geometry(geom=Point(lon, lat), crs='epsg:4326', to_latlong=False)[0].coords[0] for lat, lon in self.predefined_trajectory_coords]
+        # Si recorre tramos de las trayectorias predefinidas (`device_context.predefined`)
+        self.predefined = predefined
+        self._encoder = None
+
+    @property
+    def rng(self):
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng
+
+    @property
+    def trajectory_encoder(self):
+        if not CONTINUOUS_TRAJECTORIES:
+            return standalone_encoder
+        if self._encoder is None:
+            self._encoder = TrajectoryEncoder(1, continuous=True)
+        return self._encoder
 
     def get_sub_trajectory(self):
-        # Aseguramos que haya al menos 10 puntos en la trayectoria principal para generar una subtrayectoria.
-        min_points = 10
-        if not self.predefined_trajectory_proj or len(self.predefined_trajectory_proj) < min_points:
-            return []
-
-        # Elige un inicio aleatorio para la subtrayectoria
-        start_index = random.randint(0, len(self.predefined_trajectory_proj) - min_points)
-        # Elige un fin aleatorio para la subtrayectoria, asegurando al menos `min_points`
-        end_index = random.randint(start_index + min_points -1, len(self.predefined_trajectory_proj) -1)
-
-        # Genera la subtrayectoria en el orden original
-        sub_trajectory_proj = self.predefined_trajectory_proj[start_index : end_index + 1]
-        
-        # Opcional: Para el caso de "5,4,3,2", que es una subtrayectoria invertida
-        # Si se quiere permitir invertir, se podría agregar una lógica aquí:
-        # if random.random() < 0.5: # 50% de probabilidad de invertir la subtrayectoria
-        #    sub_trajectory_proj.reverse()
-
-        return sub_trajectory_proj
-
-
-    def update_gps_and_speed_on_streets(self):
-        if not self.route or self.edge_point_index >= len(self.route) - 1:
-            with print_lock:
-                print(f"🗺️  [Dev:{self.device_id}] Generando nueva ruta...")
+        """Tramo al azar de una trayectoria predefinida (al menos 10 puntos originales), como `Route`."""
+        return device_context.predefined.sample(self.rng)
+
+
+    def random_street_route(self, chile_time):
+        """
+        Ruta más corta (`Route` compartida) entre dos nodos (o hubs) distintos al azar saliendo a
+        la hora `chile_time`, o `None` si no hay camino.
+        """
+        return route_service.random_route(self.rng, device_context.nodes_proj, bucket=SpeedModel.bucket(chile_time))
+
+    def update_gps_and_speed_on_streets(self, chile_time=None):
+        self.tick_energy = 0.0
+        if self.battery_state == "CHARGING" and self.station >= 0:
+            # Cargando en una estación: queda detenido
+            return self.lat, self.lon, 0, []
+        chile_time = chile_time or get_chile_current_time()
+        if self.route is None or self.edge_point_index >= self.route.last_index:
+            log.info(f"🗺️  [Dev:{self.device_id}] Generando nueva ruta...")
             self.trip_id = get_new_trip_id()
 
-            if self.device_id == 2 and self.predefined_trajectory_encoded:
-                # Para el dispositivo 2, usa la subtrayectoria predefinida
-                self.route = self.get_sub_trajectory()
-                if not self.route:
-                    with print_lock:
-                        print(f"⚠️ [Dev:{self.device_id}] No se pudo generar una subtrayectoria válida. Reintentando con ruta aleatoria.")
-                    # Si no se puede generar una subtrayectoria, vuelve a una ruta aleatoria.
-                    origin_node = random.choice(self.nodes_proj)
-                    destination_node = random.choice(self.nodes_proj)
-                    while origin_node == destination_node:
-                        destination_node = random.choice(self.nodes_proj)
-                    try:
-                        route_nodes = nx.shortest_path(self.G_proj, origin_node, destination_node, weight='length')
-                        self.route = []
-                        for u, v in zip(route_nodes[:-1], route_nodes[1:]):
-                            edge_data = self.G_proj.get_edge_data(u, v)
-                            edge = min(edge_data.values(), key=lambda d: d['length'])
-                            if 'geometry' in edge:
-                                self.route.extend(list(edge['geometry'].coords))
-                            else:
-                                self.route.append((self.G_proj.nodes[v]['x'], self.G_proj.nodes[v]['y']))
-                    except nx.NetworkXNoPath:
-                        with print_lock:
-                            print(f"⚠️ [Dev:{self.device_id}] No se encontró ruta aleatoria. Reintentando...")
-                        return self.lat, self.lon, 0, []
-            else:
+            new_route = None
+            if self.predefined and device_context.predefined is not None:
+                # Dispositivos con trayectoria predefinida: un tramo de ella
+                new_route = self.get_sub_trajectory()
+                if new_route is None:
+                    log.warning(f"⚠️ [Dev:{self.device_id}] No se pudo generar una subtrayectoria válida. Reintentando con ruta aleatoria.")
+            if new_route is None:
                 # Para otros dispositivos o si falla la ruta predefinida, genera una ruta aleatoria
-                origin_node = random.choice(self.nodes_proj)
-                destination_node = random.choice(self.nodes_proj)
-                while origin_node == destination_node:
-                    destination_node = random.choice(self.nodes_proj)
-                try:
-                    route_nodes = nx.shortest_path(self.G_proj, origin_node, destination_node, weight='length')
-                    self.route = []
-                    for u, v in zip(route_nodes[:-1], route_nodes[1:]):
-                        edge_data = self.G_proj.get_edge_data(u, v)
-                        edge = min(edge_data.values(), key=lambda d: d['length'])
-                        if 'geometry' in edge:
-                            self.route.extend(list(edge['geometry'].coords))
-                        else:
-                            self.route.append((self.G_proj.nodes[v]['x'], self.G_proj.nodes[v]['y']))
-                except nx.NetworkXNoPath:
-                    with print_lock:
-                        print(f"⚠️ [Dev:{self.device_id}] No se encontró ruta. Reintentando...")
+                new_route = self.random_street_route(chile_time)
+                if new_route is None:
+                    log.warning(f"⚠️ [Dev:{self.device_id}] No se encontró ruta. Reintentando...")
                     return self.lat, self.lon, 0, []
 
             self.edge_point_index = 0
+            self.route = new_route
             if self.route:
-                start_point_proj = self.route[0]
-                unprojected_point = ox.projection.project_geometry(geom=Point(start_point_proj), crs=self.G_proj.graph['crs'], to_latlong=True)[0]
-                start_lon, start_lat = unprojected_point.x, unprojected_point.y
-                self.lat, self.lon = start_lat, start_lon
-                with print_lock:
-                    print(f"🚦 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta generada. Inicio en: ({self.lat:.5f}, {self.lon:.5f})")
+                start_lat, start_lon = unproject_coords(self.route.coords[0], device_context.graph.crs)[0]
+                self.lat, self.lon = float(start_lat), float(start_lon)
+                log.info(f"🚦 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta generada. Inicio en: ({self.lat:.5f}, {self.lon:.5f})")
             else:
                 return self.lat, self.lon, 0, []
 
 
-        max_speed_mps = MAX_SPEED_KMH * 1000 / 3600
-        self.speed_mps = random.uniform(0.5 * max_speed_mps, max_speed_mps)
-        distance_to_travel_m = self.speed_mps * UPDATE_INTERVAL
-        trajectory_points_proj = []
-        if self.route:
-            start_point = self.route[self.edge_point_index]
-            trajectory_points_proj.append(start_point)
-
-        while distance_to_travel_m > 0 and self.edge_point_index < len(self.route) - 1:
-            p1 = self.route[self.edge_point_index]
-            p2 = self.route[self.edge_point_index + 1]
-            segment_dist = math.sqrt((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)
-            if distance_to_travel_m >= segment_dist:
-                distance_to_travel_m -= segment_dist
-                self.edge_point_index += 1
-                trajectory_points_proj.append(p2)
-            else:
-                ratio = distance_to_travel_m / segment_dist
-                final_x = p1[0] + ratio * (p2[0] - p1[0])
-                final_y = p1[1] + ratio * (p2[1] - p1[1])
-                trajectory_points_proj.append((final_x, final_y))
-                distance_to_travel_m = 0
-
-        if self.edge_point_index >= len(self.route) - 1:
-            with print_lock:
-                print(f"🏁 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta completada.")
-        
-        trajectory_latlon = []
-        if len(trajectory_points_proj) > 1:
-            line_proj = LineString(trajectory_points_proj)
-            line_unproj = ox.projection.project_geometry(geom=line_proj, crs=self.G_proj.graph['crs'], to_latlong=True)[0]
-            trajectory_latlon = [(round(lat, 6), round(lon, 6)) for lon, lat in line_unproj.coords]
-        elif len(trajectory_points_proj) == 1:
-            point_unproj = ox.projection.project_geometry(geom=Point(trajectory_points_proj[0]), crs=self.G_proj.graph['crs'], to_latlong=True)[0]
-            trajectory_latlon = [(round(point_unproj.y, 6), round(point_unproj.x, 6))]
+        model = device_context.speed_model
+        if model is None:
+            max_speed_mps = MAX_SPEED_KMH * 1000 / 3600
+            self.speed_mps = self.rng.uniform(0.5 * max_speed_mps, max_speed_mps)
+            distance_to_travel_m = self.speed_mps * UPDATE_INTERVAL
+        else:
+            # Tiempos de la ruta en la franja horaria actual (tablas por arista: maxspeed,
+            # congestión y esperas en intersecciones); se sortea sólo un factor sobre el intervalo
+            factor = self.rng.uniform(1 - SPEED_JITTER, 1 + SPEED_JITTER)
+            times = self.route.travel_times(model, model.bucket(chile_time))
+            distance_to_travel_m = self.route.distance_in(self.edge_point_index, UPDATE_INTERVAL * factor, times)
+            self.speed_mps = distance_to_travel_m / UPDATE_INTERVAL
+        self.tick_energy = self.route.energy_used(self.edge_point_index, distance_to_travel_m)
+        # Búsqueda binaria sobre la distancia acumulada: el costo no depende de la densidad de la ruta
+        self.edge_point_index, trajectory_points_proj = self.route.advance(self.edge_point_index, distance_to_travel_m)
+
+        if self.edge_point_index >= self.route.last_index:
+            log.info(f"🏁 [Dev:{self.device_id}/Viaje:{self.trip_id}] Ruta completada.")
+            if self.battery_state == "TO_STATION":
+                self.battery_state = "CHARGING"
+                log.info(f"🔌 [Dev:{self.device_id}] Llegó a la estación {device_context.stations.station_nodes[self.station]}. Cargando...")
         
-        if trajectory_latlon:
-            self.lat, self.lon = trajectory_latlon[-1]
+        # Una sola transformación vectorizada para toda la trayectoria del tick
+        # (se devuelve sin redondear: el codificador Polyline cuantiza una sola vez)
+        trajectory_latlon = unproject_coords(trajectory_points_proj, device_context.graph.crs)
+
+        if len(trajectory_latlon):
+            self.lat, self.lon = float(trajectory_latlon[-1, 0]), float(trajectory_latlon[-1, 1])
         return round(self.lat, 6), round(self.lon, 6), round(self.speed_mps, 2), trajectory_latlon
 
     def update_battery(self):
@@ -294,78 +399,306 @@ class Device:
             if self.battery >= INITIAL_BATTERY:
                 self.battery = INITIAL_BATTERY
                 self.battery_state = "DISCHARGING"
-        elif self.battery_state == "DISCHARGING":
-            weibull_component = random.weibullvariate(ALPHA_WEIBULL_DISCHARGE, BETA_WEIBULL_DISCHARGE)
-            max_speed_mps_calc = MAX_SPEED_KMH * 1000 / 3600
-            speed_factor = (self.speed_mps / max_speed_mps_calc) if max_speed_mps_calc > 0 else 0
-            speed_discharge = speed_factor * EXTRA_DISCHARGE_MAX_SPEED_FACTOR
-            total_discharge = weibull_component + speed_discharge
-            self.battery -= total_discharge
-            if self.battery <= LOW_BATTERY_THRESHOLD:
+                self.station = -1
+        else:
+            # Energía de tracción del tramo recorrido (pendiente y superficie) + consumo fijo
+            self.battery -= battery_drain(self.tick_energy, UPDATE_INTERVAL)
+            if self.battery_state == "DISCHARGING" and self.battery <= LOW_BATTERY_THRESHOLD:
                 self.battery = max(0, self.battery)
-                self.battery_state = "CHARGING"
+                self.go_to_station()
         self.battery = round(max(0.0, min(INITIAL_BATTERY, self.battery)), 1)
         return self.battery, self.battery_state
 
-    def run_simulation(self):
+    def go_to_station(self):
+        """Batería baja: ruta (un viaje nuevo) a la estación más cercana o, si no hay ninguna alcanzable, carga donde está."""
+        self.battery_state = "CHARGING"
+        stations = device_context.stations
+        if stations is None or self.route is None:
+            return
+        x, y = self.route.coords[min(self.edge_point_index, self.route.last_index)]
+        station, routes = stations.dispatch([x], [y])
+        self.station = int(station[0])
+        if routes[0] is not None:
+            self.route = routes[0]
+            self.edge_point_index = 0
+            self.trip_id = get_new_trip_id()
+            self.battery_state = "TO_STATION"
+            log.info(f"🪫 [Dev:{self.device_id}/Viaje:{self.trip_id}] Batería baja ({self.battery:.1f}%): "
+                     f"rumbo a la estación {stations.station_nodes[self.station]}.")
+
+    def tick(self, chile_time):
+        """Genera y publica una lectura para la hora `chile_time`."""
+        with TICK_SECONDS.labels('threads').time():
+            publish_update(self.reading(chile_time))
+        READINGS.labels('threads').inc()
+
+    def reading(self, chile_time):
+        """Genera la lectura para la hora `chile_time` (diccionario de `make_update`) sin publicarla."""
+        temperatura_actual = calculate_temperature(chile_time, self.rng)
+        lat_actual, lon_actual, velocidad_actual_mps, trayectoria = self.update_gps_and_speed_on_streets(chile_time)
+        # La lectura es del viaje recorrido en este tick, aunque la batería baja abra uno nuevo
+        trip_id = self.trip_id
+        bateria_actual, _ = self.update_battery()
+        trayectoria = np.asarray(trayectoria, dtype=np.float64).reshape(-1, 2)
+        encoded_trajectory = self.trajectory_encoder.encode(trayectoria[:, 0], trayectoria[:, 1], (0, len(trayectoria)), (trip_id,))[0]
+        return make_update(temperatura_actual, bateria_actual, lat_actual, lon_actual, velocidad_actual_mps, encoded_trajectory, self.device_id, trip_id, chile_time.isoformat())
+
+# --- Motor por dispositivo: una rueda de tiempo despacha los ticks (ver sim_clock.TimingWheel) ---
+def device_task(device):
+    """Tarea de la rueda para un dispositivo: registra su atraso y ejecuta su tick."""
+    lag_histogram = SCHEDULE_LAG_SECONDS.labels('threads')
+
+    def task(lag):
+        lag_histogram.observe(lag)
         try:
-            while True:
-                chile_time = get_chile_current_time()
-                temperatura_actual = calculate_temperature(chile_time)
-                lat_actual, lon_actual, velocidad_actual_mps, trayectoria = self.update_gps_and_speed_on_streets()
-                bateria_actual, _ = self.update_battery()
-                encoded_trajectory = polyline.encode(trayectoria, precision=5) if len(trayectoria) > 1 else ""
-                send_to_thingspeak(THINGSPEAK_WRITE_API_KEY, temperatura_actual, bateria_actual, lat_actual, lon_actual, velocidad_actual_mps, encoded_trajectory, self.device_id, self.trip_id)
-                time.sleep(UPDATE_INTERVAL)
+            device.tick(clock.now())
         except Exception as e:
-            with print_lock:
-                print(f"\n💥 [Dev:{self.device_id}] Ocurrió un error inesperado en el hilo: {e}")
-                traceback.print_exc()
+            # El dispositivo sigue en la rueda: se reintenta en su próxima ranura
+            log.exception(f"\n💥 [Dev:{device.device_id}] Ocurrió un error inesperado en el tick: {e}")
+
+    task.device_id = device.device_id
+    return task
+
+def report_overrun(task, kind):
+    SCHEDULE_OVERRUNS.labels(kind).inc()
+    if kind == "busy":
+        log.warning(f"⏳ [Dev:{task.device_id}] El tick anterior aún no termina: se salta esta vuelta.")
+
+# --- Motor vectorizado: toda la flota avanza en un solo hilo ---
+def publish_fleet_tick(fleet, chile_time):
+    """Avanza la flota un tick y publica la lectura de cada dispositivo."""
+    with TICK_SECONDS.labels('fleet').time():
+        tick = fleet.step(chile_time)
+        if isinstance(sink, ColumnarSink):
+            # El tick ya viene en columnas: se exporta sin armar un diccionario por lectura
+            sink.submit_columns(chile_time, tick.temperature, tick.battery, tick.lat, tick.lon, tick.speed,
+                                fleet.encoded_trajectories(tick), tick.device_id, tick.trip_id)
+            READINGS.labels('fleet').inc(fleet.num_devices)
+            return
+        for i, encoded_trajectory in enumerate(fleet.encoded_trajectories(tick)):
+            publish_reading(float(tick.temperature[i]), float(tick.battery[i]), float(tick.lat[i]), float(tick.lon[i]),
+                            float(tick.speed[i]), encoded_trajectory, int(tick.device_id[i]), int(tick.trip_id[i]), chile_time)
+    READINGS.labels('fleet').inc(fleet.num_devices)
+
+def make_fleet(num_devices, seed=None, predefined=None, predefined_devices=()):
+    return Fleet.from_graph(graph, nodes_proj, num_devices, seed=seed, route_service=route_service, new_trip_id=get_new_trip_id,
+                            predefined=predefined, predefined_devices=predefined_devices,
+                            continuous_trajectories=CONTINUOUS_TRAJECTORIES, stations=station_network,
+                            speed_model=speed_model)
+
+def run_fleet_simulation(fleet):
+    """Avanza en tiempo real la flota ya armada (con sus trayectorias predefinidas) cada intervalo."""
+    next_tick = time.monotonic()
+    try:
+        while True:
+            next_tick = track_schedule_lag('fleet', next_tick)
+            publish_fleet_tick(fleet, clock.now())
+            next_tick += UPDATE_INTERVAL
+            clock.sleep(next_tick - time.monotonic())
+    except Exception as e:
+        log.exception(f"\n💥 [Flota] Ocurrió un error inesperado en el motor vectorizado: {e}")
+
+# --- Tiempo virtual: todos los dispositivos en un solo hilo, en orden determinista ---
+def run_virtual_simulation(engine, devices, fleet, duration=None):
+    """Ejecuta la simulación sobre el reloj virtual hasta `duration` segundos simulados."""
+    scheduler = VirtualScheduler(clock)
+    if engine == "fleet":
+        scheduler.schedule(0.0, lambda now: publish_fleet_tick(fleet, now) or UPDATE_INTERVAL)
+    else:
+        # Mismas fases que la rueda de tiempo: repartidas parejo en el intervalo
+        for device, phase in zip(devices, phase_offsets(len(devices), UPDATE_INTERVAL)):
+            scheduler.schedule(phase, lambda now, device=device: device.tick(now) or UPDATE_INTERVAL)
+    scheduler.run(duration)
+
+# --- Motor asyncio: ranuras de dispositivos como corrutinas (ver async_runtime.py) ---
+async def run_async_simulation(devices, max_connections=DEFAULT_MAX_CONNECTIONS, cpu_workers=DEFAULT_CPU_WORKERS,
+                               slot_width=DEFAULT_SLOT_WIDTH):
+    """Ejecuta los dispositivos en el event loop hasta que se cancele (CTRL+C)."""
+    options = dict(clock=clock, slot_width=slot_width, cpu_workers=cpu_workers)
+    if sink is not None:
+        await AsyncSimulation(devices, UPDATE_INTERVAL, sink=sink, **options).run()
+        return
+    async with AsyncThingSpeakClient(THINGSPEAK_BASE_URL, THINGSPEAK_WRITE_API_KEY, max_connections=max_connections) as client:
+        await AsyncSimulation(devices, UPDATE_INTERVAL, client=client, **options).run()
 
 # --- Bucle Principal ---
 if __name__ == "__main__":
-    # --- NUEVO: Inicializar el contador de viajes desde ThingSpeak ---
-    latest_trip_id = get_latest_trip_id_from_thingspeak(THINGSPEAK_CHANNEL_ID, THINGSPEAK_READ_API_KEY)
-    trip_id_counter = latest_trip_id + 1
-    
+    parser = argparse.ArgumentParser(description="Simulador de flota de bicicletas para ThingSpeak.")
+    parser.add_argument("--speedup", type=float, default=None,
+                        help="Tiempo virtual: segundos simulados por segundo real (p. ej. 60).")
+    parser.add_argument("--as-fast-as-possible", action="store_true",
+                        help="Tiempo virtual sin esperas: genera los datos tan rápido como se pueda.")
+    parser.add_argument("--start", default=os.getenv("SIM_START_TIME"),
+                        help="Hora inicial simulada (ISO 8601, hora de Chile). Por defecto, ahora.")
+    parser.add_argument("--duration", type=float, default=float(os.getenv("SIM_DURATION_HOURS", "0")) or None,
+                        help="Horas simuladas antes de terminar (sólo en tiempo virtual).")
+    parser.add_argument("--seed", type=int, default=int(os.getenv("SIM_SEED")) if os.getenv("SIM_SEED") else None,
+                        help="Semilla para reproducir la misma simulación.")
+    args = parser.parse_args()
+    speedup_env = os.getenv("SIM_SPEEDUP", "")
+    if args.as_fast_as_possible or speedup_env == "max":
+        clock = VirtualClock(parse_start_time(args.start) if args.start else None)
+    elif args.speedup or speedup_env:
+        clock = VirtualClock(parse_start_time(args.start) if args.start else None, speedup=args.speedup or float(speedup_env))
+
+    # Sólo se consulta el canal si se pide o si el contador local aún no existe (primer arranque con ThingSpeak)
+    if RECONCILE_TRIP_IDS or (trip_ids.high_water_mark() == 0 and SINK_KIND == "thingspeak"):
+        latest_trip_id = get_latest_trip_id_from_thingspeak(THINGSPEAK_CHANNEL_ID, THINGSPEAK_READ_API_KEY)
+        trip_ids.reconcile(latest_trip_id)
+
     print("-" * 50)
     print(f"🚀 INICIO DE SIMULACIÓN 🚀")
-    print(f"    Los nuevos viajes comenzarán desde el ID: {trip_id_counter}")
+    print(f"    Los nuevos viajes comenzarán después del ID: {trip_ids.high_water_mark()} (bloques de {trip_ids.block_size})")
     print("-" * 50)
 
-    NUM_DEVICES = 2
-    STAGGER_DELAY = UPDATE_INTERVAL/2
-
-    print(f"    Iniciando simulación para {NUM_DEVICES} dispositivos...")
+    NUM_DEVICES = int(os.getenv("SIM_NUM_DEVICES", "2"))
+    # "threads": un objeto Device por dispositivo; sus ticks los despacha una rueda de tiempo. "fleet": toda la flota en el motor vectorizado de fleet.py.
+    # "processes": la flota repartida por regiones del mapa en SIM_WORKERS procesos (ver sharding.py).
+    # "asyncio": objetos Device como en "threads", pero en un event loop: cada ranura de fase es una corrutina
+    # y los POST van por un cliente HTTP asíncrono (aiohttp) con SIM_ASYNC_CONNECTIONS conexiones (ver async_runtime.py).
+    SIM_ENGINE = os.getenv("SIM_ENGINE", "threads")
+    SIM_WORKERS = int(os.getenv("SIM_WORKERS", str(os.cpu_count() or 1)))
+    # Rueda de tiempo: ancho de cada ranura (segundos) e hilos que ejecutan los ticks (y los POST)
+    SCHEDULER_SLOT_WIDTH = float(os.getenv("SIM_SCHEDULER_SLOT", str(DEFAULT_SLOT_WIDTH)))
+    SCHEDULER_WORKERS = int(os.getenv("SIM_SCHEDULER_WORKERS", str(DEFAULT_WHEEL_WORKERS)))
+    # Motor asyncio: POST simultáneos e hilos que generan las lecturas (rutas, GPS)
+    ASYNC_CONNECTIONS = int(os.getenv("SIM_ASYNC_CONNECTIONS", str(DEFAULT_MAX_CONNECTIONS)))
+    ASYNC_CPU_WORKERS = int(os.getenv("SIM_ASYNC_CPU_WORKERS", str(DEFAULT_CPU_WORKERS)))
+
+    print(f"    Iniciando simulación para {NUM_DEVICES} dispositivos (motor: {SIM_ENGINE})...")
     print(f"    Intervalo de actualización por dispositivo: {UPDATE_INTERVAL} segundos.")
-    print(f"    Desfase entre dispositivos: {STAGGER_DELAY} segundos.")
+    if clock.virtual:
+        ritmo = f"x{clock.speedup:g}" if clock.speedup else "lo más rápido posible"
+        print(f"    Tiempo virtual desde {clock.start.isoformat()} ({ritmo}, semilla: {args.seed}).")
+    if SIM_ENGINE == "processes":
+        print(f"    Procesos de simulación: {SIM_WORKERS}.")
+    elif SIM_ENGINE == "asyncio" and not clock.virtual:
+        print(f"    Event loop: ranuras de {SCHEDULER_SLOT_WIDTH}s, {ASYNC_CONNECTIONS} conexiones, {ASYNC_CPU_WORKERS} hilos de cálculo.")
+    elif SIM_ENGINE != "fleet":
+        print(f"    Fases repartidas en el intervalo (ranuras de {SCHEDULER_SLOT_WIDTH}s, {SCHEDULER_WORKERS} hilos).")
     print("    Presiona CTRL+C para detener.")
 
     # Trayectoria predefinida en formato Polyline
     PREDEFINED_TRAJECTORY_POLYLINE = "tdshEb~}sLHd@Xr@D~@T|@Cr@Mt@]v@}@T_A`@Wd@Ln@Pz@Lh@?\]^@z@TjAZp@f@f@^FXQ\e@Pi@Pm@?aAAw@Oq@BWPL^RVKNKNSN[TKRMVM\O"
+    # Más trayectorias: un archivo con una Polyline por línea en SIM_PREDEFINED_TRAJECTORIES
+    PREDEFINED_TRAJECTORIES_FILE = os.getenv("SIM_PREDEFINED_TRAJECTORIES")
+    if PREDEFINED_TRAJECTORIES_FILE:
+        with open(PREDEFINED_TRAJECTORIES_FILE, 'r', encoding='utf-8') as f:
+            PREDEFINED_POLYLINES = [line.strip() for line in f if line.strip()]
+    else:
+        PREDEFINED_POLYLINES = [PREDEFINED_TRAJECTORY_POLYLINE]
+    # Dispositivos que recorren tramos de las trayectorias predefinidas (IDs separados por coma)
+    PREDEFINED_DEVICES = {int(n) for n in os.getenv("SIM_PREDEFINED_DEVICES", "2").split(",") if n.strip()}
+    # Se ajustan a la red una sola vez; el resultado queda en el caché del grafo
+    predefined = PredefinedTrajectories.from_polylines(PREDEFINED_POLYLINES, street_graph, graph, trip_sampler.component)
+    device_context.predefined = predefined
+    print(f"    {len(predefined)} trayectorias predefinidas ajustadas a la red (dispositivos: {sorted(PREDEFINED_DEVICES)}).")
+
+    sharded = None
+
+    if SIM_ENGINE == "processes":
+        # Los procesos se crean (fork) antes de abrir el spool y arrancar el hilo de envío. Lo ya
+        # calculado aquí (CSR, componentes, velocidades, estaciones...) lo mapean desde el disco
+        sharded = ShardedSimulation(NUM_DEVICES, SIM_WORKERS, {
+            'place': GRAPH_PLACE, 'fixture_path': GRAPH_FIXTURE, 'elevation_path': ELEVATION_PATH or None,
+            'route_weight': ROUTE_WEIGHT, 'route_hierarchy': USE_ROUTE_HIERARCHY, 'hubs': ROUTE_HUB_NODES, 'station_nodes': STATION_NODES,
+            'route_cache_size': ROUTE_CACHE_SIZE, 'trip_min_distance': TRIP_MIN_DISTANCE,
+            'trip_max_distance': TRIP_MAX_DISTANCE, 'predefined_polylines': PREDEFINED_POLYLINES,
+            'predefined_devices': sorted(PREDEFINED_DEVICES), 'continuous_trajectories': CONTINUOUS_TRAJECTORIES,
+            'trip_id_path': TRIP_ID_PATH, 'trip_id_block_size': TRIP_ID_BLOCK_SIZE,
+            'seed': args.seed, 'virtual': clock.virtual, 'speedup': getattr(clock, 'speedup', None),
+            'start': clock.start.isoformat() if clock.virtual else None,
+            'duration': args.duration * 3600 if args.duration else None,
+        }, street_graph, graph, trip_sampler, speed_model, stations=station_network, predefined=predefined).start()
+
+    spool = None
+    if SINK_KIND in ("parquet", "arrow"):
+        sink = ColumnarSink(EXPORT_DIR, fmt=SINK_KIND)
+        print(f"    Exportando lecturas a archivos {SINK_KIND} en {EXPORT_DIR} (sin ThingSpeak).")
+    elif UPLINK_MODE == "bulk" or SPOOL_PATH or clock.virtual or SIM_ENGINE == "processes":
+        # En tiempo virtual la hora de cada lectura va en `created_at`, que sólo admite bulk_update;
+        # con procesos las lecturas llegan ya armadas para bulk_update
+        if SPOOL_PATH:
+            spool = ReadingSpool(SPOOL_PATH)
+            print(f"    Spool de lecturas en {SPOOL_PATH} ({spool.depth()} pendientes de ejecuciones anteriores).")
+        sink = ThingSpeakUplink(THINGSPEAK_CHANNEL_ID, THINGSPEAK_WRITE_API_KEY, base_url=THINGSPEAK_BASE_URL,
+                                batch_size=UPLINK_BATCH_SIZE, flush_interval=UPLINK_FLUSH_INTERVAL,
+                                spool=spool, max_batches_per_flush=UPLINK_MAX_BATCHES).start()
+        print(f"    Envío por lotes: hasta {sink.batch_size} lecturas cada {UPLINK_FLUSH_INTERVAL} segundos.")
+        if spool is not None:
+            print(f"    Atraso del spool: se reponen hasta {sink.batch_size * UPLINK_MAX_BATCHES} lecturas por envío, "
+                  f"además de las nuevas.")
+
+    metrics_server = None
+    if sink is not None:
+        # Lecturas aún no subidas (spool en disco o cola en memoria del uplink)
+        SPOOL_DEPTH.set_function(sink.pending)
+    if METRICS_PORT:
+        try:
+            metrics_server = MetricsServer(METRICS_PORT).start()
+            print(f"    Métricas en {metrics_server.url}")
+        except OSError as e:
+            print(f"⚠️ No se pudo abrir el puerto de métricas {METRICS_PORT}: {e}")
 
-    devices = []
-    for i in range(NUM_DEVICES):
-        if i + 1 == 2: # Aplica la trayectoria predefinida al dispositivo 2
-            devices.append(Device(device_id=i+1, graph=G, projected_graph=G_proj, projected_nodes=nodes_proj, predefined_trajectory_encoded=PREDEFINED_TRAJECTORY_POLYLINE))
-        else:
-            devices.append(Device(device_id=i+1, graph=G, projected_graph=G_proj, projected_nodes=nodes_proj))
-            
     threads = []
-
-    for i, device in enumerate(devices):
-        if i > 0:
-            with print_lock:
-                print(f"🕒 Esperando {STAGGER_DELAY}s para iniciar el dispositivo {device.device_id}...")
-            time.sleep(STAGGER_DELAY)
-        thread = threading.Thread(target=device.run_simulation, daemon=True)
-        threads.append(thread)
-        thread.start()
+    devices = []
+    fleet = None
+    wheel = None
+
+    if SIM_ENGINE == "fleet":
+        fleet = make_fleet(NUM_DEVICES, seed=args.seed, predefined=predefined, predefined_devices=PREDEFINED_DEVICES)
+    elif sharded is None:
+        for i in range(NUM_DEVICES):
+            # Semilla distinta (y reproducible) por dispositivo
+            device_seed = f"{args.seed}-{i + 1}" if args.seed is not None else None
+            # Los que están en PREDEFINED_DEVICES recorren las trayectorias predefinidas
+            devices.append(Device(device_id=i+1, predefined=i + 1 in PREDEFINED_DEVICES, seed=device_seed))
 
     try:
-        while True:
-            time.sleep(1)
+        if sharded is not None:
+            def submit_shard_tick(updates):
+                for update in updates:
+                    sink.submit(update)
+                READINGS.labels('processes').inc(len(updates))
+            sharded.run(submit_shard_tick)
+            log.info(f"\n⏱️  Simulación en {sharded.num_workers} procesos completa.")
+        elif clock.virtual:
+            run_virtual_simulation(SIM_ENGINE, devices, fleet,
+                                   duration=args.duration * 3600 if args.duration else None)
+            log.info(f"\n⏱️  Simulación virtual completa hasta {clock.now().isoformat()}.")
+        else:
+            if SIM_ENGINE == "fleet":
+                thread = threading.Thread(target=run_fleet_simulation, args=(fleet,), daemon=True)
+                threads.append(thread)
+                thread.start()
+            elif SIM_ENGINE == "asyncio":
+                # Corre en este hilo hasta CTRL+C (asyncio.run cancela las corrutinas y relanza KeyboardInterrupt)
+                asyncio.run(run_async_simulation(devices, max_connections=ASYNC_CONNECTIONS,
+                                                 cpu_workers=ASYNC_CPU_WORKERS, slot_width=SCHEDULER_SLOT_WIDTH))
+            else:
+                wheel = TimingWheel(UPDATE_INTERVAL, slot_width=SCHEDULER_SLOT_WIDTH, workers=SCHEDULER_WORKERS,
+                                    on_overrun=report_overrun)
+                wheel.add_evenly(device_task(device) for device in devices)
+                thread = threading.Thread(target=wheel.run, name="timing-wheel", daemon=True)
+                threads.append(thread)
+                thread.start()
+
+            while True:
+                time.sleep(1)
     except KeyboardInterrupt:
-        print("\n🛑 Simulación detenida por el usuario.")
+        log.info("\n🛑 Simulación detenida por el usuario.")
     finally:
+        if wheel is not None:
+            wheel.stop()
+        if sharded is not None:
+            sharded.stop()
+        if sink is not None:
+            sink.stop()
+        if spool is not None:
+            spool.close()
+        if metrics_server is not None:
+            metrics_server.stop()
+        trip_ids.close()
+        # Lo que quede en la cola de mensajes se escribe antes de la despedida
+        stop_logging()
         print("👋 Script finalizado.")
\ No newline at end of file
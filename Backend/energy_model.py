@@ -0,0 +1,139 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from graph_store import SURFACE_COBBLESTONE, SURFACE_PAVED, SURFACE_UNPAVED, SURFACES
+from projection import to_latlon
+from sim_model import (
+    AIR_DENSITY, AUXILIARY_POWER_W, BATTERY_CAPACITY_WH, CRUISE_SPEED_MPS, DRAG_AREA_M2, DRIVETRAIN_EFFICIENCY,
+    VEHICLE_MASS_KG,
+)
+
+# --- Modelo de Energía por Arista ---
+# Cada arista del grafo se anota una sola vez con su pendiente (elevación de sus nodos, desde
+# una grilla local), su superficie y su largo, y con eso se precalcula la energía (Wh) que
+# gasta la batería en recorrerla: rodadura + subida + arrastre del aire a velocidad crucero,
+# dividido por la eficiencia. En bajada no se recupera energía (el mínimo es 0).
+# Las rutas llevan la energía acumulada junto a la distancia acumulada (ver routing.Route):
+# la descarga de un tick es la diferencia entre dos posiciones de ese array.
+GRAVITY = 9.81
+# Coeficiente de rodadura por superficie (índices de graph_store.SURFACES)
+ROLLING_RESISTANCE = np.zeros(len(SURFACES))
+ROLLING_RESISTANCE[SURFACE_PAVED] = 0.006
+ROLLING_RESISTANCE[SURFACE_COBBLESTONE] = 0.015
+ROLLING_RESISTANCE[SURFACE_UNPAVED] = 0.025
+DEFAULT_ELEVATION_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'valparaiso_elevation.json')
+
+# Anotación de las aristas de un `StreetGraph` (arrays alineados con sus nodos y aristas)
+EdgeEnergy = namedtuple('EdgeEnergy', ['node_elevation', 'grade', 'energy_wh'])
+
+
+def _require_rasterio():
+    try:
+        import rasterio
+    except ImportError as e:
+        raise ImportError("Leer elevaciones desde un GeoTIFF requiere rasterio (pip install rasterio).") from e
+    return rasterio
+
+
+# --- Elevación ---
+class ElevationGrid:
+    """
+    Grilla regular de elevaciones (m) en grados: `values[i, j]` es la elevación en
+    (lat0 + i·dlat, lon0 + j·dlon). Fuera de la grilla se usa el borde más cercano.
+    """
+
+    def __init__(self, values, lat0, lon0, dlat, dlon):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.lat0, self.lon0, self.dlat, self.dlon = lat0, lon0, dlat, dlon
+
+    def sample(self, lat, lon):
+        """Elevación interpolada (bilineal) en arrays de lat/lon."""
+        rows, cols = self.values.shape
+        fi = np.clip((np.asarray(lat, dtype=np.float64) - self.lat0) / self.dlat, 0, rows - 1)
+        fj = np.clip((np.asarray(lon, dtype=np.float64) - self.lon0) / self.dlon, 0, cols - 1)
+        i = np.minimum(fi.astype(np.int64), max(rows - 2, 0))
+        j = np.minimum(fj.astype(np.int64), max(cols - 2, 0))
+        di, dj = fi - i, fj - j
+        i1, j1 = np.minimum(i + 1, rows - 1), np.minimum(j + 1, cols - 1)
+        v = self.values
+        return ((v[i, j] * (1 - dj) + v[i, j1] * dj) * (1 - di)
+                + (v[i1, j] * (1 - dj) + v[i1, j1] * dj) * di)
+
+    @classmethod
+    def from_geotiff(cls, path):
+        """Primera banda de un GeoTIFF en EPSG:4326 (p. ej. un recorte de SRTM)."""
+        rasterio = _require_rasterio()
+        with rasterio.open(path) as src:
+            if src.crs is not None and src.crs.to_epsg() != 4326:
+                raise ValueError(f"El raster de elevación debe estar en EPSG:4326 (es {src.crs}).")
+            values = src.read(1).astype(np.float64)
+            if src.nodata is not None:
+                values[values == src.nodata] = np.nan
+            t = src.transform
+        # Centros de los píxeles; las filas del GeoTIFF van de norte a sur y aquí de sur a norte
+        values = np.nan_to_num(values[::-1], nan=float(np.nanmean(values)))
+        return cls(values, lat0=t.f + t.e * (values.shape[0] - 0.5), lon0=t.c + t.a / 2, dlat=-t.e, dlon=t.a)
+
+
+def load_elevation(path):
+    """Grilla de elevación desde un fixture JSON, un .npz (mismas claves) o un GeoTIFF."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.tif', '.tiff'):
+        return ElevationGrid.from_geotiff(path)
+    if ext == '.npz':
+        with np.load(path) as data:
+            return ElevationGrid(data['values'], *(float(data[k]) for k in ('lat0', 'lon0', 'dlat', 'dlon')))
+    with open(path, 'r', encoding='utf-8') as f:
+        doc = json.load(f)
+    return ElevationGrid(doc['values'], doc['lat0'], doc['lon0'], doc['dlat'], doc['dlon'])
+
+
+# --- Energía ---
+def edge_energy_wh(length, climb, surface, speed=CRUISE_SPEED_MPS):
+    """Energía (Wh) que entrega la batería para recorrer `length` m subiendo `climb` m."""
+    length = np.asarray(length, dtype=np.float64)
+    rolling = ROLLING_RESISTANCE[np.asarray(surface, dtype=np.int64)] * length
+    drag = 0.5 * AIR_DENSITY * DRAG_AREA_M2 * speed ** 2 * length
+    work = VEHICLE_MASS_KG * GRAVITY * (rolling + climb) + drag
+    return np.maximum(work, 0.0) / DRIVETRAIN_EFFICIENCY / 3600
+
+
+def flat_energy_per_m(surface=SURFACE_PAVED):
+    """Wh por metro en plano: para rutas sin perfil de energía (grafos sin anotar)."""
+    return float(edge_energy_wh(1.0, 0.0, surface))
+
+
+def annotate_edges(street_graph, elevation=None):
+    """
+    Pendiente y energía de cada arista de un `StreetGraph`. Sin `elevation` (una
+    `ElevationGrid`) todo es plano y sólo cuentan la superficie y el largo.
+    """
+    if elevation is None:
+        z = np.zeros(street_graph.num_nodes)
+    else:
+        lat, lon = np.asarray(street_graph.node_lat), np.asarray(street_graph.node_lon)
+        missing = np.isnan(lat) | np.isnan(lon)
+        if missing.any():
+            lat, lon = lat.copy(), lon.copy()
+            lat[missing], lon[missing] = to_latlon(np.asarray(street_graph.node_x)[missing],
+                                                   np.asarray(street_graph.node_y)[missing], street_graph.crs)
+        z = elevation.sample(lat, lon)
+    length = np.asarray(street_graph.edge_length, dtype=np.float64)
+    climb = z[street_graph.edge_v] - z[street_graph.edge_u]
+    grade = np.divide(climb, length, out=np.zeros_like(length), where=length > 0)
+    return EdgeEnergy(z, grade, edge_energy_wh(length, climb, street_graph.edge_surface))
+
+
+def battery_drain(energy_wh, seconds):
+    """Porcentaje de batería que consumen `energy_wh` de tracción más el consumo fijo de `seconds`."""
+    return (energy_wh + AUXILIARY_POWER_W * seconds / 3600) / BATTERY_CAPACITY_WH * 100
+
+
+def annotate_graph(street_graph, graph, elevation_path=None):
+    """Anota las aristas (con la elevación de `elevation_path`, si se da) y carga su energía en el `CSRGraph`."""
+    edges = annotate_edges(street_graph, load_elevation(elevation_path) if elevation_path else None)
+    graph.set_edge_energy(edges.energy_wh)
+    return edges
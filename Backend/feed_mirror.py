@@ -0,0 +1,309 @@
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+from polyline_codec import decode_points, dequantize, encode_points
+from sim_log import log
+from uplink import THINGSPEAK_BASE_URL
+
+# --- Espejo Local de los Feeds del Canal ---
+# Cada `sync` baja sólo las entradas posteriores a la última guardada y las agrega a un
+# SQLite local. ThingSpeak no filtra por `entry_id`: se consulta desde la hora (`start`) de
+# la última entrada guardada y, como cada respuesta trae las `results` más nuevas del rango,
+# se retrocede con `end` hasta alcanzarla. Al guardarlas se actualiza el resumen de cada viaje (field8):
+# distancia, duración, batería usada y la trayectoria completa como una sola Polyline
+# (los `field6` del viaje decodificados y unidos). Consultar un viaje es leer una fila por
+# su clave, sin volver a bajar ni decodificar las lecturas.
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'feed_mirror.sqlite3')
+# Máximo de entradas que devuelve ThingSpeak por consulta (las más nuevas)
+MAX_RESULTS = 8000
+# Formato de `start` / `end` (las consultas piden `timezone=UTC`)
+QUERY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EARTH_RADIUS_M = 6371008.8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    entry_id INTEGER PRIMARY KEY, created_at TEXT, device_id INTEGER, trip_id INTEGER,
+    temperature REAL, battery REAL, lat REAL, lon REAL, speed REAL, trajectory TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_trip ON entries (trip_id, entry_id);
+CREATE TABLE IF NOT EXISTS trips (
+    trip_id INTEGER PRIMARY KEY, device_id INTEGER, first_entry_id INTEGER, last_entry_id INTEGER,
+    start_time TEXT, end_time TEXT, readings INTEGER, distance_m REAL, battery_used REAL,
+    path TEXT, path_points INTEGER, last_x INTEGER, last_y INTEGER, last_battery REAL
+);
+CREATE INDEX IF NOT EXISTS trips_device ON trips (device_id, trip_id);
+"""
+TRIP_COLUMNS = ('trip_id', 'device_id', 'first_entry_id', 'last_entry_id', 'start_time', 'end_time', 'readings',
+                'distance_m', 'battery_used', 'path', 'path_points', 'last_x', 'last_y', 'last_battery')
+ENTRY_COLUMNS = ('entry_id', 'created_at', 'device_id', 'trip_id', 'temperature', 'battery', 'lat', 'lon', 'speed',
+                 'trajectory')
+# Columnas de `entries` -> campos del canal (ver make_update en uplink.py)
+ENTRY_FIELDS = (('temperature', 'field1'), ('battery', 'field2'), ('lat', 'field3'), ('lon', 'field4'),
+                ('speed', 'field5'))
+
+
+def haversine_m(lat, lon):
+    """Distancia (m) entre puntos consecutivos de una trayectoria lat/lon en grados."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _number(value, kind=float):
+    try:
+        return kind(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _query_time(created_at):
+    """`created_at` de feeds.json -> `start` / `end` de una consulta (UTC, al segundo)."""
+    if not created_at:
+        return None
+    when = datetime.fromisoformat(created_at)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc).strftime(QUERY_TIME_FORMAT)
+
+
+def _duration(start, end):
+    try:
+        return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+class FeedMirror:
+    """
+    Copia local e incremental de los feeds de un canal de ThingSpeak, con un resumen por
+    viaje. `continuous` indica cómo se codificó field6 (SIM_TRAJECTORY_ENCODING en data4.py).
+    """
+
+    def __init__(self, channel_id, read_api_key, path=DEFAULT_MIRROR_PATH, base_url=THINGSPEAK_BASE_URL,
+                 continuous=False, timeout=20):
+        self.channel_id = channel_id
+        self.read_api_key = read_api_key
+        self.url = f"{base_url.rstrip('/')}/channels/{channel_id}/feeds.json"
+        self.continuous = continuous
+        self.timeout = timeout
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    # --- Sincronización ---
+    def last_entry_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(entry_id), 0) FROM entries").fetchone()[0]
+
+    def _last_entry(self):
+        with self._lock:
+            row = self._conn.execute("SELECT entry_id, created_at FROM entries ORDER BY entry_id DESC LIMIT 1").fetchone()
+        return row if row is not None else (0, None)
+
+    def _fetch(self, start, end):
+        params = {'api_key': self.read_api_key, 'results': MAX_RESULTS, 'timezone': 'UTC'}
+        if start is not None:
+            params['start'] = start
+        if end is not None:
+            params['end'] = end
+        response = requests.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return [f for f in response.json().get('feeds', []) if f.get('entry_id')]
+
+    def sync(self):
+        """Baja las entradas nuevas del canal y actualiza los viajes. Devuelve cuántas se agregaron."""
+        last, last_time = self._last_entry()
+        start = _query_time(last_time)
+        new, end = {}, None
+        while True:
+            page = self._fetch(start, end)
+            added = [f for f in page if int(f['entry_id']) > last and int(f['entry_id']) not in new]
+            new.update((int(f['entry_id']), f) for f in added)
+            oldest = min((int(f['entry_id']) for f in page), default=last)
+            # Página incompleta: ya no hay nada más antiguo en el rango
+            if len(page) < MAX_RESULTS or oldest <= last + 1:
+                break
+            if not added:
+                # Más de MAX_RESULTS entradas en el mismo segundo: `end` no puede retroceder más
+                break
+            end = _query_time(min(page, key=lambda f: int(f['entry_id'])).get('created_at'))
+        feeds = [new[entry_id] for entry_id in sorted(new)]
+        if feeds and int(feeds[0]['entry_id']) > last + 1:
+            log.warning(f"⚠️ [Espejo] Se saltaron {int(feeds[0]['entry_id']) - last - 1} entradas entre "
+                        f"{last} y {feeds[0]['entry_id']}: sus viajes quedan incompletos.")
+        return self.ingest(feeds)
+
+    def ingest(self, feeds):
+        """Guarda entradas (diccionarios de feeds.json, en orden de `entry_id`) y actualiza sus viajes."""
+        rows = []
+        for feed in feeds:
+            row = {'entry_id': int(feed['entry_id']), 'created_at': feed.get('created_at'),
+                   'device_id': _number(feed.get('field7'), int), 'trip_id': _number(feed.get('field8'), int),
+                   'trajectory': feed.get('field6') or ""}
+            row.update((column, _number(feed.get(field))) for column, field in ENTRY_FIELDS)
+            rows.append(row)
+        if not rows:
+            return 0
+        by_trip = {}
+        for row in rows:
+            if row['trip_id'] is not None:
+                by_trip.setdefault(row['trip_id'], []).append(row)
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO entries ({', '.join(ENTRY_COLUMNS)}) VALUES ({', '.join('?' * len(ENTRY_COLUMNS))})",
+                    ([row[c] for c in ENTRY_COLUMNS] for row in rows))
+                trips = [self._update_trip(self._load_trip(trip_id), trip_rows) for trip_id, trip_rows in by_trip.items()]
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO trips ({', '.join(TRIP_COLUMNS)}) VALUES ({', '.join('?' * len(TRIP_COLUMNS))})",
+                    ([trip[c] for c in TRIP_COLUMNS] for trip in trips))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def _load_trip(self, trip_id):
+        row = self._conn.execute(f"SELECT {', '.join(TRIP_COLUMNS)} FROM trips WHERE trip_id = ?", (trip_id,)).fetchone()
+        if row is not None:
+            return dict(zip(TRIP_COLUMNS, row))
+        return {'trip_id': trip_id, 'device_id': None, 'first_entry_id': None, 'last_entry_id': None, 'start_time': None,
+                'end_time': None, 'readings': 0, 'distance_m': 0.0, 'battery_used': 0.0, 'path': "", 'path_points': 0,
+                'last_x': None, 'last_y': None, 'last_battery': None}
+
+    def _update_trip(self, trip, rows):
+        """Suma al resumen `trip` las lecturas nuevas `rows` del mismo viaje."""
+        trip['device_id'] = rows[-1]['device_id'] if rows[-1]['device_id'] is not None else trip['device_id']
+        trip['first_entry_id'] = trip['first_entry_id'] or rows[0]['entry_id']
+        trip['last_entry_id'] = rows[-1]['entry_id']
+        trip['start_time'] = trip['start_time'] or rows[0]['created_at']
+        trip['end_time'] = rows[-1]['created_at'] or trip['end_time']
+        trip['readings'] += len(rows)
+
+        # Batería usada: las bajadas entre lecturas consecutivas (mientras carga no se descuenta)
+        battery = [trip['last_battery']] + [row['battery'] for row in rows]
+        battery = np.array([b for b in battery if b is not None], dtype=np.float64)
+        if len(battery):
+            trip['battery_used'] += float(np.clip(-np.diff(battery), 0, None).sum())
+            trip['last_battery'] = float(battery[-1])
+
+        # Trayectoria: en modo continuo los trozos unidos ya forman una Polyline que sigue al
+        # último punto guardado; si no, cada trozo es independiente y empieza desde cero
+        previous = (trip['last_x'], trip['last_y']) if trip['last_x'] is not None else None
+        if self.continuous:
+            points = decode_points("".join(row['trajectory'] for row in rows), previous)
+        else:
+            chunks = [decode_points(row['trajectory']) for row in rows if row['trajectory']]
+            points = np.concatenate(chunks) if chunks else np.zeros((0, 2), dtype=np.int64)
+        if len(points):
+            joined = np.vstack(([previous], points)) if previous is not None else points
+            keep = np.concatenate(([True], np.any(np.diff(joined, axis=0) != 0, axis=1)))
+            lat_lon = dequantize(joined[keep])
+            trip['distance_m'] += float(haversine_m(lat_lon[:, 0], lat_lon[:, 1]).sum())
+            trip['path'] += encode_points(points, previous)
+            trip['path_points'] += int(keep.sum()) - (previous is not None)
+            trip['last_x'], trip['last_y'] = int(points[-1, 0]), int(points[-1, 1])
+        return trip
+
+    # --- Consultas ---
+    def latest_trip_id(self):
+        """ID de viaje más alto visto en el canal (0 si no hay ninguno)."""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(trip_id), 0) FROM trips").fetchone()[0]
+
+    def trip(self, trip_id):
+        """Resumen de un viaje (ver `_summary`), o `None` si no está en el espejo."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(TRIP_COLUMNS)} FROM trips WHERE trip_id = ?", (trip_id,)).fetchone()
+        return _summary(dict(zip(TRIP_COLUMNS, row))) if row is not None else None
+
+    def trips(self, device_id=None, limit=None):
+        """Resúmenes de los viajes (de un dispositivo, si se indica), del más nuevo al más viejo."""
+        query = f"SELECT {', '.join(TRIP_COLUMNS)} FROM trips"
+        params = []
+        if device_id is not None:
+            query += " WHERE device_id = ?"
+            params.append(device_id)
+        query += " ORDER BY trip_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [_summary(dict(zip(TRIP_COLUMNS, row))) for row in rows]
+
+    def trip_path(self, trip_id):
+        """Trayectoria completa del viaje como array (N, 2) lat/lon (vacío si no está)."""
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM trips WHERE trip_id = ?", (trip_id,)).fetchone()
+        return dequantize(decode_points(row[0])) if row is not None else np.zeros((0, 2))
+
+    def trip_readings(self, trip_id):
+        """Lecturas guardadas de un viaje, en orden de `entry_id`."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(ENTRY_COLUMNS)} FROM entries WHERE trip_id = ? ORDER BY entry_id",
+                                      (trip_id,)).fetchall()
+        return [dict(zip(ENTRY_COLUMNS, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+
+
+def _summary(trip):
+    """Fila de `trips` -> resumen público (sin el estado interno de la codificación)."""
+    return {
+        'trip_id': trip['trip_id'],
+        'device_id': trip['device_id'],
+        'start_time': trip['start_time'],
+        'end_time': trip['end_time'],
+        'duration_s': _duration(trip['start_time'], trip['end_time']),
+        'readings': trip['readings'],
+        'distance_m': trip['distance_m'],
+        'battery_used': trip['battery_used'],
+        'path': trip['path'],
+        'path_points': trip['path_points'],
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
+    parser = argparse.ArgumentParser(description="Sincroniza el espejo local del canal y muestra sus viajes.")
+    parser.add_argument("--device", type=int, help="Sólo los viajes de este dispositivo.")
+    parser.add_argument("--trip", type=int, help="Detalle de un viaje (incluye la Polyline completa).")
+    parser.add_argument("--limit", type=int, default=20, help="Cantidad de viajes a listar (por defecto 20).")
+    parser.add_argument("--no-sync", action="store_true", help="No consulta ThingSpeak; usa lo ya guardado.")
+    args = parser.parse_args()
+
+    mirror = FeedMirror(os.getenv("VITE_THINGSPEAK_CHANNEL_ID"), os.getenv("VITE_THINGSPEAK_READ_API_KEY"),
+                        path=os.getenv("SIM_FEED_MIRROR_PATH", DEFAULT_MIRROR_PATH),
+                        base_url=os.getenv("THINGSPEAK_BASE_URL", THINGSPEAK_BASE_URL),
+                        continuous=os.getenv("SIM_TRAJECTORY_ENCODING", "standalone") == "continuous")
+    try:
+        if not args.no_sync:
+            print(f"🔄 {mirror.sync()} entradas nuevas (última: {mirror.last_entry_id()}).")
+        if args.trip is not None:
+            trip = mirror.trip(args.trip)
+            print(trip if trip is not None else f"🤷 El viaje {args.trip} no está en el espejo.")
+        else:
+            for trip in mirror.trips(device_id=args.device, limit=args.limit):
+                duration = f"{trip['duration_s'] / 60:.1f} min" if trip['duration_s'] is not None else "?"
+                print(f"🚲 Dev:{trip['device_id']} Viaje:{trip['trip_id']} {trip['distance_m'] / 1000:.2f} km, {duration}, "
+                      f"{trip['readings']} lecturas, batería usada {trip['battery_used']:.1f}%")
+    finally:
+        mirror.close()
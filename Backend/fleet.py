@@ -0,0 +1,395 @@
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+from polyline_codec import TrajectoryEncoder
+from projection import to_latlon
+from energy_model import battery_drain
+from routing import cumulative_lengths, Route, RouteService
+from speed_model import SpeedModel
+from sim_model import (
+    UPDATE_INTERVAL, MAX_SPEED_MPS, INITIAL_BATTERY, LOW_BATTERY_THRESHOLD, BATTERY_CHARGE_RATE, TEMP_STD_DEV,
+    SPEED_JITTER, get_chile_current_time, target_temperature,
+)
+
+# --- Estados de Batería (codificados como enteros en los arrays) ---
+DISCHARGING = 0
+CHARGING = 1
+TO_STATION = 2 # batería baja, en camino a una estación (sigue descargándose)
+BATTERY_STATE_NAMES = ("DISCHARGING", "CHARGING", "TO_STATION")
+
+# Resultado de un tick para toda la flota. `traj_xy[traj_offsets[i]:traj_offsets[i + 1]]`
+# es la trayectoria proyectada recorrida por el dispositivo i en este tick.
+FleetTick = namedtuple('FleetTick', [
+    'device_id', 'trip_id', 'temperature', 'battery', 'battery_state',
+    'x', 'y', 'lat', 'lon', 'speed', 'traj_xy', 'traj_offsets',
+])
+
+
+class RoutePool:
+    """
+    Buffer contiguo con las rutas activas de toda la flota. Cada ruta ocupa un rango
+    [start, end] de puntos y su distancia acumulada se guarda desplazada por una base,
+    de modo que `cum` es creciente en todo el buffer y un solo `searchsorted` avanza
+    a todos los dispositivos a la vez. `energy` es la energía acumulada de cada ruta (Wh,
+    ver `routing.Route`); sólo se restan valores de una misma ruta. Con un modelo de
+    velocidades (`retime`), `time` es el tiempo acumulado en la franja actual, también
+    creciente en todo el buffer, calculado desde la arista de cada punto (`edges`).
+    """
+
+    def __init__(self, capacity=4096):
+        self.xy = np.empty((capacity, 2), dtype=np.float64)
+        self.cum = np.empty(capacity, dtype=np.float64)
+        self.energy = np.empty(capacity, dtype=np.float64)
+        self.edges = np.empty(capacity, dtype=np.int32)
+        self.head = np.empty(capacity, dtype=bool) # primer punto de cada ruta
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.live = 0
+        self.speed_model = None
+        self.bucket = None
+
+    def _arrays(self):
+        return ('xy', 'cum', 'energy', 'edges', 'head', 'time')
+
+    def _reserve(self, n):
+        if self.size + n <= len(self.cum):
+            return
+        capacity = max(2 * len(self.cum), self.size + n)
+        for name in self._arrays():
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, coords, energy, edges=None):
+        """Agrega una ruta (N, 2), su energía acumulada y sus aristas al final del buffer. Devuelve su rango (start, end)."""
+        n = len(coords)
+        self._reserve(n)
+        start = self.size
+        # Separación de 1 m entre rutas para que `cum` sea estrictamente creciente
+        base = self.cum[start - 1] + 1.0 if start else 0.0
+        self.xy[start:start + n] = coords
+        self.cum[start:start + n] = base + cumulative_lengths(coords)
+        self.energy[start:start + n] = energy
+        self.edges[start:start + n] = -1 if edges is None else edges
+        self.head[start:start + n] = False
+        self.head[start] = True
+        if self.speed_model is not None:
+            # Igual que en `retime`: 1 s entre rutas
+            time_base = self.time[start - 1] + 1.0 if start else 0.0
+            self.time[start:start + n] = time_base + self.speed_model.route_times(
+                self.edges[start:start + n], self.cum[start:start + n], self.bucket)
+        self.size += n
+        self.live += n
+        return start, start + n - 1
+
+    def retime(self, speed_model, bucket):
+        """Recalcula `time` de todo el buffer con las tablas de `speed_model` en la franja `bucket`."""
+        self.speed_model, self.bucket = speed_model, bucket
+        n = self.size
+        if n == 0:
+            return
+        self.time[0] = 0.0
+        if n > 1:
+            np.cumsum(speed_model.segment_times(self.edges[:n], self.cum[:n], bucket, self.head[:n]), out=self.time[1:n])
+
+    def release(self, start, end):
+        self.live -= end - start + 1
+
+    def needs_compaction(self):
+        return self.size > 4096 and self.size > 2 * self.live
+
+    def compact(self, starts, ends):
+        """Reescribe el buffer dejando sólo las rutas [starts, ends]. Devuelve los nuevos inicios."""
+        lengths = ends - starts + 1
+        total = int(lengths.sum())
+        new_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        gather = np.repeat(starts - new_starts, lengths) + np.arange(total)
+
+        route_lengths = self.cum[ends] - self.cum[starts]
+        new_bases = np.concatenate(([0.0], np.cumsum(route_lengths + 1.0)[:-1]))
+        cum = self.cum[gather] - np.repeat(self.cum[starts] - new_bases, lengths)
+        kept = {name: getattr(self, name)[gather] for name in self._arrays() if name not in ('cum', 'time')}
+
+        capacity = max(4096, 2 * total)
+        for name in self._arrays():
+            old = getattr(self, name)
+            setattr(self, name, np.empty((capacity,) + old.shape[1:], dtype=old.dtype))
+        self.cum[:total] = cum
+        for name, values in kept.items():
+            getattr(self, name)[:total] = values
+        self.size = self.live = total
+        if self.speed_model is not None:
+            self.retime(self.speed_model, self.bucket)
+        return new_starts
+
+
+class Fleet:
+    """
+    Motor vectorizado de la flota: el estado de los N dispositivos vive en arrays de NumPy
+    (estructura de arrays) y cada tick avanza a todos con operaciones por lotes.
+
+    Reproduce la lógica de `Device.update_gps_and_speed_on_streets` y `Device.update_battery`
+    de data4.py: mismas fórmulas, mismos redondeos y mismas transiciones de estado.
+    """
+
+    def __init__(self, num_devices, route_provider, seed=None, device_ids=None, new_trip_id=None,
+                 update_interval=UPDATE_INTERVAL, crs=None, continuous_trajectories=False, stations=None,
+                 speed_model=None):
+        n = num_devices
+        self.num_devices = n
+        self.rng = np.random.default_rng(seed)
+        self.route_provider = route_provider
+        self.new_trip_id = new_trip_id or itertools.count(1).__next__
+        self.update_interval = update_interval
+        self.crs = crs
+        # `stations.StationNetwork`: sin estaciones, la batería baja se carga donde esté el dispositivo
+        self.stations = stations
+        # `speed_model.SpeedModel`: sin modelo, cada tick se sortea una velocidad uniforme como antes
+        self.speed_model = speed_model
+        # Franja horaria del tick en curso: la de salida de las rutas que se piden en él
+        self.bucket = None
+        # Con `continuous_trajectories` los trozos de un viaje se concatenan en una sola Polyline
+        self.trajectory_encoder = TrajectoryEncoder(n, continuous=continuous_trajectories)
+
+        self.device_id = np.arange(1, n + 1, dtype=np.int64) if device_ids is None else np.asarray(device_ids, dtype=np.int64)
+        self.trip_id = np.zeros(n, dtype=np.int64)
+        self.x = np.full(n, np.nan)
+        self.y = np.full(n, np.nan)
+        self.lat = np.zeros(n)
+        self.lon = np.zeros(n)
+        self.speed = np.zeros(n)
+        self.battery = np.full(n, INITIAL_BATTERY)
+        self.battery_state = np.full(n, DISCHARGING, dtype=np.int8)
+        # Energía (Wh) gastada por cada dispositivo en el último avance
+        self.tick_energy = np.zeros(n)
+        # Estación a la que va (TO_STATION) o en la que está cargando (CHARGING); -1 si ninguna
+        self.station = np.full(n, -1, dtype=np.int32)
+
+        # Ruta de cada dispositivo como rango en el pool; route_idx es el último vértice alcanzado
+        self.pool = RoutePool()
+        self.route_start = np.full(n, -1, dtype=np.int64)
+        self.route_end = np.full(n, -1, dtype=np.int64)
+        self.route_idx = np.full(n, -1, dtype=np.int64)
+
+    @classmethod
+    def from_graph(cls, graph, nodes_proj, num_devices, seed=None, route_service=None, predefined=None,
+                   predefined_devices=(), **kwargs):
+        """
+        Flota con rutas aleatorias sobre un `CSRGraph`, como los dispositivos de data4.py. Los
+        dispositivos en `predefined_devices` recorren tramos de `predefined`
+        (`trajectories.PredefinedTrajectories`) y, si no se puede, una ruta aleatoria.
+        """
+        route_service = route_service or RouteService(graph)
+        fleet = cls(num_devices, None, seed=seed, crs=graph.crs, **kwargs)
+        uses_predefined = np.isin(fleet.device_id, list(predefined_devices)) if predefined else np.zeros(num_devices, dtype=bool)
+
+        def route_provider(i, rng):
+            if uses_predefined[i]:
+                route = predefined.sample(rng)
+                if route is not None:
+                    return route
+            return route_service.random_route(rng, nodes_proj, bucket=fleet.bucket)
+
+        fleet.route_provider = route_provider
+        return fleet
+
+    # --- Rutas ---
+    def _assign_route(self, i):
+        """Pide una ruta nueva para el dispositivo i. Devuelve False si no se pudo generar."""
+        route = self.route_provider(i, self.rng)
+        if route is not None and not isinstance(route, Route):
+            route = Route(route) if len(route) else None
+        return self._set_route(i, route)
+
+    def _set_route(self, i, route):
+        """Reemplaza la ruta del dispositivo i por `route` (un viaje nuevo). Devuelve False si no hay ruta."""
+        if self.route_start[i] >= 0:
+            self.pool.release(self.route_start[i], self.route_end[i])
+            self.route_start[i] = self.route_end[i] = self.route_idx[i] = -1
+        self.trip_id[i] = self.new_trip_id()
+        if route is None or len(route) == 0:
+            return False
+        start, end = self.pool.add(route.coords, route.energy, route.edges)
+        self.route_start[i] = self.route_idx[i] = start
+        self.route_end[i] = end
+        self.x[i], self.y[i] = self.pool.xy[start]
+        return True
+
+    def _compact_routes(self):
+        active = np.flatnonzero(self.route_start >= 0)
+        new_starts = self.pool.compact(self.route_start[active], self.route_end[active])
+        shift = new_starts - self.route_start[active]
+        self.route_start[active] += shift
+        self.route_end[active] += shift
+        self.route_idx[active] += shift
+
+    # --- Tick ---
+    def _timed_targets(self, active, factor):
+        """
+        Distancia acumulada que alcanzan los dispositivos `active` en un intervalo (escalado por
+        `factor`) según los tiempos del pool: el mismo `searchsorted`, ahora sobre `time`.
+        """
+        pool = self.pool
+        idx_old = self.route_idx[active]
+        end = self.route_end[active]
+        target_time = pool.time[idx_old] + self.update_interval * factor[active]
+        j = np.searchsorted(pool.time[:pool.size], target_time, side='right') - 1
+        j = np.clip(j, idx_old, end)
+        at_end = j >= end
+        k = np.where(at_end, j, j + 1)
+        span = pool.time[k] - pool.time[j]
+        ratio = np.where(at_end, 0.0, (target_time - pool.time[j]) / np.where(span > 0, span, 1.0))
+        return pool.cum[j] + ratio * (pool.cum[k] - pool.cum[j])
+
+    def _advance(self, active, target=None):
+        """
+        Avanza a los dispositivos `active` hasta la distancia acumulada `target` de su ruta
+        (por defecto, speed * intervalo desde su último vértice).
+        """
+        pool = self.pool
+        idx_old = self.route_idx[active]
+        end = self.route_end[active]
+        if target is None:
+            target = pool.cum[idx_old] + self.speed[active] * self.update_interval
+
+        # Último vértice con distancia acumulada <= objetivo (búsqueda binaria por lotes)
+        j = np.searchsorted(pool.cum[:pool.size], target, side='right') - 1
+        j = np.clip(j, idx_old, end)
+        at_end = j >= end
+
+        # Interpolación dentro del segmento [j, j + 1] para quienes no terminaron la ruta
+        k = np.where(at_end, j, j + 1)
+        seg = pool.cum[k] - pool.cum[j]
+        ratio = np.where(at_end, 0.0, (target - pool.cum[j]) / np.where(seg > 0, seg, 1.0))
+        pos = pool.xy[j] + ratio[:, None] * (pool.xy[k] - pool.xy[j])
+
+        # Energía de lo recorrido: la acumulada en la posición final menos la del vértice de partida
+        energy_end = pool.energy[j] + ratio * (pool.energy[k] - pool.energy[j])
+        self.tick_energy[:] = 0.0
+        self.tick_energy[active] = energy_end - pool.energy[idx_old]
+
+        # Igual que Device: el próximo tick parte desde el último vértice alcanzado
+        self.route_idx[active] = j
+        self.x[active], self.y[active] = pos[:, 0], pos[:, 1]
+
+        # Trayectoria del tick: vértices [idx_old..j] más el punto interpolado final
+        tail = ~at_end
+        counts = np.zeros(self.num_devices, dtype=np.int64)
+        counts[active] = j - idx_old + 1 + tail
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        active_counts = counts[active]
+        starts = offsets[active]
+        total = int(offsets[-1])
+        traj_xy = np.empty((total, 2), dtype=np.float64)
+        # Índices dentro del pool para cada punto de trayectoria (la cola se corrige abajo)
+        local = np.arange(total) - np.repeat(starts, active_counts)
+        src = np.repeat(idx_old, active_counts) + local
+        traj_xy[:] = pool.xy[np.minimum(src, pool.size - 1)]
+        tail_rows = (starts + active_counts - 1)[tail]
+        traj_xy[tail_rows] = pos[tail]
+        return traj_xy, offsets
+
+    def _update_battery(self):
+        # Los que llegaron a su estación empiezan a cargar en este mismo tick
+        arrived = (self.battery_state == TO_STATION) & (self.route_idx >= self.route_end)
+        self.battery_state[arrived] = CHARGING
+
+        charging = self.battery_state == CHARGING
+        discharging = ~charging
+
+        self.battery[charging] += BATTERY_CHARGE_RATE
+        full = charging & (self.battery >= INITIAL_BATTERY)
+        self.battery[full] = INITIAL_BATTERY
+        self.battery_state[full] = DISCHARGING
+        self.station[full] = -1
+
+        total_discharge = battery_drain(self.tick_energy, self.update_interval)
+        self.battery[discharging] -= total_discharge[discharging]
+        low = np.flatnonzero((self.battery_state == DISCHARGING) & (self.battery <= LOW_BATTERY_THRESHOLD))
+        if self.stations is None:
+            self.battery_state[low] = CHARGING
+        elif len(low):
+            self._dispatch_to_stations(low)
+
+        self.battery = np.round(np.clip(self.battery, 0.0, INITIAL_BATTERY), 1)
+
+    def _dispatch_to_stations(self, low):
+        """Manda a los dispositivos `low` a su estación más cercana (una consulta por lotes)."""
+        station, routes = self.stations.dispatch(self.x[low], self.y[low])
+        self.station[low] = station
+        for i, route in zip(low.tolist(), routes):
+            if route is not None:
+                self._set_route(i, route)
+                self.battery_state[i] = TO_STATION
+            else:
+                # Ya en la estación, o sin ninguna alcanzable: carga donde está
+                self.battery_state[i] = CHARGING
+
+    def to_latlon(self, x, y):
+        """Desproyecta arrays de coordenadas del CRS del grafo a (lat, lon)."""
+        return to_latlon(x, y, self.crs)
+
+    def encoded_trajectories(self, tick):
+        """Trayectoria de cada dispositivo en el tick, como Polyline (o "" con menos de 2 puntos)."""
+        traj_lat, traj_lon = self.to_latlon(tick.traj_xy[:, 0], tick.traj_xy[:, 1])
+        return self.trajectory_encoder.encode(traj_lat, traj_lon, tick.traj_offsets, tick.trip_id)
+
+    def step(self, now=None):
+        """Avanza un tick a toda la flota y devuelve un `FleetTick` con las lecturas."""
+        chile_time = now or get_chile_current_time()
+
+        # 0. Tiempos de las rutas del pool en la franja horaria actual
+        self.bucket = SpeedModel.bucket(chile_time)
+        if self.speed_model is not None and self.bucket != self.pool.bucket:
+            self.pool.retime(self.speed_model, self.bucket)
+
+        # 1. Rutas nuevas sólo para quienes terminaron (o nunca tuvieron) ruta; los que cargan
+        #    en una estación se quedan quietos
+        docked = (self.battery_state == CHARGING) & (self.station >= 0)
+        has_route = ~docked
+        for i in np.flatnonzero((self.route_idx >= self.route_end) & ~docked):
+            has_route[i] = self._assign_route(i)
+        if self.pool.needs_compaction():
+            self._compact_routes()
+
+        # 2. Velocidad (sin ruta no se sortea, igual que el retorno temprano de Device). Con
+        #    modelo de velocidades se sortea un factor sobre el tiempo del intervalo y la
+        #    velocidad es la distancia que alcanza según las tablas de la franja
+        active = np.flatnonzero(has_route)
+        target = None
+        if self.speed_model is None:
+            new_speed = self.rng.uniform(0.5 * MAX_SPEED_MPS, MAX_SPEED_MPS, self.num_devices)
+            self.speed = np.where(has_route, new_speed, self.speed)
+        else:
+            factor = self.rng.uniform(1 - SPEED_JITTER, 1 + SPEED_JITTER, self.num_devices)
+            target = self._timed_targets(active, factor)
+            self.speed[active] = (target - self.pool.cum[self.route_idx[active]]) / self.update_interval
+
+        # 3. Posición y trayectoria
+        traj_xy, traj_offsets = self._advance(active, target)
+        if self.crs is not None and len(active):
+            lat, lon = self.to_latlon(self.x[active], self.y[active])
+            self.lat[active], self.lon[active] = lat, lon
+
+        # 4. Batería y temperatura (la lectura es del viaje recorrido, aunque la batería baja abra uno nuevo)
+        trip_id = self.trip_id.copy()
+        self._update_battery()
+        temperature = np.round(self.rng.normal(target_temperature(chile_time), TEMP_STD_DEV, self.num_devices), 2)
+
+        return FleetTick(
+            device_id=self.device_id,
+            trip_id=trip_id,
+            temperature=temperature,
+            battery=self.battery.copy(),
+            battery_state=self.battery_state.copy(),
+            x=self.x.copy(),
+            y=self.y.copy(),
+            lat=np.round(self.lat, 6),
+            lon=np.round(self.lon, 6),
+            speed=np.round(np.where(has_route, self.speed, 0.0), 2),
+            traj_xy=traj_xy,
+            traj_offsets=traj_offsets,
+        )
@@ -0,0 +1,308 @@
+import os
+import json
+import hashlib
+import re
+from datetime import datetime
+
+import numpy as np
+
+# --- Configuración del Almacén de Grafos ---
+# Cambiar este número invalida todos los cachés existentes (formato de arrays distinto).
+GRAPH_STORE_VERSION = 3
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+DEFAULT_FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'valparaiso_grid.json')
+
+# Arrays que componen un grafo en disco (un archivo .npy por array, cargables con mmap)
+NODE_ARRAYS = ('node_ids', 'node_x', 'node_y', 'node_lon', 'node_lat', 'node_control')
+EDGE_ARRAYS = ('edge_u', 'edge_v', 'edge_key', 'edge_length', 'edge_has_geom', 'edge_geom_offsets', 'geom_xy',
+               'edge_surface', 'edge_road_class', 'edge_maxspeed')
+
+# --- Superficie de las Calles ---
+# Tipo de superficie de cada arista (índice en SURFACES), según la etiqueta `surface` de OSM o,
+# si no la tiene, según el tipo de vía. Lo usa el modelo de energía (ver energy_model.py).
+SURFACES = ('paved', 'cobblestone', 'unpaved')
+SURFACE_PAVED, SURFACE_COBBLESTONE, SURFACE_UNPAVED = range(len(SURFACES))
+COBBLESTONE_TAGS = {'sett', 'cobblestone', 'unhewn_cobblestone', 'cobblestone:flattened', 'paving_stones'}
+UNPAVED_TAGS = {'unpaved', 'gravel', 'fine_gravel', 'compacted', 'dirt', 'earth', 'ground', 'grass', 'sand', 'mud',
+                'pebblestone', 'rock', 'woodchips'}
+UNPAVED_HIGHWAYS = {'track', 'path', 'bridleway'}
+
+# --- Tipo de Vía, Velocidad Máxima y Control de Intersecciones ---
+# Los usa el modelo de velocidades (ver speed_model.py). `edge_maxspeed` está en km/h (NaN si
+# la arista no tiene la etiqueta) y `node_control` dice si el nodo tiene semáforo o un
+# disco PARE / CEDA EL PASO (etiqueta `highway` de los nodos de OSM).
+ROAD_CLASSES = ('primary', 'secondary', 'tertiary', 'residential', 'service')
+ROAD_PRIMARY, ROAD_SECONDARY, ROAD_TERTIARY, ROAD_RESIDENTIAL, ROAD_SERVICE = range(len(ROAD_CLASSES))
+ROAD_CLASS_TAGS = {
+    'motorway': ROAD_PRIMARY, 'trunk': ROAD_PRIMARY, 'primary': ROAD_PRIMARY,
+    'secondary': ROAD_SECONDARY, 'tertiary': ROAD_TERTIARY,
+    'residential': ROAD_RESIDENTIAL, 'unclassified': ROAD_RESIDENTIAL, 'living_street': ROAD_RESIDENTIAL,
+}
+CONTROLS = ('none', 'traffic_signals', 'stop')
+CONTROL_NONE, CONTROL_SIGNALS, CONTROL_STOP = range(len(CONTROLS))
+# Valores de `maxspeed` sin número: límites por defecto de la ley de tránsito chilena (km/h)
+MAXSPEED_ZONES = {'CL:urban': 50.0, 'CL:rural': 100.0, 'CL:living_street': 20.0, 'walk': 10.0}
+
+
+class StreetGraph:
+    """Red de calles proyectada guardada como arrays planos (nodos, aristas y geometrías)."""
+
+    def __init__(self, arrays, crs, place=None, network_type=None):
+        self.crs = crs
+        self.place = place
+        self.network_type = network_type
+        self.path = None # Directorio del caché en disco, si se cargó desde ahí
+        for name in NODE_ARRAYS + EDGE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self._node_index = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_u)
+
+    @property
+    def nodes_proj(self):
+        """Lista de IDs OSM de los nodos, equivalente a `list(G_proj.nodes())`."""
+        return self.node_ids.tolist()
+
+    def node_index(self, osmid):
+        """Índice interno (posición en los arrays) de un nodo a partir de su ID OSM."""
+        if self._node_index is None:
+            self._node_index = {int(n): i for i, n in enumerate(self.node_ids)}
+        return self._node_index[int(osmid)]
+
+    def edge_geometry(self, edge):
+        """Coordenadas proyectadas (N, 2) de una arista, como vista sobre el buffer compartido."""
+        return self.geom_xy[self.edge_geom_offsets[edge]:self.edge_geom_offsets[edge + 1]]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in NODE_ARRAYS + EDGE_ARRAYS}
+
+
+def _first_tag(value):
+    # OSMnx deja una lista cuando al simplificar se unen vías con etiquetas distintas
+    return value[0] if isinstance(value, list) and value else value
+
+
+def surface_code(surface=None, highway=None):
+    """Código de superficie (ver SURFACES) a partir de las etiquetas OSM `surface` y `highway`."""
+    surface, highway = _first_tag(surface), _first_tag(highway)
+    if surface in COBBLESTONE_TAGS:
+        return SURFACE_COBBLESTONE
+    if surface in UNPAVED_TAGS:
+        return SURFACE_UNPAVED
+    if surface is None and highway in UNPAVED_HIGHWAYS:
+        return SURFACE_UNPAVED
+    return SURFACE_PAVED
+
+
+def road_class_code(highway=None):
+    """Código de tipo de vía (ver ROAD_CLASSES) a partir de la etiqueta OSM `highway`."""
+    highway = _first_tag(highway)
+    if isinstance(highway, str) and highway.endswith('_link'):
+        highway = highway[:-len('_link')]
+    return ROAD_CLASS_TAGS.get(highway, ROAD_SERVICE)
+
+
+def maxspeed_kmh(maxspeed=None):
+    """Velocidad máxima (km/h) de la etiqueta OSM `maxspeed` ("50", "30 mph", "CL:urban", ...), o NaN."""
+    maxspeed = _first_tag(maxspeed)
+    if maxspeed is None:
+        return np.nan
+    if isinstance(maxspeed, (int, float)):
+        return float(maxspeed)
+    maxspeed = str(maxspeed).strip()
+    if maxspeed in MAXSPEED_ZONES:
+        return MAXSPEED_ZONES[maxspeed]
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*(mph|knots)?$', maxspeed)
+    if not match:
+        return np.nan
+    value = float(match.group(1))
+    return value * 1.609344 if match.group(2) == 'mph' else value * 1.852 if match.group(2) else value
+
+
+def control_code(highway=None, crossing=None):
+    """Código de control de un nodo (ver CONTROLS) a partir de sus etiquetas OSM `highway` y `crossing`."""
+    highway, crossing = _first_tag(highway), _first_tag(crossing)
+    if highway == 'traffic_signals' or crossing == 'traffic_signals':
+        return CONTROL_SIGNALS
+    if highway in ('stop', 'give_way'):
+        return CONTROL_STOP
+    return CONTROL_NONE
+
+
+# --- Construcción desde las distintas fuentes ---
+def _build_arrays(node_rows, edge_rows):
+    """
+    Arma los arrays a partir de filas (osmid, x, y, lon, lat, tags) y (u, v, key, length,
+    geometry, tags), donde `tags` es un diccionario con las etiquetas OSM del nodo o de la
+    arista (puede faltar).
+    """
+    node_ids = np.array([row[0] for row in node_rows], dtype=np.int64)
+    index = {int(n): i for i, n in enumerate(node_ids)}
+    node_x = np.array([row[1] for row in node_rows], dtype=np.float64)
+    node_y = np.array([row[2] for row in node_rows], dtype=np.float64)
+    node_control = [control_code(tags.get('highway'), tags.get('crossing'))
+                     for tags in (row[5] if len(row) > 5 else {} for row in node_rows)]
+
+    edge_u, edge_v, edge_key, edge_length, edge_has_geom, edge_surface = [], [], [], [], [], []
+    edge_road_class, edge_maxspeed = [], []
+    offsets = [0]
+    coords = []
+    for u, v, key, length, geometry, *rest in edge_rows:
+        tags = rest[0] if rest else {}
+        ui, vi = index[int(u)], index[int(v)]
+        edge_u.append(ui)
+        edge_v.append(vi)
+        edge_key.append(key)
+        edge_length.append(length)
+        edge_has_geom.append(geometry is not None)
+        edge_surface.append(surface_code(tags.get('surface'), tags.get('highway')))
+        edge_road_class.append(road_class_code(tags.get('highway')))
+        edge_maxspeed.append(maxspeed_kmh(tags.get('maxspeed')))
+        # Las aristas sin geometría se guardan como el segmento recto entre sus nodos
+        points = geometry if geometry is not None else [(node_x[ui], node_y[ui]), (node_x[vi], node_y[vi])]
+        coords.extend(points)
+        offsets.append(len(coords))
+
+    return {
+        'node_ids': node_ids,
+        'node_x': node_x,
+        'node_y': node_y,
+        'node_lon': np.array([row[3] for row in node_rows], dtype=np.float64),
+        'node_lat': np.array([row[4] for row in node_rows], dtype=np.float64),
+        'node_control': np.array(node_control, dtype=np.int8),
+        'edge_u': np.array(edge_u, dtype=np.int32),
+        'edge_v': np.array(edge_v, dtype=np.int32),
+        'edge_key': np.array(edge_key, dtype=np.int32),
+        'edge_length': np.array(edge_length, dtype=np.float64),
+        'edge_has_geom': np.array(edge_has_geom, dtype=bool),
+        'edge_geom_offsets': np.array(offsets, dtype=np.int64),
+        'geom_xy': np.array(coords, dtype=np.float64).reshape(-1, 2),
+        'edge_surface': np.array(edge_surface, dtype=np.int8),
+        'edge_road_class': np.array(edge_road_class, dtype=np.int8),
+        'edge_maxspeed': np.array(edge_maxspeed, dtype=np.float32),
+    }
+
+
+def from_networkx(G_proj, place=None, network_type=None):
+    """Convierte el grafo proyectado de OSMnx en un `StreetGraph`."""
+    node_rows = [(n, d['x'], d['y'], d.get('lon', np.nan), d.get('lat', np.nan),
+                  {'highway': d.get('highway'), 'crossing': d.get('crossing')}) for n, d in G_proj.nodes(data=True)]
+    edge_rows = []
+    for u, v, key, d in G_proj.edges(keys=True, data=True):
+        geometry = list(d['geometry'].coords) if 'geometry' in d else None
+        edge_rows.append((u, v, key, d['length'], geometry,
+                          {'highway': d.get('highway'), 'maxspeed': d.get('maxspeed'), 'surface': d.get('surface')}))
+    return StreetGraph(_build_arrays(node_rows, edge_rows), G_proj.graph['crs'], place, network_type)
+
+
+def load_fixture(path=DEFAULT_FIXTURE_PATH):
+    """Carga un grafo pequeño versionado en el repositorio (JSON) para trabajar sin conexión."""
+    with open(path, 'r', encoding='utf-8') as f:
+        doc = json.load(f)
+    # Columnas después de (osmid, x, y, lon, lat) y de la geometría (highway, maxspeed, ...) son etiquetas OSM
+    node_tags = doc.get('node_fields', [])[5:]
+    node_rows = [tuple(row[:5]) + (dict(zip(node_tags, row[5:])),) for row in doc['nodes']]
+    edge_tags = doc.get('edge_fields', [])[5:]
+    edge_rows = [tuple(row[:5]) + (dict(zip(edge_tags, row[5:])),) for row in doc['edges']]
+    arrays = _build_arrays(node_rows, edge_rows)
+    return StreetGraph(arrays, doc['crs'], doc.get('place'), doc.get('network_type'))
+
+
+def download_graph(place, network_type='drive'):
+    """Descarga y proyecta la red de calles desde OpenStreetMap (lento, requiere red)."""
+    import osmnx as ox
+    G = ox.graph_from_place(place, network_type=network_type)
+    G_proj = ox.project_graph(G)
+    return from_networkx(G_proj, place, network_type)
+
+
+# --- Persistencia en disco ---
+def cache_key(place, network_type):
+    raw = f"{place}|{network_type}|v{GRAPH_STORE_VERSION}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_path(place, network_type, cache_dir=DEFAULT_CACHE_DIR):
+    slug = re.sub(r'[^a-z0-9]+', '-', place.lower()).strip('-')[:40]
+    return os.path.join(cache_dir, f"{slug}-{network_type}-{cache_key(place, network_type)}")
+
+
+def save(street_graph, path):
+    """Guarda el grafo como un directorio de arrays .npy más un `meta.json`."""
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name, array in street_graph.arrays().items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+    meta = {
+        'version': GRAPH_STORE_VERSION,
+        'key': cache_key(street_graph.place or '', street_graph.network_type or ''),
+        'place': street_graph.place,
+        'network_type': street_graph.network_type,
+        'crs': str(street_graph.crs),
+        'num_nodes': street_graph.num_nodes,
+        'num_edges': street_graph.num_edges,
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+    # El meta se escribe al final: un directorio sin meta.json se considera incompleto
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load(path, mmap=True):
+    """Carga un grafo guardado con `save`. Con `mmap=True` los arrays se mapean en memoria."""
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f"No hay un grafo válido en {path}")
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in NODE_ARRAYS + EDGE_ARRAYS}
+    street_graph = StreetGraph(arrays, meta['crs'], meta['place'], meta['network_type'])
+    street_graph.path = path
+    return street_graph
+
+
+def is_valid(path, place, network_type):
+    meta = read_meta(path)
+    return (meta is not None
+            and meta.get('version') == GRAPH_STORE_VERSION
+            and meta.get('key') == cache_key(place, network_type))
+
+
+def load_street_graph(place, network_type='drive', cache_dir=DEFAULT_CACHE_DIR, fixture_path=None, rebuild=False):
+    """
+    Devuelve la red de calles desde el caché local si existe y es vigente.
+    Si no, la construye (desde el fixture indicado o descargándola) y la guarda.
+    """
+    if fixture_path:
+        # Modo sin conexión: el contenido del fixture reemplaza al lugar como clave del caché
+        with open(fixture_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:12]
+        place = f"fixture:{os.path.basename(fixture_path)}:{digest}"
+    path = cache_path(place, network_type, cache_dir)
+
+    if not rebuild and is_valid(path, place, network_type):
+        return load(path)
+
+    if fixture_path:
+        street_graph = load_fixture(fixture_path)
+    else:
+        street_graph = download_graph(place, network_type)
+    street_graph.place = place
+    street_graph.network_type = network_type
+    save(street_graph, path)
+    return load(path)
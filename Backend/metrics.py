@@ -0,0 +1,270 @@
+import bisect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Métricas del Simulador (formato de texto de Prometheus) ---
+# Contadores, gauges e histogramas en memoria, sin dependencias. Registrar un valor es tomar
+# un lock por métrica y sumar; el texto se arma sólo cuando alguien consulta /metrics.
+# `MetricsServer` los sirve en 127.0.0.1 (ver SIM_METRICS_PORT en data4.py).
+DEFAULT_METRICS_PORT = 8352
+# Límites (segundos) de los histogramas de latencia: de 1 ms a 1 minuto
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """Conjunto de métricas que se exportan juntas."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self.labels()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        """La serie con esos valores de etiqueta (se crea la primera vez)."""
+        key = tuple(str(v) for v in values) or tuple(str(kwargs[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        # Métricas sin etiquetas: una sola serie
+        return self.labels()
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        lines = []
+        for key, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, key))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, key):
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(value)}"]
+
+
+class _GaugeValue(_Value):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """El valor se calcula al exportar (p. ej. la profundidad del spool)."""
+        self.function = function
+
+
+class _HistogramValue:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self.observe)
+
+    def samples(self, name, labelnames, key):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(list(self.bounds) + [math.inf], counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labelnames, key, [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    """Context manager que registra la duración del bloque (segundos)."""
+
+    def __init__(self, observe):
+        self.observe = observe
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.observe(time.perf_counter() - self.start)
+
+
+class Counter(_Metric):
+    """Valor que sólo crece (lecturas enviadas, rechazos, ...)."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja (profundidad del spool, atraso de un dispositivo, ...)."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class Histogram(_Metric):
+    """Distribución de duraciones en `buckets` acumulados, más su suma y cantidad."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+# --- Métricas del Simulador ---
+TICK_SECONDS = Histogram("sim_tick_seconds", "Duración de un tick (un dispositivo o toda la flota).", ["engine"])
+# Sin etiqueta por dispositivo (una serie por dispositivo no escala): la distribución del atraso
+# de todos sale del histograma, p. ej. histogram_quantile(0.99, sim_schedule_lag_seconds_bucket)
+SCHEDULE_LAG_SECONDS = Histogram("sim_schedule_lag_seconds", "Atraso del inicio de cada tick respecto de su hora programada.", ["engine"])
+SCHEDULE_OVERRUNS = Counter("sim_schedule_overruns_total", "Ticks saltados (\"busy\") o despachados con más de un intervalo de atraso (\"late\").", ["kind"])
+ROUTE_GENERATION_SECONDS = Histogram("sim_route_generation_seconds", "Tiempo para obtener una ruta aleatoria (incluye aciertos del caché).")
+SHORTEST_PATH_SECONDS = Histogram("sim_shortest_path_seconds", "Tiempo de cada búsqueda de camino más corto (fallos del caché de rutas).")
+ROUTE_METRIC_SECONDS = Histogram("sim_route_metric_seconds", "Tiempo para personalizar la jerarquía de contracción con una métrica (p. ej. al cambiar de franja horaria).")
+ROUTE_CACHE_LOOKUPS = Counter("sim_route_cache_lookups_total", "Consultas al caché de rutas.", ["result"])
+STATION_DISPATCHES = Counter("sim_station_dispatches_total", "Dispositivos con batería baja enviados a una estación (\"station\") o a cargar donde están (\"in_place\").", ["result"])
+READINGS = Counter("sim_readings_total", "Lecturas generadas.", ["engine"])
+UPLOAD_SECONDS = Histogram("sim_upload_seconds", "Latencia de cada envío a ThingSpeak.", ["mode"])
+UPLOADED_READINGS = Counter("sim_uploaded_readings_total", "Lecturas aceptadas por ThingSpeak.", ["mode"])
+UPLOAD_REJECTIONS = Counter("sim_upload_rejections_total", "Envíos rechazados por ThingSpeak (\"0\" o success=false).", ["mode"])
+UPLOAD_ERRORS = Counter("sim_upload_errors_total", "Envíos fallidos por error de conexión o HTTP.", ["mode"])
+SPOOL_DEPTH = Gauge("sim_spool_depth", "Lecturas pendientes de subir (spool en disco o cola del uplink).")
+
+
+class MetricsServer:
+    """Servidor HTTP en 127.0.0.1 que expone `registry` en /metrics."""
+
+    def __init__(self, port=DEFAULT_METRICS_PORT, registry=REGISTRY, host='127.0.0.1'):
+        self.registry = registry
+        self.server = ThreadingHTTPServer((host, port), _make_handler(registry))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _make_handler(registry):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
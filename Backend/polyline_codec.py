@@ -0,0 +1,150 @@
+import numpy as np
+
+# --- Codificación Polyline Vectorizada ---
+# Mismo formato que `polyline.encode` (Google Encoded Polyline, precisión 5), pero para las
+# trayectorias de todos los dispositivos de un tick a la vez y directo desde arrays lat/lon
+# sin redondear (redondear a 6 decimales antes de cuantizar a 5 perdía precisión dos veces).
+#
+# Modo continuo: el trozo de cada tick se codifica como delta desde el último punto enviado
+# en el tick anterior del mismo viaje y se omiten los puntos que repiten al anterior. Así,
+# concatenar los `field6` consecutivos de un viaje da una Polyline válida del viaje
+# completo, sin puntos duplicados en las uniones.
+PRECISION = 5
+# |lat|, |lon| <= 180 a precisión 5, en zigzag, caben en 6 grupos de 5 bits
+MAX_CHUNKS = 6
+
+
+def quantize(values, precision=PRECISION):
+    """Coordenadas -> enteros de la Polyline, redondeando como `polyline` (mitades lejos del cero)."""
+    scaled = np.asarray(values, dtype=np.float64) * 10 ** precision
+    return (np.copysign(np.floor(np.abs(scaled) + 0.5), scaled)).astype(np.int64)
+
+
+def _encode_values(deltas):
+    """Enteros con signo -> bytes ASCII de la Polyline y cantidad de caracteres de cada valor."""
+    zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    shifts = 5 * np.arange(MAX_CHUNKS)
+    groups = (zigzag[:, None] >> shifts) & 0x1f
+    # Cantidad de grupos de 5 bits de cada valor (al menos uno)
+    nchunks = np.maximum(1, (np.sum((zigzag[:, None] >> shifts) > 0, axis=1)))
+    used = np.arange(MAX_CHUNKS) < nchunks[:, None]
+    more = np.arange(MAX_CHUNKS) < (nchunks - 1)[:, None]
+    chars = (groups | np.where(more, 0x20, 0)) + 63
+    return chars[used].astype(np.uint8), nchunks
+
+
+def encode_batch(lat, lon, offsets, previous=None, new_trip=None, min_points=2):
+    """
+    Codifica la trayectoria de cada dispositivo: los puntos `offsets[i]:offsets[i + 1]` de
+    `lat`/`lon` son del dispositivo i. Devuelve la lista de strings.
+
+    Sin `previous`, cada trozo es una Polyline independiente ("" si tiene menos de
+    `min_points` puntos). Con `previous` (array (N, 2) de enteros cuantizados del último
+    punto enviado por cada dispositivo, que se actualiza en el lugar) se codifica en modo
+    continuo; `new_trip[i]` indica que el dispositivo i empezó un viaje y su trozo parte de cero.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(offsets) - 1
+    points = np.column_stack((quantize(lat), quantize(lon)))
+    counts = np.diff(offsets)
+    device = np.repeat(np.arange(n), counts)
+    is_first = np.zeros(len(points), dtype=bool)
+    is_first[offsets[:-1][counts > 0]] = True
+
+    # Punto anterior de cada punto: el previo del mismo trozo, o la referencia del trozo
+    base = np.zeros_like(points)
+    base[1:] = points[:-1]
+    keep = np.ones(len(points), dtype=bool)
+    if previous is None:
+        base[is_first] = 0
+        keep &= (counts >= min_points)[device]
+    else:
+        fresh = np.asarray(new_trip, dtype=bool) if new_trip is not None else np.zeros(n, dtype=bool)
+        firsts = np.flatnonzero(is_first)
+        reference = np.where(fresh[device[firsts]][:, None], 0, previous[device[firsts]])
+        base[firsts] = reference
+        # Un punto igual al anterior (en la unión con el tick previo o dentro del trozo) no se manda
+        keep = np.any(points != base, axis=1)
+        keep[firsts[fresh[device[firsts]]]] = True
+        last = offsets[1:][counts > 0] - 1
+        previous[device[last]] = points[last]
+
+    chars, nchunks = _encode_values((points - base)[keep].ravel())
+    # Caracteres por dispositivo -> cortes del buffer
+    point_chars = nchunks.reshape(-1, 2).sum(axis=1)
+    per_device = np.bincount(device[keep], weights=point_chars, minlength=n).astype(np.int64)
+    ends = np.cumsum(per_device)
+    text = chars.tobytes().decode('ascii')
+    return [text[e - c:e] for e, c in zip(ends.tolist(), per_device.tolist())]
+
+
+class TrajectoryEncoder:
+    """
+    Codificador con estado para `num_devices` dispositivos. En modo continuo recuerda el
+    último punto enviado y el viaje de cada dispositivo: el primer trozo de un viaje nuevo
+    es una Polyline completa y los siguientes continúan desde donde quedó el anterior.
+    """
+
+    def __init__(self, num_devices, continuous=False):
+        self.continuous = continuous
+        self.previous = np.zeros((num_devices, 2), dtype=np.int64)
+        self.trip_id = np.full(num_devices, -1, dtype=np.int64)
+
+    def encode(self, lat, lon, offsets, trip_ids=None):
+        if not self.continuous:
+            return encode_batch(lat, lon, offsets)
+        trip_ids = np.asarray(trip_ids, dtype=np.int64)
+        sent = np.diff(offsets) > 0
+        new_trip = trip_ids != self.trip_id
+        encoded = encode_batch(lat, lon, offsets, previous=self.previous, new_trip=new_trip)
+        # Sólo cuenta como enviado el viaje de quienes mandaron puntos en este tick
+        self.trip_id[sent] = trip_ids[sent]
+        return encoded
+
+
+# --- Decodificación ---
+def decode_values(encoded):
+    """Polyline -> array (N, 2) de enteros: los deltas tal como vienen en el texto."""
+    data = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if not len(data):
+        return np.zeros((0, 2), dtype=np.int64)
+    # Cada valor termina en el primer grupo sin el bit de continuación (0x20)
+    ends = data < 0x20
+    value = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    position = np.arange(len(data)) - starts[value]
+    zigzag = np.bincount(value, weights=(data & 0x1f) << (5 * position)).astype(np.int64)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    return deltas[:len(deltas) // 2 * 2].reshape(-1, 2)
+
+
+def decode_points(encoded, previous=None):
+    """
+    Puntos cuantizados (N, 2) de una Polyline. Con `previous` (el último punto cuantizado
+    de un trozo anterior) se decodifica como continuación, igual que la codifica el modo continuo.
+    """
+    points = np.cumsum(decode_values(encoded), axis=0)
+    if previous is not None:
+        points += np.asarray(previous, dtype=np.int64)
+    return points
+
+
+def encode_points(points, previous=None):
+    """
+    Puntos cuantizados (N, 2) -> Polyline, como deltas desde `previous` (o desde cero). Se
+    omiten los puntos que repiten al anterior, así el resultado se puede concatenar.
+    """
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    base = np.empty_like(points)
+    base[:1] = previous if previous is not None else 0
+    base[1:] = points[:-1]
+    keep = np.any(points != base, axis=1)
+    if previous is None and len(keep):
+        keep[0] = True
+    chars, _ = _encode_values((points - base)[keep].ravel())
+    return chars.tobytes().decode('ascii')
+
+
+def dequantize(points, precision=PRECISION):
+    """Enteros de la Polyline -> coordenadas (lat, lon)."""
+    return np.asarray(points, dtype=np.float64) / 10 ** precision
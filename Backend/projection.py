@@ -0,0 +1,45 @@
+import threading
+
+import numpy as np
+from pyproj import Transformer
+
+# --- Transformación de Coordenadas por Lotes ---
+# Un Transformer de pyproj por par de CRS y por hilo: crearlo es caro (y construir un
+# GeoDataFrame por punto, como hace `ox.projection.project_geometry`, lo es mucho más).
+LATLON_CRS = 'epsg:4326'
+_local = threading.local()
+
+
+def get_transformer(crs_from, crs_to):
+    cache = getattr(_local, 'transformers', None)
+    if cache is None:
+        cache = _local.transformers = {}
+    key = (str(crs_from), str(crs_to))
+    if key not in cache:
+        cache[key] = Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    return cache[key]
+
+
+def to_latlon(x, y, crs):
+    """Desproyecta arrays de coordenadas del CRS `crs` a arrays (lat, lon)."""
+    lon, lat = get_transformer(crs, LATLON_CRS).transform(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    return lat, lon
+
+
+def to_projected(lat, lon, crs):
+    """Proyecta arrays (lat, lon) al CRS `crs`. Devuelve arrays (x, y)."""
+    return get_transformer(LATLON_CRS, crs).transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+
+
+def unproject_coords(coords_xy, crs):
+    """Array (N, 2) de coordenadas proyectadas (x, y) -> array (N, 2) de (lat, lon)."""
+    coords_xy = np.asarray(coords_xy, dtype=np.float64).reshape(-1, 2)
+    lat, lon = to_latlon(coords_xy[:, 0], coords_xy[:, 1], crs)
+    return np.column_stack((lat, lon))
+
+
+def project_coords(coords_latlon, crs):
+    """Array (N, 2) de (lat, lon) -> array (N, 2) de coordenadas proyectadas (x, y)."""
+    coords_latlon = np.asarray(coords_latlon, dtype=np.float64).reshape(-1, 2)
+    x, y = to_projected(coords_latlon[:, 0], coords_latlon[:, 1], crs)
+    return np.column_stack((x, y))
@@ -0,0 +1,315 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from energy_model import flat_energy_per_m
+from metrics import ROUTE_CACHE_LOOKUPS, ROUTE_GENERATION_SECONDS, ROUTE_METRIC_SECONDS, SHORTEST_PATH_SECONDS
+from sim_model import get_chile_current_time
+
+_CACHE_HITS = ROUTE_CACHE_LOOKUPS.labels('hit')
+_CACHE_MISSES = ROUTE_CACHE_LOOKUPS.labels('miss')
+
+
+# --- Representación de Rutas con Distancia Acumulada ---
+def cumulative_lengths(coords):
+    """Distancia acumulada (m) a lo largo de una polilínea proyectada (N, 2); empieza en 0."""
+    cum = np.zeros(len(coords), dtype=np.float64)
+    if len(coords) > 1:
+        np.cumsum(np.hypot(*np.diff(coords, axis=0).T), out=cum[1:])
+    return cum
+
+
+class Route:
+    """
+    Ruta proyectada como array contiguo de coordenadas más su distancia acumulada y su
+    energía acumulada (Wh, ver energy_model.py). Avanzar una distancia es una búsqueda
+    binaria y una interpolación, sin importar cuántos puntos tenga la ruta. `edges` es la
+    arista de la calle de cada punto (ver `CSRGraph.path_edges`), con la que se leen las
+    tablas de velocidad (ver speed_model.py); `None` si la ruta no viene del grafo.
+    """
+
+    def __init__(self, coords, cum=None, energy=None, edges=None):
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+        # `cum` y `energy` precalculados pueden venir desplazados (un tramo de una ruta más larga): sólo importan las diferencias
+        self.cum = cumulative_lengths(self.coords) if cum is None else cum
+        # Sin perfil de energía (grafo sin anotar) se asume calle plana y pavimentada
+        self.energy = self.cum * flat_energy_per_m() if energy is None else energy
+        self.edges = edges
+        # (modelo, franja, tiempos) del último `travel_times`: todos los dispositivos comparten el reloj
+        self._times = None
+
+    def __len__(self):
+        return len(self.coords)
+
+    @property
+    def last_index(self):
+        return len(self.coords) - 1
+
+    @property
+    def length(self):
+        return self.cum[-1] - self.cum[0] if len(self.cum) else 0.0
+
+    def advance(self, index, distance):
+        """
+        Avanza `distance` metros desde el vértice `index`. Devuelve el último vértice
+        alcanzado y la trayectoria recorrida: una vista `coords[index:j + 1]`, más el
+        punto interpolado final cuando la ruta no se completó.
+        """
+        if distance <= 0 or index >= self.last_index:
+            return index, self.coords[index:index + 1]
+        target = self.cum[index] + distance
+        j = int(np.searchsorted(self.cum, target, side='right')) - 1
+        j = min(max(j, index), self.last_index)
+        if j == self.last_index:
+            return j, self.coords[index:]
+        ratio = (target - self.cum[j]) / (self.cum[j + 1] - self.cum[j])
+        point = self.coords[j] + ratio * (self.coords[j + 1] - self.coords[j])
+        return j, np.vstack((self.coords[index:j + 1], point))
+
+    def travel_times(self, speed_model, bucket):
+        """Tiempo acumulado (s) en cada punto según las tablas de `speed_model` en la franja `bucket`."""
+        cached = self._times
+        if cached is not None and cached[0] is speed_model and cached[1] == bucket:
+            return cached[2]
+        times = speed_model.route_times(self.edges, self.cum, bucket)
+        self._times = (speed_model, bucket, times)
+        return times
+
+    def distance_in(self, index, seconds, times):
+        """Metros que se recorren en `seconds` segundos desde el vértice `index`, con los tiempos acumulados `times`."""
+        if seconds <= 0 or index >= self.last_index:
+            return 0.0
+        target = times[index] + seconds
+        if target >= times[-1]:
+            return float(self.cum[-1] - self.cum[index])
+        j = int(np.searchsorted(times, target, side='right')) - 1
+        ratio = (target - times[j]) / (times[j + 1] - times[j])
+        return float(self.cum[j] + ratio * (self.cum[j + 1] - self.cum[j]) - self.cum[index])
+
+    def energy_used(self, index, distance):
+        """Energía (Wh) para avanzar `distance` metros desde el vértice `index` (hasta el final como máximo)."""
+        if distance <= 0 or index >= self.last_index:
+            return 0.0
+        target = min(self.cum[index] + distance, self.cum[-1])
+        return float(np.interp(target, self.cum, self.energy) - self.energy[index])
+
+
+# --- Generación de Rutas sobre la Red de Calles ---
+def random_node_pair(nodes, rng):
+    """
+    Par (origen, destino) de nodos distintos elegidos al azar. `rng` puede ser un generador
+    de NumPy o un `random.Random` (sólo se usa `rng.random()`).
+    """
+    origin_node = nodes[int(rng.random() * len(nodes))]
+    destination_node = nodes[int(rng.random() * len(nodes))]
+    while origin_node == destination_node:
+        destination_node = nodes[int(rng.random() * len(nodes))]
+    return origin_node, destination_node
+
+
+# --- Servicio de Rutas con Caché ---
+class RouteService:
+    """
+    Memoiza (origen, destino) -> `Route` en un caché LRU acotado y, opcionalmente,
+    precalcula las rutas entre un conjunto de nodos "hub" (estacionamientos, docks)
+    con un árbol de Dijkstra por hub. Las búsquedas corren sobre un `CSRGraph`.
+    Con un `spatial_index.TripSampler` los viajes aleatorios son de largo acotado y siempre
+    tienen camino. Es seguro para usar desde varios hilos. Las rutas son de solo lectura y
+    se comparten: los dispositivos que recorren el mismo par guardan una referencia a la misma.
+    `weight` es lo que minimizan las búsquedas: 'length' (metros), 'energy' (Wh, requiere
+    `CSRGraph.set_edge_energy`) o 'time' (segundos según las tablas de `speed_model` en la
+    franja horaria de salida). Con `hierarchy` (`contraction.ContractionHierarchy`, obligatoria
+    para 'time') cada búsqueda es una consulta a la jerarquía personalizada con ese peso; las
+    personalizaciones por franja se guardan en un LRU de `metric_cache_size`. Por tiempo de
+    viaje las rutas entre hubs se precalculan por franja, al personalizar cada una.
+    """
+
+    def __init__(self, graph, cache_size=4096, hubs=None, trips=None, weight='length', hierarchy=None,
+                 speed_model=None, metric_cache_size=2):
+        if weight == 'time' and (hierarchy is None or speed_model is None):
+            raise ValueError("Las rutas por tiempo de viaje requieren la jerarquía de contracción y el modelo de velocidades")
+        self.graph = graph
+        self.cache_size = cache_size
+        self.trips = trips
+        self.weight = weight
+        self.hierarchy = hierarchy
+        self.speed_model = speed_model
+        self.metric_cache_size = metric_cache_size
+        self.hubs = []
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._hub_routes = {}
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+        self._metric_lock = threading.Lock()
+        if hubs:
+            self.precompute_hubs(hubs)
+
+    def precompute_hubs(self, hubs):
+        """
+        Calcula las rutas entre todos los pares de hubs (un Dijkstra de fuente única por hub). Por
+        tiempo de viaje dependen de la franja de salida: se calculan en `metric`, una vez por franja.
+        """
+        self.hubs = list(dict.fromkeys(hubs))
+        if self.weight == 'time':
+            return
+        hub_set = set(self.hubs)
+        for origin_node in self.hubs:
+            _, pred = self.graph.dijkstra(self.graph.index_of(origin_node), weight=self.weight)
+            for destination_node in hub_set:
+                if destination_node == origin_node:
+                    continue
+                path = self.graph.tree_path(pred, self.graph.index_of(destination_node))
+                self._hub_routes[(origin_node, destination_node)] = path_route(self.graph, path)
+
+    def time_bucket(self, bucket=None):
+        """Franja horaria de las búsquedas por tiempo (por defecto, la de la hora actual); `None` con otros pesos."""
+        if self.weight != 'time':
+            return None
+        return self.speed_model.bucket(get_chile_current_time()) if bucket is None else bucket
+
+    def metric(self, bucket=None):
+        """Jerarquía personalizada con el peso del servicio (de la franja `bucket` si es 'time')."""
+        with self._metric_lock:
+            if bucket in self._metrics:
+                self._metrics.move_to_end(bucket)
+                return self._metrics[bucket]
+            # Se personaliza con el lock tomado: los demás hilos esperan en vez de repetir el trabajo
+            graph = self.graph
+            if self.weight == 'time':
+                weights = self.speed_model.edge_travel_time(graph.weights, bucket, graph.edge_ref)
+            elif self.weight == 'energy':
+                if graph.energy is None:
+                    raise ValueError("El grafo no tiene energía por arista (ver CSRGraph.set_edge_energy)")
+                weights = graph.energy
+            else:
+                weights = graph.weights
+            with ROUTE_METRIC_SECONDS.time():
+                metric = self.hierarchy.customize(weights)
+            self._metrics[bucket] = metric
+            evicted = []
+            while len(self._metrics) > self.metric_cache_size:
+                evicted.append(self._metrics.popitem(last=False)[0])
+            if self.weight == 'time' and self.hubs:
+                self._precompute_bucket_hubs(metric, bucket, evicted)
+            return metric
+
+    def _precompute_bucket_hubs(self, metric, bucket, evicted):
+        """Rutas entre todos los pares de hubs saliendo en la franja `bucket` (consultas a la jerarquía)."""
+        routes = {}
+        for origin_node in self.hubs:
+            source = self.graph.index_of(origin_node)
+            for destination_node in self.hubs:
+                if destination_node != origin_node:
+                    path = metric.shortest_path(source, self.graph.index_of(destination_node))
+                    routes[(origin_node, destination_node, bucket)] = path_route(self.graph, path)
+        with self._lock:
+            # Las de las franjas que salieron del LRU se descartan junto con su personalización
+            for key in [k for k in self._hub_routes if k[2] in evicted]:
+                del self._hub_routes[key]
+            self._hub_routes.update(routes)
+
+    def shortest_path(self, origin_node, destination_node, bucket=None):
+        """Camino más corto (índices internos) entre dos IDs OSM, con la jerarquía si la hay, o `None`."""
+        if self.hierarchy is None:
+            return self.graph.shortest_path(origin_node, destination_node, self.weight)
+        metric = self.metric(self.time_bucket(bucket))
+        with SHORTEST_PATH_SECONDS.time():
+            return metric.shortest_path(self.graph.index_of(origin_node), self.graph.index_of(destination_node))
+
+    def route(self, origin_node, destination_node, bucket=None):
+        """
+        `Route` compartida (solo lectura) de la ruta más corta, o `None` si no hay camino. Por
+        tiempo de viaje, `bucket` es la franja horaria de salida (por defecto, la actual).
+        """
+        bucket = self.time_bucket(bucket)
+        key = (origin_node, destination_node) if bucket is None else (origin_node, destination_node, bucket)
+        if bucket is not None and self.hubs:
+            # Personalizar la franja deja listas sus rutas entre hubs
+            self.metric(bucket)
+        with self._lock:
+            if key in self._hub_routes:
+                self.hits += 1
+                _CACHE_HITS.inc()
+                return self._hub_routes[key]
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                _CACHE_HITS.inc()
+                return self._cache[key]
+            self.misses += 1
+        _CACHE_MISSES.inc()
+
+        # La búsqueda se hace fuera del lock para no serializar a los demás hilos
+        if self.hierarchy is None:
+            with SHORTEST_PATH_SECONDS.time():
+                path = self.graph.shortest_path(origin_node, destination_node, self.weight)
+        else:
+            path = self.shortest_path(origin_node, destination_node, bucket)
+        route = path_route(self.graph, path)
+        with self._lock:
+            # También se guardan los pares sin camino, para no repetir búsquedas fallidas
+            self._cache[key] = route
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return route
+
+    def random_route(self, rng, nodes_proj=None, bucket=None):
+        """
+        Ruta aleatoria entre hubs (si hay) o con origen en `nodes_proj`, o `None` si no hay camino.
+        `bucket` es la franja horaria de salida (sólo cuenta con el peso 'time').
+        """
+        with ROUTE_GENERATION_SECONDS.time():
+            return self._random_route(rng, nodes_proj, bucket)
+
+    def _random_route(self, rng, nodes_proj, bucket):
+        if self.hubs:
+            return self.route(*random_node_pair(self.hubs, rng), bucket=bucket)
+        if self.trips is not None:
+            trip = self.trips.random_trip(rng, nodes_proj)
+            return self.route(*trip, bucket=bucket) if trip is not None else None
+        return self.route(*random_node_pair(nodes_proj, rng), bucket=bucket)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'cached_routes': len(self._cache),
+                'hub_routes': len(self._hub_routes),
+                'metrics': len(self._metrics),
+            }
+
+
+def path_route(graph, path, with_start=False):
+    """
+    `Route` compartida (geometría y energía) de un camino de índices internos de `graph`, o
+    `None`. Con `with_start` la geometría empieza en el nodo de origen (la convención de
+    `CSRGraph.path_energy(..., with_start=True)`) aunque el primer tramo no tenga geometría.
+    """
+    if path is None or len(path) < 2:
+        return None
+    # Las aristas del camino se buscan una sola vez para la geometría, la energía y las calles
+    hops = graph.hop_edges(path)
+    if not with_start:
+        return _frozen(Route(graph.path_geometry(path, hops), energy=graph.path_energy(path, hops=hops),
+                             edges=graph.path_edges(path, hops=hops)))
+    gather, _ = graph.hop_geometry(hops, with_edge_start=False)
+    coords = np.vstack(([graph.x[path[0]], graph.y[path[0]]], graph.geom_xy[gather]))
+    return _frozen(Route(coords, energy=graph.path_energy(path, with_start=True, hops=hops),
+                         edges=graph.path_edges(path, with_start=True, hops=hops)))
+
+
+def _frozen(route):
+    """Marca los arrays de la ruta como solo lectura: las rutas del caché se comparten entre dispositivos."""
+    route.coords.flags.writeable = False
+    route.cum.flags.writeable = False
+    route.energy.flags.writeable = False
+    if route.edges is not None:
+        route.edges.flags.writeable = False
+    return route
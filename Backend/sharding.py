@@ -0,0 +1,294 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import time
+
+import numpy as np
+
+from contraction import load_hierarchy
+from csr_graph import CSRGraph
+from fleet import Fleet
+from graph_store import DEFAULT_CACHE_DIR, load_street_graph, read_meta
+from routing import RouteService
+from sim_log import start_logging, stop_logging
+from sim_clock import VirtualClock, WallClock, parse_start_time
+from sim_model import UPDATE_INTERVAL
+from speed_model import SpeedModel
+from spatial_index import DEFAULT_TRIP_MAX_DISTANCE, DEFAULT_TRIP_MIN_DISTANCE, NodeGrid, TripSampler
+from stations import StationNetwork
+from trajectories import MatchedTrajectory, PredefinedTrajectories
+from trip_ids import DEFAULT_BLOCK_SIZE, DEFAULT_TRIP_ID_PATH, TripIdAllocator
+from uplink import make_update
+
+# --- Simulación Repartida en Procesos ---
+# Cada proceso simula una región del mapa con su propio `Fleet`: origen y destino de los
+# viajes caen dentro de la región, así que las rutas y el caché de rutas de cada proceso
+# quedan locales. El grafo no se copia a los procesos: cada uno lo abre desde el caché en
+# disco (archivos .npy mapeados en memoria) y el sistema operativo comparte las páginas.
+# Lo mismo con lo que se deriva del grafo (CSR, energía por arista, componentes, grilla,
+# tablas de velocidad, campo de distancias a estaciones, trayectorias predefinidas y
+# regiones): el proceso principal ya lo calculó, lo guarda junto al caché del grafo en
+# `<grafo>/shards/` y los procesos lo mapean en vez de recalcularlo cada uno.
+# Los procesos devuelven las lecturas ya armadas y el proceso principal las sube.
+
+# Ticks que un proceso puede adelantarse al consumidor antes de bloquearse
+QUEUE_TICKS_PER_WORKER = 4
+# Cambiar este número invalida los arrays compartidos ya guardados
+SHARED_ARRAYS_VERSION = 1
+SHARED_DIR = 'shards'
+
+
+def region_labels(x, y, num_regions):
+    """
+    Reparte los nodos en `num_regions` regiones compactas y de tamaño parecido mediante
+    bisecciones sucesivas por la mediana del eje más largo. Devuelve la región de cada nodo.
+    """
+    labels = np.zeros(len(x), dtype=np.int32)
+
+    def split(members, first_label, count):
+        if count == 1 or len(members) == 0:
+            labels[members] = first_label
+            return
+        px, py = x[members], y[members]
+        coords = px if np.ptp(px) >= np.ptp(py) else py
+        left = count // 2
+        order = members[np.argsort(coords, kind='stable')]
+        cut = len(order) * left // count
+        split(order[:cut], first_label, left)
+        split(order[cut:], first_label + left, count - left)
+
+    split(np.arange(len(x)), 0, max(1, num_regions))
+    return labels
+
+
+def shard_device_ids(num_devices, num_shards):
+    """IDs de dispositivo (1..N) repartidos en bloques contiguos, uno por proceso."""
+    return [ids.astype(np.int64) for ids in np.array_split(np.arange(1, num_devices + 1), num_shards)]
+
+
+def shared_arrays_path(street_graph, num_shards, settings):
+    """Directorio de los arrays compartidos para este grafo, esta cantidad de regiones y esta configuración."""
+    elevation = settings.get('elevation_path')
+    raw = json.dumps([num_shards, elevation, os.path.getmtime(elevation) if elevation and os.path.exists(elevation) else None,
+                      settings.get('route_weight', 'length'), settings.get('station_nodes') or [],
+                      settings.get('predefined_polylines') if settings.get('predefined_devices') else []])
+    return os.path.join(street_graph.path, SHARED_DIR, hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16])
+
+
+def _shared_stamp(street_graph):
+    meta = read_meta(street_graph.path)
+    return f"{meta['key']}:{meta['created']}:v{SHARED_ARRAYS_VERSION}" if meta else ''
+
+
+def save_shared_arrays(path, street_graph, graph, trips, speed_model, num_shards, stations=None, predefined=None):
+    """
+    Guarda como archivos .npy lo que el proceso principal ya derivó del grafo, para que los
+    procesos lo mapeen (ver `load_shared_arrays`). Si ya está guardado para esta versión del
+    grafo no hace nada.
+    """
+    stamp = _shared_stamp(street_graph)
+    meta = read_meta(path)
+    if meta is not None and meta.get('stamp') == stamp:
+        return path
+    arrays = dict(zip(('indptr', 'indices', 'weights', 'edge_ref'), graph.csr_arrays()))
+    arrays['energy'] = graph.energy
+    arrays['region'] = region_labels(graph.x, graph.y, num_shards)
+    arrays['component'] = trips.component
+    arrays['grid_order'], arrays['grid_cell_start'] = trips.grid.order, trips.grid.cell_start
+    arrays.update(speed_model.tables())
+    if stations is not None:
+        arrays['station_distance'], arrays['station'], arrays['station_next'] = \
+            stations.distance, stations.station, stations.next_node
+    if predefined is not None and len(predefined):
+        # Todas las trayectorias concatenadas; `*_offsets` marca dónde empieza cada una
+        trajectories = predefined.trajectories
+        for name in ('coords', 'cum', 'energy', 'edges', 'nodes', 'point_index'):
+            parts = [getattr(t, name) for t in trajectories]
+            if any(part is None for part in parts):
+                continue
+            arrays[f"trajectory_{name}"] = np.concatenate(parts)
+            arrays[f"trajectory_{name}_offsets"] = np.concatenate(([0], np.cumsum([len(p) for p in parts])))
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, array in arrays.items():
+        if array is not None:
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+    # El meta se escribe al final: un directorio sin meta.json se considera incompleto
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'stamp': stamp, 'arrays': sorted(n for n, a in arrays.items() if a is not None)}, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def load_shared_arrays(path):
+    """Arrays guardados con `save_shared_arrays`, mapeados en memoria (solo lectura)."""
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f"No hay arrays compartidos válidos en {path}")
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in meta['arrays']}
+
+
+def _shared_trajectories(arrays):
+    """`PredefinedTrajectories` sobre vistas de los arrays compartidos."""
+    if 'trajectory_coords' not in arrays:
+        return PredefinedTrajectories([])
+    names = ('coords', 'cum', 'nodes', 'point_index', 'energy', 'edges')
+    count = len(arrays['trajectory_coords_offsets']) - 1
+    trajectories = []
+    for k in range(count):
+        parts = []
+        for name in names:
+            offsets = arrays.get(f"trajectory_{name}_offsets")
+            parts.append(arrays[f"trajectory_{name}"][offsets[k]:offsets[k + 1]] if offsets is not None else None)
+        trajectories.append(MatchedTrajectory(*parts))
+    return PredefinedTrajectories(trajectories)
+
+
+def _run_shard(shard, num_shards, device_ids, settings, out_queue, stop_event):
+    """Cuerpo de cada proceso: simula los `device_ids` sobre su región y publica cada tick."""
+    # El hilo de escritura de mensajes no pasa por el fork: el proceso arma el suyo
+    start_logging()
+    try:
+        _simulate_shard(shard, device_ids, settings, out_queue, stop_event)
+    finally:
+        stop_logging()
+
+
+def _simulate_shard(shard, device_ids, settings, out_queue, stop_event):
+    street_graph = load_street_graph(settings['place'], network_type=settings.get('network_type', 'drive'),
+                                     cache_dir=settings.get('cache_dir', DEFAULT_CACHE_DIR),
+                                     fixture_path=settings.get('fixture_path'))
+    shared = load_shared_arrays(settings['shared_path'])
+    graph = CSRGraph.from_street_graph(street_graph, csr=(shared['indptr'], shared['indices'], shared['weights'],
+                                                          shared['edge_ref']))
+    graph.energy = shared.get('energy')
+    region_nodes = graph.node_ids[shared['region'] == shard].tolist()
+    region_set = set(region_nodes)
+    hubs = [h for h in settings.get('hubs') or () if h in region_set] or settings.get('hubs')
+    grid = NodeGrid(graph.x, graph.y, index=(shared['grid_order'], shared['grid_cell_start']))
+    trips = TripSampler(graph, min_distance=settings.get('trip_min_distance', DEFAULT_TRIP_MIN_DISTANCE),
+                        max_distance=settings.get('trip_max_distance', DEFAULT_TRIP_MAX_DISTANCE),
+                        component=shared['component'], grid=grid)
+    speed_model = SpeedModel(street_graph, tables=shared)
+    # La jerarquía ya quedó en el caché del grafo (la arma el proceso principal): aquí sólo se lee
+    hierarchy = load_hierarchy(street_graph, graph) if settings.get('route_hierarchy') else None
+    route_service = RouteService(graph, cache_size=settings.get('route_cache_size', 4096), hubs=hubs, trips=trips,
+                                 weight=settings.get('route_weight', 'length'), hierarchy=hierarchy,
+                                 speed_model=speed_model)
+    # Las estaciones son las mismas para todas las regiones: se puede ir a cargar a otra
+    stations = None
+    if settings.get('station_nodes'):
+        stations = StationNetwork(graph, settings['station_nodes'], weight=settings.get('route_weight', 'length'),
+                                  grid=trips.grid,
+                                  field=(shared['station_distance'], shared['station'], shared['station_next']))
+
+    predefined = None
+    if settings.get('predefined_devices'):
+        predefined = _shared_trajectories(shared)
+
+    trip_ids = TripIdAllocator(settings.get('trip_id_path', DEFAULT_TRIP_ID_PATH),
+                               block_size=settings.get('trip_id_block_size', DEFAULT_BLOCK_SIZE))
+    seed = settings.get('seed')
+    fleet = Fleet.from_graph(graph, region_nodes, len(device_ids), seed=None if seed is None else [seed, shard],
+                             route_service=route_service, predefined=predefined,
+                             predefined_devices=settings.get('predefined_devices', ()),
+                             device_ids=device_ids, new_trip_id=trip_ids.next_id,
+                             continuous_trajectories=settings.get('continuous_trajectories', False),
+                             stations=stations, speed_model=speed_model)
+
+    start = settings.get('start')
+    if settings.get('virtual'):
+        clock = VirtualClock(parse_start_time(start) if start else None, speedup=settings.get('speedup'))
+    else:
+        clock = WallClock()
+    duration = settings.get('duration')
+    interval = settings.get('update_interval', UPDATE_INTERVAL)
+    try:
+        while not stop_event.is_set():
+            # Como `VirtualScheduler.run`: el tick que cae justo al final no se ejecuta
+            if clock.virtual and duration is not None and clock.elapsed >= duration:
+                break
+            tick_start = time.time()
+            chile_time = clock.now()
+            tick = fleet.step(chile_time)
+            created_at = chile_time.isoformat()
+            updates = [
+                make_update(float(tick.temperature[i]), float(tick.battery[i]), float(tick.lat[i]), float(tick.lon[i]),
+                            float(tick.speed[i]), encoded, int(tick.device_id[i]), int(tick.trip_id[i]), created_at)
+                for i, encoded in enumerate(fleet.encoded_trajectories(tick))
+            ]
+            out_queue.put(updates)
+            clock.sleep(interval if clock.virtual else interval - (time.time() - tick_start))
+    finally:
+        out_queue.put(None)
+        trip_ids.close()
+
+
+class ShardedSimulation:
+    """
+    Reparte `num_devices` dispositivos entre `num_workers` procesos, uno por región del
+    grafo. `settings` describe cómo abrir el grafo y configurar cada proceso: 'place',
+    'fixture_path', 'cache_dir', 'elevation_path', 'route_weight', 'route_hierarchy', 'hubs',
+    'station_nodes', 'route_cache_size', 'trip_min_distance', 'trip_max_distance',
+    'predefined_polylines', 'predefined_devices', 'continuous_trajectories', 'trip_id_path',
+    'trip_id_block_size', 'seed', 'virtual', 'start', 'speedup', 'duration' (segundos).
+    `graph`, `trips`, `speed_model`, `stations` y `predefined` son los del proceso principal,
+    armados con esa misma configuración: sus arrays se guardan para que los procesos los mapeen.
+    """
+
+    def __init__(self, num_devices, num_workers, settings, street_graph, graph, trips, speed_model,
+                 stations=None, predefined=None):
+        self.num_workers = max(1, min(num_workers, num_devices))
+        path = shared_arrays_path(street_graph, self.num_workers, settings)
+        save_shared_arrays(path, street_graph, graph, trips, speed_model, self.num_workers,
+                           stations=stations, predefined=predefined)
+        self.settings = settings = dict(settings, shared_path=path)
+        # fork: los procesos heredan los módulos ya importados en vez de reimportar el script principal
+        self._ctx = mp.get_context('fork')
+        self._queue = self._ctx.Queue(maxsize=QUEUE_TICKS_PER_WORKER * self.num_workers)
+        self._stop = self._ctx.Event()
+        self._processes = [
+            self._ctx.Process(target=_run_shard, name=f"fleet-shard-{shard}", daemon=True,
+                              args=(shard, self.num_workers, ids, settings, self._queue, self._stop))
+            for shard, ids in enumerate(shard_device_ids(num_devices, self.num_workers))
+        ]
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+        return self
+
+    def run(self, on_updates):
+        """Entrega a `on_updates` cada lote de lecturas hasta que todos los procesos terminen."""
+        finished = 0
+        while finished < self.num_workers:
+            try:
+                updates = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self._processes):
+                    break
+                continue
+            if updates is None:
+                finished += 1
+            else:
+                on_updates(updates)
+
+    def stop(self):
+        self._stop.set()
+        # Vacía la cola para que ningún proceso quede bloqueado en `put`
+        deadline = time.time() + 10
+        while any(p.is_alive() for p in self._processes) and time.time() < deadline:
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,196 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sim_model import CHILE_TZ, get_chile_current_time
+
+# --- Relojes de Simulación ---
+# El simulador pide la hora y duerme a través de un reloj: `WallClock` sigue la hora real,
+# `VirtualClock` avanza sólo cuando el planificador lo indica, así que un día de datos se
+# puede generar en minutos y repetirse igual con la misma semilla.
+
+
+class WallClock:
+    """Hora real de Chile; `sleep` bloquea el hilo como `time.sleep`."""
+
+    virtual = False
+
+    def now(self):
+        return get_chile_current_time()
+
+    def sleep(self, seconds):
+        time.sleep(max(0.0, seconds))
+
+
+class VirtualClock:
+    """
+    Reloj simulado que parte en `start`. Con `speedup=None` el tiempo salta de inmediato
+    (lo más rápido posible); con `speedup=k` cada segundo simulado toma 1/k segundos reales.
+    """
+
+    virtual = True
+
+    def __init__(self, start=None, speedup=None):
+        self.start = start or get_chile_current_time()
+        self.speedup = speedup
+        self.elapsed = 0.0 # segundos simulados desde `start`
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def advance(self, seconds):
+        seconds = max(0.0, seconds)
+        if self.speedup:
+            time.sleep(seconds / self.speedup)
+        self.elapsed += seconds
+
+    def advance_to(self, elapsed):
+        self.advance(elapsed - self.elapsed)
+
+    # Un solo consumidor puede usar el reloj virtual como si fuera el real
+    sleep = advance
+
+
+def parse_start_time(value):
+    """Fecha ISO 8601 (p. ej. "2024-03-01T00:00") en hora de Chile si no trae zona horaria."""
+    start = datetime.fromisoformat(value)
+    return CHILE_TZ.localize(start) if start.tzinfo is None else start
+
+
+class VirtualScheduler:
+    """
+    Planificador de eventos en tiempo virtual, en un solo hilo. Cada tarea es una función
+    `task(now)` que devuelve cuántos segundos esperar hasta su próxima ejecución (o `None`
+    para terminar). Las tareas con la misma hora se ejecutan en el orden en que se agendaron,
+    así que la secuencia de eventos es determinista.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._queue = []
+        self._order = itertools.count()
+
+    def schedule(self, delay, task):
+        heapq.heappush(self._queue, (self.clock.elapsed + delay, next(self._order), task))
+
+    def run(self, duration=None):
+        """
+        Ejecuta tareas hasta agotar la cola o durante `duration` segundos simulados: las que
+        tocan justo al final quedan para la próxima llamada (con un intervalo de 60 s, 300 s son
+        5 ticks por tarea, igual que en los procesos de sharding.py).
+        """
+        end = self.clock.elapsed + duration if duration is not None else None
+        while self._queue:
+            at, order, task = self._queue[0]
+            if end is not None and at >= end:
+                self.clock.advance_to(end)
+                return
+            heapq.heappop(self._queue)
+            self.clock.advance_to(at)
+            delay = task(self.clock.now())
+            if delay is not None:
+                heapq.heappush(self._queue, (at + delay, order, task))
+
+
+# --- Rueda de Tiempo (ticks periódicos en tiempo real) ---
+# En vez de un hilo por dispositivo que duerme por su cuenta (y se corre lo que tarde cada
+# tick), un solo despachador divide el intervalo en ranuras y cada dispositivo ocupa una:
+# su fase. Las horas de despacho son absolutas (inicio + k * ancho de ranura), así que el
+# tiempo de proceso no acumula atraso, y con las fases repartidas las lecturas salen a ritmo
+# parejo durante todo el intervalo en vez de en ráfagas.
+DEFAULT_SLOT_WIDTH = 0.25 # segundos
+DEFAULT_WHEEL_WORKERS = 16
+
+
+def phase_offsets(count, interval):
+    """Fases (segundos desde el inicio del intervalo) repartidas parejo para `count` tareas."""
+    return [i * interval / count for i in range(count)]
+
+
+class TimingWheel:
+    """
+    Despacha tareas periódicas cada `interval` segundos, cada una en su ranura de
+    `slot_width` segundos. Las tareas de una ranura se ejecutan en un pool de `workers` hilos
+    y reciben su atraso (segundos desde la hora programada hasta que empiezan a correr).
+
+    Un sobregiro (`overruns`) se informa a `on_overrun(task, kind)`:
+    - "busy": el tick anterior de la tarea aún no terminaba; se salta esta vuelta.
+    - "late": el despachador quedó más de un intervalo atrasado; se reancla el calendario
+      en vez de ponerse al día en ráfaga.
+    """
+
+    def __init__(self, interval, slot_width=DEFAULT_SLOT_WIDTH, workers=DEFAULT_WHEEL_WORKERS, on_overrun=None):
+        self.interval = interval
+        self.num_slots = max(1, int(round(interval / slot_width)))
+        self.slot_width = interval / self.num_slots
+        self.slots = [[] for _ in range(self.num_slots)]
+        self.workers = workers
+        self.on_overrun = on_overrun
+        self.overruns = 0
+        self._busy = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def add(self, task, phase=0.0):
+        """Agenda `task(lag)` en la ranura de la fase `phase` (segundos dentro del intervalo)."""
+        self.slots[int(phase / self.slot_width) % self.num_slots].append(task)
+
+    def add_evenly(self, tasks):
+        """Agenda las tareas con fases repartidas parejo en el intervalo."""
+        tasks = list(tasks)
+        for task, phase in zip(tasks, phase_offsets(len(tasks), self.interval)):
+            self.add(task, phase)
+
+    def stop(self):
+        self._stop.set()
+
+    def _overrun(self, task, kind):
+        self.overruns += 1
+        if self.on_overrun is not None:
+            self.on_overrun(task, kind)
+
+    def run(self):
+        """Bucle del despachador; corre hasta `stop()` y espera a las tareas en curso."""
+        if not any(self.slots):
+            self._stop.wait()
+            return
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="tick")
+        start = time.monotonic()
+        tick = 0
+        try:
+            while not self._stop.is_set():
+                tasks = self.slots[tick % self.num_slots]
+                if not tasks:
+                    tick += 1
+                    continue
+                due = start + tick * self.slot_width
+                wait = due - time.monotonic()
+                if wait > 0:
+                    if self._stop.wait(wait):
+                        break
+                elif -wait > self.interval:
+                    for task in tasks:
+                        self._overrun(task, "late")
+                    start -= wait
+                    due -= wait
+                for task in tasks:
+                    with self._lock:
+                        busy = task in self._busy
+                        self._busy.add(task)
+                    if busy:
+                        self._overrun(task, "busy")
+                        continue
+                    executor.submit(self._execute, task, due)
+                tick += 1
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _execute(self, task, due):
+        try:
+            task(max(0.0, time.monotonic() - due))
+        finally:
+            with self._lock:
+                self._busy.discard(task)
@@ -0,0 +1,60 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# --- Registro de Mensajes sin Bloquear la Simulación ---
+# Los hilos de la simulación sólo encolan cada mensaje (`QueueHandler`); un hilo aparte
+# (`QueueListener`) los escribe en la consola. Antes cada `print` pasaba por un lock global
+# y, con muchos dispositivos, los hilos se esperaban entre sí para escribir.
+LOGGER_NAME = "simulador"
+log = logging.getLogger(LOGGER_NAME)
+_listener = None
+
+
+def start_logging(level=logging.INFO, stream=None):
+    """Envía los mensajes de `log` a `stream` (por defecto stdout) a través de una cola."""
+    global _listener
+    if _listener is not None:
+        return log
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(records, handler)
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.setLevel(level)
+    log.propagate = False
+    _listener.start()
+    atexit.register(stop_logging)
+    return log
+
+
+def stop_logging():
+    """Escribe los mensajes pendientes y detiene el hilo de escritura."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    for handler in list(log.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            log.removeHandler(handler)
+
+
+def _forget_listener():
+    """
+    En el proceso hijo de un fork no existe el hilo de escritura del padre: se descarta su
+    cola para que `start_logging` arme una propia en vez de encolar mensajes que nadie escribe.
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener = None
+    for handler in list(log.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            log.removeHandler(handler)
+
+
+os.register_at_fork(after_in_child=_forget_listener)
@@ -0,0 +1,54 @@
+import math
+import random
+from datetime import datetime
+
+import pytz
+
+# --- Configuración de Simulación (Constantes Globales) ---
+# Compartidas por el simulador por hilos (data4.py) y el motor vectorizado (fleet.py).
+UPDATE_INTERVAL = 60 # segundos
+MAX_SPEED_KMH = 25.0
+INITIAL_BATTERY = 100.0
+LOW_BATTERY_THRESHOLD = 10.0
+BATTERY_CHARGE_RATE = 2.5
+CHILE_TZ = pytz.timezone('America/Santiago')
+MIN_TEMP_DAY = 12.0
+MAX_TEMP_DAY = 26.0
+PEAK_TEMP_HOUR = 14.0
+TEMP_STD_DEV = 1.0
+
+MAX_SPEED_MPS = MAX_SPEED_KMH * 1000 / 3600
+
+# --- Modelo de Energía (ver energy_model.py) ---
+# La descarga de cada tick es la energía de las calles recorridas (pendiente, superficie y
+# largo de cada arista) más un consumo fijo, como porcentaje de la capacidad de la batería.
+BATTERY_CAPACITY_WH = 500.0
+VEHICLE_MASS_KG = 100.0 # vehículo más conductor
+DRAG_AREA_M2 = 0.5 # coeficiente aerodinámico por área frontal (Cd·A)
+AIR_DENSITY = 1.2 # kg/m³
+DRIVETRAIN_EFFICIENCY = 0.8
+AUXILIARY_POWER_W = 5.0 # luces y electrónica, aunque no se avance
+# Velocidad de crucero con la calle libre (ver speed_model.py): la usa también el arrastre del aire
+CRUISE_SPEED_MPS = 0.75 * MAX_SPEED_MPS
+
+# --- Modelo de Velocidades (ver speed_model.py) ---
+# En cada tick un dispositivo avanza lo que alcanza a recorrer en el intervalo según las
+# tablas de velocidad y esperas de sus calles, con un ritmo propio al azar de ±SPEED_JITTER.
+SPEED_JITTER = 0.25
+
+
+# --- Funciones del Modelo ---
+def get_chile_current_time():
+    return datetime.now(CHILE_TZ)
+
+def target_temperature(chile_time):
+    """Temperatura media esperada para la hora del día (ciclo diario cosenoidal)."""
+    hour_float = chile_time.hour + chile_time.minute / 60.0
+    mean_daily_temp = (MIN_TEMP_DAY + MAX_TEMP_DAY) / 2.0
+    amplitude = (MAX_TEMP_DAY - MIN_TEMP_DAY) / 2.0
+    temp_cycle = math.cos(2 * math.pi * (hour_float - PEAK_TEMP_HOUR) / 24.0)
+    return mean_daily_temp + amplitude * temp_cycle
+
+def calculate_temperature(chile_time, rng=random):
+    simulated_temp = rng.gauss(target_temperature(chile_time), TEMP_STD_DEV)
+    return round(simulated_temp, 2)
@@ -0,0 +1,213 @@
+import math
+
+import numpy as np
+
+from projection import project_coords
+
+# --- Índice Espacial de Nodos ---
+# Grilla uniforme sobre las coordenadas proyectadas (metros): cada celda guarda el rango de
+# sus nodos en un array ordenado por celda, igual que un CSR. Sirve para ajustar puntos
+# lat/lon al nodo más cercano y para sortear destinos dentro de un radio.
+DEFAULT_CELL_SIZE = 250.0 # metros
+# Largo en línea recta de los viajes aleatorios (metros)
+DEFAULT_TRIP_MIN_DISTANCE = 300.0
+DEFAULT_TRIP_MAX_DISTANCE = 3000.0
+
+
+class NodeGrid:
+    """Índice de grilla sobre los nodos (x, y) de un grafo proyectado."""
+
+    def __init__(self, x, y, cell_size=DEFAULT_CELL_SIZE, index=None):
+        """`index` es el (order, cell_start) de otra grilla igual sobre los mismos nodos, si ya se tiene."""
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.x0, self.y0 = float(self.x.min()), float(self.y.min())
+        self.nx = int((self.x.max() - self.x0) // self.cell_size) + 1
+        self.ny = int((self.y.max() - self.y0) // self.cell_size) + 1
+        if index is not None:
+            self.order, self.cell_start = index
+            return
+
+        cells = self._cell_ix(self.x) * self.ny + self._cell_iy(self.y)
+        self.order = np.argsort(cells, kind='stable').astype(np.int64)
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.nx * self.ny), out=self.cell_start[1:])
+
+    def _cell_ix(self, x):
+        return np.clip(((np.asarray(x) - self.x0) // self.cell_size).astype(np.int64), 0, self.nx - 1)
+
+    def _cell_iy(self, y):
+        return np.clip(((np.asarray(y) - self.y0) // self.cell_size).astype(np.int64), 0, self.ny - 1)
+
+    def _cells_members(self, ix0, ix1, iy0, iy1):
+        """Índices de los nodos en el rectángulo de celdas [ix0, ix1] x [iy0, iy1]."""
+        ix0, iy0 = max(ix0, 0), max(iy0, 0)
+        ix1, iy1 = min(ix1, self.nx - 1), min(iy1, self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.empty(0, dtype=np.int64)
+        # Cada columna de celdas (ix fijo, iy0..iy1) es un tramo contiguo de `order`
+        columns = np.arange(ix0, ix1 + 1) * self.ny
+        starts = self.cell_start[columns + iy0]
+        ends = self.cell_start[columns + iy1 + 1]
+        return np.concatenate([self.order[a:b] for a, b in zip(starts, ends)])
+
+    def within(self, px, py, radius):
+        """Índices de los nodos a distancia <= `radius` del punto (px, py)."""
+        ix0, ix1 = int((px - radius - self.x0) // self.cell_size), int((px + radius - self.x0) // self.cell_size)
+        iy0, iy1 = int((py - radius - self.y0) // self.cell_size), int((py + radius - self.y0) // self.cell_size)
+        members = self._cells_members(ix0, ix1, iy0, iy1)
+        d2 = (self.x[members] - px) ** 2 + (self.y[members] - py) ** 2
+        return members[d2 <= radius * radius]
+
+    def nearest(self, px, py):
+        """Índice del nodo más cercano al punto (px, py)."""
+        cx, cy = int(self._cell_ix(px)), int(self._cell_iy(py))
+        best, best_d2 = -1, math.inf
+        ring = 0
+        max_ring = max(self.nx, self.ny)
+        while ring <= max_ring:
+            # Anillo de celdas a distancia de Chebyshev `ring` de la celda del punto
+            if ring == 0:
+                members = self._cells_members(cx, cx, cy, cy)
+            else:
+                members = np.concatenate([
+                    self._cells_members(cx - ring, cx + ring, cy - ring, cy - ring),
+                    self._cells_members(cx - ring, cx + ring, cy + ring, cy + ring),
+                    self._cells_members(cx - ring, cx - ring, cy - ring + 1, cy + ring - 1),
+                    self._cells_members(cx + ring, cx + ring, cy - ring + 1, cy + ring - 1),
+                ])
+            if len(members):
+                d2 = (self.x[members] - px) ** 2 + (self.y[members] - py) ** 2
+                k = int(np.argmin(d2))
+                if d2[k] < best_d2:
+                    best, best_d2 = int(members[k]), float(d2[k])
+            # Los nodos de anillos más externos están a más de `ring * cell_size` del punto
+            if best >= 0 and ring * self.cell_size >= math.sqrt(best_d2):
+                break
+            ring += 1
+        return best
+
+    def nearest_many(self, px, py):
+        """
+        `nearest` para arrays de puntos, por lotes: se miran las 3x3 celdas alrededor de cada
+        punto y sólo los que no tienen ahí un nodo a menos de una celda se resuelven de a uno.
+        """
+        px = np.asarray(px, dtype=np.float64)
+        py = np.asarray(py, dtype=np.float64)
+        n = len(px)
+        best = np.full(n, -1, dtype=np.int64)
+        best_d2 = np.full(n, np.inf)
+        cx, cy = self._cell_ix(px), self._cell_iy(py)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                ix, iy = cx + dx, cy + dy
+                valid = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+                cell = np.where(valid, ix * self.ny + iy, 0)
+                starts = self.cell_start[cell]
+                counts = np.where(valid, self.cell_start[cell + 1] - starts, 0)
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                # Un candidato por (punto, nodo de la celda), como en `RoutePool.compact`
+                point = np.repeat(np.arange(n), counts)
+                offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                members = self.order[np.repeat(starts - offsets, counts) + np.arange(total)]
+                d2 = (self.x[members] - px[point]) ** 2 + (self.y[members] - py[point]) ** 2
+                # Los candidatos ya vienen agrupados por punto: mínimo de cada grupo con `reduceat`
+                has = counts > 0
+                group_min = np.full(n, np.inf)
+                group_min[has] = np.minimum.reduceat(d2, offsets[has])
+                closer = (d2 == group_min[point]) & (d2 < best_d2[point])
+                best[point[closer]] = members[closer]
+                best_d2[point[closer]] = d2[closer]
+        # Fuera del vecindario puede haber un nodo más cercano sólo si el mejor está a más de una celda
+        for i in np.flatnonzero(best_d2 > self.cell_size ** 2):
+            best[i] = self.nearest(px[i], py[i])
+        return best
+
+
+class TripSampler:
+    """
+    Sortea viajes (origen, destino) realistas sobre un `CSRGraph`: el destino se elige a una
+    distancia en línea recta entre `min_distance` y `max_distance` del origen y dentro de su
+    misma componente fuertemente conexa, así que siempre existe camino entre ambos.
+    `component` y `grid` permiten pasar las componentes y la grilla ya calculadas.
+    """
+
+    def __init__(self, graph, cell_size=DEFAULT_CELL_SIZE, min_distance=DEFAULT_TRIP_MIN_DISTANCE,
+                 max_distance=DEFAULT_TRIP_MAX_DISTANCE, component=None, grid=None):
+        self.graph = graph
+        self.grid = grid if grid is not None else NodeGrid(graph.x, graph.y, cell_size)
+        self.component = component if component is not None else graph.strongly_connected_components()
+        self.component_size = np.bincount(self.component)
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        # Sólo pueden ser origen los nodos con algún destino alcanzable
+        self.origins = np.flatnonzero(self.component_size[self.component] > 1)
+        self._origins_cache = None
+
+    def nearest_node(self, lat, lon):
+        """ID OSM del nodo más cercano a un punto lat/lon."""
+        px, py = project_coords([(lat, lon)], self.graph.crs)[0]
+        return int(self.graph.node_ids[self.grid.nearest(px, py)])
+
+    def snap(self, coords_xy):
+        """Índice del nodo más cercano para cada punto proyectado (N, 2)."""
+        coords_xy = np.asarray(coords_xy, dtype=np.float64).reshape(-1, 2)
+        return self.grid.nearest_many(coords_xy[:, 0], coords_xy[:, 1])
+
+    def _pick(self, rng, candidates):
+        return candidates[int(rng.random() * len(candidates))]
+
+    def random_trip(self, rng, origins=None):
+        """
+        Par (origen, destino) de IDs OSM. `origins` restringe el viaje a esos IDs (por ejemplo,
+        la región de un proceso): origen y destino salen de ahí, y sólo si la región no tiene
+        destinos alcanzables desde el origen se busca en el resto de su componente. `rng` puede
+        ser un `random.Random` o un generador de NumPy. Devuelve `None` si ningún origen
+        candidato tiene destinos alcanzables.
+        """
+        graph = self.graph
+        if origins is None:
+            candidates, in_region = self.origins, None
+        else:
+            candidates, in_region = self._origin_candidates(origins)
+        if len(candidates) == 0:
+            return None
+        origin = int(self._pick(rng, candidates))
+        ox, oy = self.grid.x[origin], self.grid.y[origin]
+
+        near = self.grid.within(ox, oy, self.max_distance)
+        d2 = (self.grid.x[near] - ox) ** 2 + (self.grid.y[near] - oy) ** 2
+        near = near[(self.component[near] == self.component[origin]) & (d2 >= self.min_distance ** 2)]
+        same = None
+        if in_region is not None:
+            local = near[in_region[near]]
+            if len(local) == 0:
+                # Región chica o estirada: cualquier nodo de la región en la misma componente
+                same = np.flatnonzero(self.component == self.component[origin])
+                same = same[same != origin]
+                local = same[in_region[same]]
+            if len(local):
+                near = local
+        if len(near) == 0:
+            # Componente pequeña o aislada: cualquier otro nodo de la misma componente
+            if same is None:
+                same = np.flatnonzero(self.component == self.component[origin])
+                same = same[same != origin]
+            near = same
+        destination = int(self._pick(rng, near))
+        return int(graph.node_ids[origin]), int(graph.node_ids[destination])
+
+    def _origin_candidates(self, origins):
+        # Se llama con la misma lista en cada viaje: se traduce a índices una sola vez
+        cached = self._origins_cache
+        if cached is not None and cached[0] is origins:
+            return cached[1], cached[2]
+        region = np.array([self.graph.index_of(n) for n in origins], dtype=np.int64)
+        in_region = np.zeros(self.graph.num_nodes, dtype=bool)
+        in_region[region] = True
+        candidates = region[self.component_size[self.component[region]] > 1]
+        self._origins_cache = (origins, candidates, in_region)
+        return candidates, in_region
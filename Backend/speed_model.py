@@ -0,0 +1,124 @@
+import numpy as np
+
+from graph_store import CONTROL_SIGNALS, CONTROL_STOP, ROAD_TERTIARY
+from sim_model import CRUISE_SPEED_MPS
+
+# --- Modelo de Velocidades por Arista y Hora del Día ---
+# Para cada arista del grafo y cada franja horaria se precalculan dos tablas: el ritmo al
+# recorrerla (s/m, según su velocidad máxima, la del vehículo y la congestión de la franja) y
+# la espera al llegar a su nodo final (semáforo o disco PARE, más larga en hora punta). Una
+# ruta guarda la arista de cada punto, así que su tiempo acumulado en una franja es un
+# `cumsum` sobre lecturas de esas tablas, y avanzar un tick es buscar el tiempo del intervalo.
+BUCKET_MINUTES = 30
+NUM_BUCKETS = 24 * 60 // BUCKET_MINUTES
+# Velocidad máxima (km/h) de las aristas sin etiqueta `maxspeed`, por tipo de vía (índices de graph_store.ROAD_CLASSES)
+DEFAULT_MAXSPEED_KMH = np.array([60.0, 50.0, 50.0, 40.0, 20.0])
+# Fracción de la velocidad que se pierde en el peor momento de la hora punta, por tipo de vía
+CONGESTION_SEVERITY = np.array([0.45, 0.35, 0.3, 0.15, 0.1])
+# Horas punta de un día hábil: (hora, intensidad de 0 a 1, ancho en horas)
+CONGESTION_PEAKS = ((8.0, 1.0, 1.0), (13.5, 0.4, 1.0), (18.5, 1.0, 1.5))
+# Semáforos: ciclo (s) y fracción en rojo para quien llega por cada tipo de vía
+SIGNAL_CYCLE_S = 90.0
+SIGNAL_RED_FRACTION = np.array([0.35, 0.45, 0.5, 0.55, 0.55])
+# Detención en un disco PARE / CEDA EL PASO (sólo para quien llega por una vía terciaria o menor)
+STOP_DELAY_S = 4.0
+# Con la congestión máxima las colas alargan las esperas en este factor adicional
+QUEUE_DELAY_FACTOR = 1.0
+# Tablas de un `SpeedModel` (ver `SpeedModel.tables`)
+SPEED_TABLES = ('free_speed', 'profile', 'pace', 'delay')
+
+
+def congestion_profile(hours):
+    """Intensidad de la congestión (0 a 1) a las horas del día `hours`."""
+    hours = np.asarray(hours, dtype=np.float64)
+    level = np.zeros_like(hours)
+    for peak, intensity, width in CONGESTION_PEAKS:
+        # Distancia circular en horas, para que los picos cerca de medianoche den la vuelta
+        offset = (hours - peak + 12) % 24 - 12
+        level += intensity * np.exp(-0.5 * (offset / width) ** 2)
+    return np.minimum(level, 1.0)
+
+
+class SpeedModel:
+    """
+    Tablas (franja, arista) de un `StreetGraph`: `pace[b, e]` es el ritmo en s/m por la arista e
+    en la franja b y `delay[b, e]` la espera (s) en su nodo final antes de tomar otra arista.
+    `vehicle_speed` es la velocidad de crucero del vehículo con la calle libre. `tables` son
+    las tablas de otro modelo igual (ver `tables()`), por ejemplo mapeadas desde el disco.
+    """
+
+    def __init__(self, street_graph, vehicle_speed=CRUISE_SPEED_MPS, tables=None):
+        self.vehicle_speed = vehicle_speed
+        if tables is not None:
+            self.free_speed, self.profile, self.pace, self.delay = (tables[name] for name in SPEED_TABLES)
+            return
+        road_class = np.asarray(street_graph.edge_road_class, dtype=np.int64)
+        maxspeed = np.asarray(street_graph.edge_maxspeed, dtype=np.float64)
+        maxspeed = np.where(np.isnan(maxspeed), DEFAULT_MAXSPEED_KMH[road_class], maxspeed) / 3.6
+        self.free_speed = np.minimum(vehicle_speed, maxspeed)
+
+        hours = (np.arange(NUM_BUCKETS) + 0.5) * BUCKET_MINUTES / 60
+        self.profile = congestion_profile(hours)
+        slowdown = 1 - CONGESTION_SEVERITY[road_class][None, :] * self.profile[:, None]
+        self.pace = (1 / (self.free_speed[None, :] * slowdown)).astype(np.float32)
+
+        # Espera esperada con llegadas al azar: P(rojo) por la mitad del rojo = rojo² · ciclo / 2
+        control = np.asarray(street_graph.node_control)[street_graph.edge_v]
+        red = SIGNAL_RED_FRACTION[road_class]
+        wait = np.where(control == CONTROL_SIGNALS, red ** 2 * SIGNAL_CYCLE_S / 2, 0.0)
+        wait = np.where((control == CONTROL_STOP) & (road_class >= ROAD_TERTIARY), STOP_DELAY_S, wait)
+        self.delay = (wait[None, :] * (1 + QUEUE_DELAY_FACTOR * self.profile[:, None])).astype(np.float32)
+
+    def tables(self):
+        return {name: getattr(self, name) for name in SPEED_TABLES}
+
+    @property
+    def num_signals(self):
+        return int(np.count_nonzero(self.delay[0]))
+
+    @property
+    def nbytes(self):
+        return self.pace.nbytes + self.delay.nbytes
+
+    @staticmethod
+    def bucket(when):
+        """Franja horaria de un `datetime`."""
+        return (when.hour * 60 + when.minute) // BUCKET_MINUTES % NUM_BUCKETS
+
+    def segment_times(self, edges, cum, bucket, head=None):
+        """
+        Segundos para recorrer cada tramo [k, k + 1] de una polilínea con distancia acumulada
+        `cum` cuyos puntos están sobre las aristas `edges` (-1 si no se sabe: ritmo del
+        vehículo, sin esperas). Al cambiar de arista se suma la espera del nodo entre ambas.
+        `head` marca los puntos donde empieza otra ruta (como en `fleet.RoutePool`): el tramo
+        que llega a ellos no es camino y dura 1 s, para que los tiempos sigan creciendo.
+        """
+        segment = np.diff(cum)
+        if edges is None:
+            return segment / self.vehicle_speed
+        edges = np.asarray(edges, dtype=np.int64)
+        prev, edge = edges[:-1], edges[1:]
+        pace, delay = self.pace[bucket], self.delay[bucket]
+        moving = np.where(edge >= 0, segment * pace[edge], segment / self.vehicle_speed)
+        waiting = np.where((prev >= 0) & (edge != prev), delay[prev], 0.0)
+        times = moving + waiting
+        if head is not None:
+            times = np.where(head[1:], 1.0, times)
+        return times
+
+    def route_times(self, edges, cum, bucket):
+        """Tiempo acumulado (s) en cada punto de una ruta, en la franja `bucket`; empieza en 0."""
+        times = np.zeros(len(cum), dtype=np.float64)
+        if len(cum) > 1:
+            np.cumsum(self.segment_times(edges, cum, bucket), out=times[1:])
+        return times
+
+    def edge_travel_time(self, edge_length, bucket, edges=None):
+        """
+        Tiempo (s) para recorrer cada arista completa y esperar en su nodo final, en la franja
+        `bucket`. Con `edges` (índices en el `StreetGraph`) `edge_length` es el largo de esas aristas.
+        """
+        pace, delay = self.pace[bucket], self.delay[bucket]
+        if edges is not None:
+            pace, delay = pace[edges], delay[edges]
+        return np.asarray(edge_length, dtype=np.float64) * pace + delay
@@ -0,0 +1,69 @@
+import json
+import os
+import sqlite3
+import threading
+
+# --- Spool Persistente de Lecturas ---
+# Cada lectura se escribe aquí antes de subirla y sólo se borra cuando ThingSpeak la
+# confirma. Si el proceso se cae o ThingSpeak no responde, las lecturas pendientes se
+# reenvían en orden al volver. SQLite en modo WAL hace que cada append sea barato.
+DEFAULT_SPOOL_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'spool.sqlite3')
+# Cada cuántas lecturas confirmadas se trunca el WAL para devolver espacio al disco
+CHECKPOINT_EVERY = 5000
+
+
+class ReadingSpool:
+    """Cola FIFO durable de lecturas (diccionarios JSON) respaldada por SQLite."""
+
+    def __init__(self, path=DEFAULT_SPOOL_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS readings (seq INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)")
+        self._acked_since_checkpoint = 0
+        self._depth = self._conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+    def append(self, update):
+        """Guarda una lectura y devuelve su número de secuencia."""
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO readings (payload) VALUES (?)", (json.dumps(update),))
+            self._depth += 1
+            return cursor.lastrowid
+
+    def append_many(self, updates):
+        updates = list(updates)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT INTO readings (payload) VALUES (?)", ((json.dumps(u),) for u in updates))
+            self._conn.execute("COMMIT")
+            self._depth += len(updates)
+
+    def peek(self, limit):
+        """Las `limit` lecturas pendientes más antiguas, como lista de (seq, lectura)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, payload FROM readings ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        return [(seq, json.loads(payload)) for seq, payload in rows]
+
+    def ack(self, up_to_seq):
+        """Confirma (y borra) todas las lecturas con secuencia <= `up_to_seq`."""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM readings WHERE seq <= ?", (up_to_seq,)).rowcount
+            self._acked_since_checkpoint += deleted
+            self._depth -= deleted
+            if self._acked_since_checkpoint >= CHECKPOINT_EVERY:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._acked_since_checkpoint = 0
+        return deleted
+
+    def depth(self):
+        """Cantidad de lecturas pendientes de confirmación."""
+        return self._depth
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
@@ -0,0 +1,172 @@
+import heapq
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import STATION_DISPATCHES
+from routing import path_route
+from spatial_index import NodeGrid
+
+# --- Estaciones de Carga ---
+# Los dispositivos con batería baja van a cargar a la estación alcanzable más cercana. Al
+# arrancar se corre un solo Dijkstra multi-fuente desde todas las estaciones sobre el grafo
+# invertido: para cada nodo queda el costo hasta su estación más cercana, cuál es y el
+# siguiente nodo del camino. Elegir estación es leer esos arrays (por lotes, para todos los
+# dispositivos con batería baja del tick) y la ruta se arma siguiendo `next_node`, sin
+# búsquedas por dispositivo.
+DEFAULT_NUM_STATIONS = 8
+
+_DISPATCHED = STATION_DISPATCHES.labels('station')
+_IN_PLACE = STATION_DISPATCHES.labels('in_place')
+
+
+def spread_stations(graph, count, component=None):
+    """
+    `count` IDs OSM repartidos por el mapa (siempre el nodo más lejano a los ya elegidos)
+    dentro de la componente fuertemente conexa más grande de un `CSRGraph`, así que todas
+    son alcanzables desde ella. Es determinista: empieza por el nodo más cercano al centro.
+    """
+    if count <= 0:
+        return []
+    component = graph.strongly_connected_components() if component is None else component
+    candidates = np.flatnonzero(component == np.argmax(np.bincount(component)))
+    x, y = graph.x[candidates], graph.y[candidates]
+    first = int(np.argmin((x - x.mean()) ** 2 + (y - y.mean()) ** 2))
+    chosen = [first]
+    d2 = (x - x[first]) ** 2 + (y - y[first]) ** 2
+    for _ in range(min(count, len(candidates)) - 1):
+        k = int(np.argmax(d2))
+        chosen.append(k)
+        np.minimum(d2, (x - x[k]) ** 2 + (y - y[k]) ** 2, out=d2)
+    return [int(graph.node_ids[candidates[k]]) for k in chosen]
+
+
+class StationNetwork:
+    """
+    Estaciones de carga `station_nodes` (IDs OSM) sobre un `CSRGraph`. `distance[n]` es el
+    costo ('length' o 'energy', como en `RouteService`; con 'time' se usa el largo, porque el
+    campo es uno solo para todo el día) del camino más corto del nodo n a su
+    estación más cercana, `station[n]` cuál es (posición en `station_nodes`, -1 si ninguna es
+    alcanzable) y `next_node[n]` el siguiente nodo de ese camino. Las rutas a estaciones se
+    guardan en un caché LRU por nodo de origen. Es seguro para usar desde varios hilos.
+    `field` es el (distance, station, next_node) ya calculado para las mismas estaciones.
+    """
+
+    def __init__(self, graph, station_nodes, weight='length', cache_size=4096, grid=None, field=None):
+        self.graph = graph
+        self.station_nodes = list(dict.fromkeys(int(n) for n in station_nodes))
+        self.station_index = np.array([graph.index_of(n) for n in self.station_nodes], dtype=np.int64)
+        self.weight = weight
+        self.grid = grid or NodeGrid(graph.x, graph.y)
+        self.distance, self.station, self.next_node = field if field is not None else self._distance_field()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def num_stations(self):
+        return len(self.station_nodes)
+
+    def _distance_field(self):
+        """Dijkstra multi-fuente desde todas las estaciones, sobre las aristas invertidas."""
+        graph = self.graph
+        n = graph.num_nodes
+        if self.weight in ('length', 'time'):
+            weights = graph.weights
+        elif self.weight == 'energy':
+            if graph.energy is None:
+                raise ValueError("El grafo no tiene energía por arista (ver CSRGraph.set_edge_energy)")
+            weights = graph.energy
+        else:
+            raise ValueError(f"Peso desconocido: {self.weight!r} (se espera 'length' o 'energy')")
+
+        # Grafo invertido en CSR: la arista k (u -> v) pasa a salir de v
+        sources = np.repeat(np.arange(n), np.diff(graph.indptr))
+        order = np.argsort(graph.indices, kind='stable')
+        rindptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(graph.indices, minlength=n), out=rindptr[1:])
+        rindptr, rindices, rweights = rindptr.tolist(), sources[order].tolist(), np.asarray(weights)[order].tolist()
+
+        dist = [math.inf] * n
+        station = [-1] * n
+        next_node = [-1] * n
+        done = [False] * n
+        heap = []
+        for j, s in enumerate(self.station_index.tolist()):
+            dist[s] = 0.0
+            station[s] = j
+            heap.append((0.0, s))
+        heapq.heapify(heap)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if done[node]:
+                continue
+            done[node] = True
+            for k in range(rindptr[node], rindptr[node + 1]):
+                prev = rindices[k] # arista prev -> node en el grafo original
+                nd = d + rweights[k]
+                if nd < dist[prev]:
+                    dist[prev] = nd
+                    station[prev] = station[node]
+                    next_node[prev] = node
+                    heapq.heappush(heap, (nd, prev))
+        return np.array(dist), np.array(station, dtype=np.int32), np.array(next_node, dtype=np.int64)
+
+    def nearest(self, nodes):
+        """(estación, costo) para un array de índices internos de nodos."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return self.station[nodes], self.distance[nodes]
+
+    def locate(self, x, y):
+        """Índice interno del nodo más cercano a cada punto proyectado."""
+        return self.grid.nearest_many(x, y)
+
+    def path_from(self, node):
+        """Camino (índices internos) del nodo a su estación más cercana, o `None` si no hay ninguna alcanzable."""
+        if self.station[node] < 0:
+            return None
+        next_node = self.next_node
+        path = [int(node)]
+        while next_node[path[-1]] >= 0:
+            path.append(int(next_node[path[-1]]))
+        return path
+
+    def route_from(self, node):
+        """`Route` compartida del nodo a su estación más cercana, o `None` si ya está en ella o no hay camino."""
+        node = int(node)
+        with self._lock:
+            if node in self._cache:
+                self._cache.move_to_end(node)
+                return self._cache[node]
+        # Desde el nodo mismo: el dispositivo termina exactamente en la estación
+        route = path_route(self.graph, self.path_from(node), with_start=True)
+        with self._lock:
+            self._cache[node] = route
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return route
+
+    def dispatch(self, x, y):
+        """
+        Estación y ruta para un lote de dispositivos con batería baja en las posiciones
+        proyectadas (x, y). Devuelve (estación, rutas): estación -1 si no tienen ninguna
+        alcanzable (cargan donde están) y ruta `None` si ya están en la estación.
+        """
+        nodes = self.locate(x, y)
+        station, _ = self.nearest(nodes)
+        routes = [self.route_from(node) if s >= 0 else None for node, s in zip(nodes.tolist(), station.tolist())]
+        stranded = int((station < 0).sum())
+        _DISPATCHED.inc(len(station) - stranded)
+        _IN_PLACE.inc(stranded)
+        return station, routes
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            'stations': self.num_stations,
+            'reachable_nodes': float((self.station >= 0).mean()) if len(self.station) else 0.0,
+            'cached_routes': cached,
+        }
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del simulador están sueltos en Backend/
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from csr_graph import CSRGraph  # noqa: E402
+from energy_model import annotate_graph  # noqa: E402
+from graph_store import DEFAULT_FIXTURE_PATH, load_street_graph  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def street_graph(tmp_path_factory):
+    """Grafo de prueba (fixture JSON) cacheado en un directorio temporal, no en Backend/cache."""
+    return load_street_graph('tests', fixture_path=DEFAULT_FIXTURE_PATH, cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+@pytest.fixture(scope='session')
+def graph(street_graph):
+    graph = CSRGraph.from_street_graph(street_graph)
+    annotate_graph(street_graph, graph)
+    return graph
@@ -0,0 +1,94 @@
+import glob
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pyarrow')
+import pyarrow.dataset as ds  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+from columnar_sink import ColumnarSink  # noqa: E402
+from uplink import make_update  # noqa: E402
+
+CHILE = timezone(timedelta(hours=-3))
+# Cruza la medianoche local: las lecturas quedan en dos fechas
+START = datetime(2024, 3, 1, 23, 30, tzinfo=CHILE)
+NUM_DEVICES = 40
+NUM_TICKS = 60
+
+
+def _ticks(seed=0):
+    rng = np.random.default_rng(seed)
+    for k in range(NUM_TICKS):
+        columns = [rng.random(NUM_DEVICES) for _ in range(5)]
+        trajectory = [f"t{k}-{i}" for i in range(NUM_DEVICES)]
+        device_id = np.arange(NUM_DEVICES, 0, -1, dtype=np.int32)
+        trip_id = np.arange(NUM_DEVICES, dtype=np.int64) + k
+        yield START + timedelta(minutes=k), columns, trajectory, device_id, trip_id
+
+
+def _files(root):
+    return sorted(glob.glob(os.path.join(root, '**', '*.parquet'), recursive=True))
+
+
+def _read(root):
+    return ds.dataset(root, format='parquet', partitioning='hive').to_table().sort_by(
+        [('created_at', 'ascending'), ('device_id', 'ascending')])
+
+
+def test_one_file_per_date(tmp_path):
+    sink = ColumnarSink(str(tmp_path), flush_rows=500)
+    for when, columns, trajectory, device_id, trip_id in _ticks():
+        sink.submit_columns(when, *columns, trajectory, device_id, trip_id)
+    sink.stop()
+    files = _files(str(tmp_path))
+    # Sin partición por dispositivo: un archivo por fecha, con un grupo de filas por lote
+    assert [os.path.basename(os.path.dirname(f)) for f in files] == ['date=2024-03-01', 'date=2024-03-02']
+    assert sink.files_written == 2
+    assert sink.rows_written == NUM_DEVICES * NUM_TICKS
+    assert sum(pq.ParquetFile(f).metadata.num_rows for f in files) == NUM_DEVICES * NUM_TICKS
+    assert pq.ParquetFile(files[0]).metadata.num_row_groups > 1
+    # Cada grupo de filas va ordenado por dispositivo
+    devices = pq.ParquetFile(files[0]).read_row_group(0).column('device_id').to_numpy()
+    assert np.all(np.diff(devices) >= 0)
+
+
+def test_files_rotate_at_max_rows(tmp_path):
+    sink = ColumnarSink(str(tmp_path), flush_rows=200, max_rows_per_file=400)
+    for when, columns, trajectory, device_id, trip_id in _ticks():
+        sink.submit_columns(when, *columns, trajectory, device_id, trip_id)
+    sink.stop()
+    files = _files(str(tmp_path))
+    rows = [pq.ParquetFile(f).metadata.num_rows for f in files]
+    assert sum(rows) == NUM_DEVICES * NUM_TICKS
+    assert len(files) == sink.files_written
+    # Se rota al pasar el límite: ningún archivo pasa de límite + un lote
+    assert max(rows) <= 400 + 200
+    assert len(files) >= NUM_DEVICES * NUM_TICKS // 600
+
+
+def test_rows_and_columns_write_the_same_table(tmp_path):
+    by_columns = ColumnarSink(str(tmp_path / 'columns'), flush_rows=300)
+    by_rows = ColumnarSink(str(tmp_path / 'rows'), flush_rows=300)
+    for when, columns, trajectory, device_id, trip_id in _ticks(seed=1):
+        by_columns.submit_columns(when, *columns, trajectory, device_id, trip_id)
+        for i in range(NUM_DEVICES):
+            by_rows.submit(make_update(*(float(c[i]) for c in columns), trajectory[i], int(device_id[i]),
+                                       int(trip_id[i]), when.isoformat()))
+    by_columns.stop()
+    by_rows.stop()
+    assert _read(str(tmp_path / 'columns')).equals(_read(str(tmp_path / 'rows')))
+    assert len(_files(str(tmp_path / 'columns'))) == len(_files(str(tmp_path / 'rows'))) == 2
+
+
+def test_buffered_ticks_are_copied(tmp_path):
+    sink = ColumnarSink(str(tmp_path), flush_rows=10_000)
+    battery = np.full(3, 50.0)
+    sink.submit_columns(START, np.zeros(3), battery, np.zeros(3), np.zeros(3), np.zeros(3), ["", "", ""],
+                        np.arange(3, dtype=np.int32), np.arange(3))
+    # La flota reescribe sus arrays en el tick siguiente, antes de que se escriba el lote
+    battery[:] = 0.0
+    sink.stop()
+    assert _read(str(tmp_path)).column('battery').to_pylist() == [50.0, 50.0, 50.0]
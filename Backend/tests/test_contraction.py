@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+import pytest
+
+from contraction import ContractionHierarchy
+from routing import RouteService
+
+
+@pytest.fixture(scope='module')
+def hierarchy(graph):
+    return ContractionHierarchy.build(graph)
+
+
+# Los pesos personalizados de la jerarquía se guardan en float32
+REL = 1e-6
+
+
+def _pairs(graph, count=150, seed=0):
+    rng = np.random.default_rng(seed)
+    return [tuple(int(n) for n in rng.integers(0, graph.num_nodes, 2)) for _ in range(count)]
+
+
+def _path_cost(graph, weights, path):
+    if len(path) < 2:
+        return 0.0
+    return float(np.asarray(weights)[graph.hop_edges(path)].sum())
+
+
+@pytest.mark.parametrize('weight', ['length', 'energy'])
+def test_matches_dijkstra(graph, hierarchy, weight):
+    weights = graph.weights if weight == 'length' else graph.energy
+    metric = hierarchy.customize(weights)
+    for source, target in _pairs(graph):
+        dist, _ = graph.dijkstra(source, weight=weight)
+        expected = dist.get(target, math.inf)
+        path = metric.shortest_path(source, target)
+        if math.isinf(expected):
+            assert path is None
+            assert math.isinf(metric.distance(source, target))
+            continue
+        assert metric.distance(source, target) == pytest.approx(expected, rel=REL, abs=REL)
+        # El camino desempaquetado empieza y termina donde corresponde y cuesta lo mismo
+        assert path[0] == source and path[-1] == target
+        assert _path_cost(graph, weights, path) == pytest.approx(expected, rel=REL, abs=REL)
+
+
+def test_route_service_same_lengths(graph, hierarchy):
+    plain = RouteService(graph, weight='length')
+    indexed = RouteService(graph, weight='length', hierarchy=hierarchy)
+    node_ids = graph.node_ids
+    for source, target in _pairs(graph, count=60, seed=1):
+        origin, destination = int(node_ids[source]), int(node_ids[target])
+        a, b = plain.route(origin, destination), indexed.route(origin, destination)
+        assert (a is None) == (b is None)
+        if a is not None:
+            assert b.length == pytest.approx(a.length, rel=REL)
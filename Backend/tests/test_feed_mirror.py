@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import feed_mirror
+from feed_mirror import FeedMirror
+from polyline_codec import TrajectoryEncoder
+from thingspeak_stub import ThingSpeakStub
+from uplink import make_update
+
+START = datetime(2024, 3, 1, tzinfo=timezone(timedelta(hours=-3)))
+PER_SECOND = 5
+READINGS_PER_TRIP = 25
+
+
+@pytest.fixture
+def stub():
+    stub = ThingSpeakStub().start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    # Páginas chicas para que una sincronización necesite varias consultas
+    monkeypatch.setattr(feed_mirror, 'MAX_RESULTS', 50)
+
+
+def _add(stub, first, last):
+    encoder = TrajectoryEncoder(0)
+    updates = []
+    for k in range(first, last):
+        lat, lon = -33.04 + k * 1e-4, -71.6
+        path = encoder.encode([lat, lat + 1e-4], [lon, lon], (0, 2), (0,))[0]
+        # Varias lecturas por segundo, como una flota que sube todo el tick junto
+        updates.append(make_update(20.0, 100.0 - k * 0.01, lat, lon, 4.0, path, k % PER_SECOND,
+                                   k // READINGS_PER_TRIP + 1, (START + timedelta(seconds=k // PER_SECOND)).isoformat()))
+    stub.add_entries(updates)
+
+
+def test_sync_pages_back_to_the_last_entry(stub, tmp_path):
+    _add(stub, 0, 1000)
+    mirror = FeedMirror('1', 'r', path=str(tmp_path / 'mirror.sqlite3'), base_url=stub.base_url)
+    assert mirror.sync() == 1000
+    assert mirror.last_entry_id() == 1000
+    trip = mirror.trip(1)
+    assert trip['readings'] == READINGS_PER_TRIP
+    assert trip['battery_used'] == pytest.approx((READINGS_PER_TRIP - 1) * 0.01)
+    assert len(mirror.trip_path(1)) > READINGS_PER_TRIP
+    mirror.close()
+
+
+def test_sync_is_incremental(stub, tmp_path):
+    _add(stub, 0, 1000)
+    mirror = FeedMirror('1', 'r', path=str(tmp_path / 'mirror.sqlite3'), base_url=stub.base_url)
+    mirror.sync()
+    _add(stub, 1000, 1120)
+    before = stub.requests
+    assert mirror.sync() == 120
+    # Sólo se bajan las páginas nuevas (que se solapan en el segundo de la última guardada)
+    assert stub.requests - before <= 3
+    assert mirror.last_entry_id() == 1120
+    # El viaje que seguía abierto suma las lecturas nuevas
+    assert mirror.trip(40)['readings'] == READINGS_PER_TRIP
+    assert sum(trip['readings'] for trip in mirror.trips()) == 1120
+    before = stub.requests
+    assert mirror.sync() == 0
+    assert stub.requests - before == 1
+    mirror.close()
+
+
+def test_sync_matches_a_single_ingest(stub, tmp_path):
+    paged = FeedMirror('1', 'r', path=str(tmp_path / 'paged.sqlite3'), base_url=stub.base_url)
+    # Los cortes caen a mitad de un segundo y de un viaje
+    for first, last in ((0, 133), (133, 412), (412, 700)):
+        _add(stub, first, last)
+        paged.sync()
+    whole = FeedMirror('1', 'r', path=str(tmp_path / 'whole.sqlite3'), base_url=stub.base_url)
+    whole.ingest([dict(entry) for entry in stub.entries])
+    assert paged.trips() == whole.trips()
+    assert paged.last_entry_id() == whole.last_entry_id() == 700
+    paged.close()
+    whole.close()
@@ -0,0 +1,85 @@
+import importlib
+import sys
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+import fleet as fleet_module
+from fleet import Fleet
+from graph_store import DEFAULT_FIXTURE_PATH
+from sim_clock import parse_start_time
+
+START = parse_start_time("2024-03-01T08:00")
+NUM_TICKS = 120
+
+
+@pytest.fixture(scope='module')
+def data4(tmp_path_factory):
+    """El simulador por dispositivo (data4.py) sobre el grafo de prueba, sin ThingSpeak."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('SIM_SINK', 'parquet')
+        mp.setenv('SIM_GRAPH_FIXTURE', DEFAULT_FIXTURE_PATH)
+        mp.setenv('SIM_TRIP_ID_PATH', str(tmp_path_factory.mktemp('trips') / 'trip_ids.sqlite3'))
+        mp.setenv('SIM_ROUTE_HIERARCHY', '0')
+        sys.modules.pop('data4', None)
+        module = importlib.import_module('data4')
+    yield module
+    module.stop_logging()
+
+
+@pytest.fixture
+def route(data4):
+    # Una ruta larga y fija: los dos motores la recorren desde el mismo vértice
+    rng = np.random.default_rng(3)
+    routes = [data4.route_service.random_route(rng, data4.nodes_proj) for _ in range(50)]
+    return max((r for r in routes if r is not None), key=lambda r: r.length)
+
+
+@pytest.fixture
+def no_jitter(data4, monkeypatch):
+    # Sin el factor aleatorio sobre el intervalo, el avance depende sólo de la ruta y la hora
+    monkeypatch.setattr(data4, 'SPEED_JITTER', 0.0)
+    monkeypatch.setattr(fleet_module, 'SPEED_JITTER', 0.0)
+
+
+def test_fleet_matches_device_on_the_same_route(data4, route, no_jitter, monkeypatch):
+    monkeypatch.setattr(data4.Device, 'random_street_route', lambda self, chile_time: route)
+    device = data4.Device(1, seed=7)
+    fleet = Fleet(1, lambda i, rng: route, seed=7, crs=data4.graph.crs, speed_model=data4.speed_model,
+                  stations=data4.station_network)
+    trips = set()
+    for k in range(NUM_TICKS):
+        now = START + timedelta(seconds=k * data4.UPDATE_INTERVAL)
+        reading = device.reading(now)
+        tick = fleet.step(now)
+        trips.add(tick.trip_id[0])
+        assert reading['field3'] == tick.lat[0] and reading['field4'] == tick.lon[0]
+        assert reading['field5'] == tick.speed[0] and reading['field2'] == tick.battery[0]
+        assert reading['field6'] == fleet.encoded_trajectories(tick)[0]
+        assert device.battery_state == fleet_module.BATTERY_STATE_NAMES[tick.battery_state[0]]
+    # La ruta se termina y se vuelve a empezar varias veces en ambos motores
+    assert len(trips) > 1
+
+
+def _run_fleet(data4, seed, ticks=30):
+    fleet = Fleet.from_graph(data4.graph, data4.nodes_proj, 20, seed=seed, route_service=data4.route_service,
+                             speed_model=data4.speed_model, stations=data4.station_network)
+    return [fleet.step(START + timedelta(seconds=k * data4.UPDATE_INTERVAL)) for k in range(ticks)]
+
+
+def _run_device(data4, seed, ticks=30):
+    device = data4.Device(1, seed=seed)
+    readings = [device.reading(START + timedelta(seconds=k * data4.UPDATE_INTERVAL)) for k in range(ticks)]
+    return [{key: value for key, value in r.items() if key != 'field8'} for r in readings]
+
+
+def test_same_seed_same_readings(data4):
+    a, b = _run_fleet(data4, seed=11), _run_fleet(data4, seed=11)
+    for x, y in zip(a, b):
+        for field in ('temperature', 'battery', 'battery_state', 'x', 'y', 'speed', 'traj_xy', 'traj_offsets'):
+            np.testing.assert_array_equal(getattr(x, field), getattr(y, field))
+    # Otra semilla, otras rutas
+    assert not np.array_equal(a[-1].x, _run_fleet(data4, seed=12)[-1].x)
+    # El dispositivo solo también se repite con su semilla (los IDs de viaje son globales)
+    assert _run_device(data4, seed=11) == _run_device(data4, seed=11)
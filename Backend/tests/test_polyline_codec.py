@@ -0,0 +1,54 @@
+import numpy as np
+import polyline
+
+from polyline_codec import TrajectoryEncoder, decode_points, dequantize, encode_batch, encode_points, quantize
+
+
+def _trajectories(seed=0, devices=20):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 12, devices)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    # Pasos chicos y grandes alrededor de Valparaíso, con coordenadas sin redondear
+    steps = rng.normal(0, 2e-4, (offsets[-1], 2)) * rng.choice([1, 100], (offsets[-1], 1))
+    points = np.array([-33.04, -71.61]) + np.cumsum(steps, axis=0)
+    return points[:, 0], points[:, 1], offsets
+
+
+def test_encode_batch_matches_polyline():
+    lat, lon, offsets = _trajectories()
+    encoded = encode_batch(lat, lon, offsets)
+    for i, text in enumerate(encoded):
+        a, b = offsets[i], offsets[i + 1]
+        if b - a < 2:
+            assert text == ""
+            continue
+        expected = [(float(y), float(x)) for y, x in dequantize(np.column_stack((quantize(lat[a:b]), quantize(lon[a:b]))))]
+        assert text == polyline.encode(expected, precision=5)
+
+
+def test_round_trip():
+    lat, lon, offsets = _trajectories(seed=1)
+    for i, text in enumerate(encode_batch(lat, lon, offsets, min_points=1)):
+        a, b = offsets[i], offsets[i + 1]
+        expected = np.column_stack((quantize(lat[a:b]), quantize(lon[a:b])))
+        np.testing.assert_array_equal(decode_points(text), expected)
+    points = np.array([[-3304000, -7161000], [-3304000, -7161000], [-3303990, -7160950]])
+    # Los puntos repetidos se omiten al codificar
+    np.testing.assert_array_equal(decode_points(encode_points(points)), points[[0, 2]])
+
+
+def test_continuous_chunks_concatenate_to_the_trip():
+    encoder = TrajectoryEncoder(1, continuous=True)
+    rng = np.random.default_rng(2)
+    points = np.cumsum(rng.integers(-40, 40, (12, 2)), axis=0) + np.array([-3304000, -7161000])
+    points[5] = points[4] # un punto repetido dentro del viaje
+    lat, lon = dequantize(points[:, 0]), dequantize(points[:, 1])
+    chunks = []
+    for a, b in ((0, 3), (3, 3), (3, 8), (8, 12)):
+        # Cada tick repite el último punto del anterior, como la posición de un dispositivo
+        start = max(a - 1, 0)
+        chunks.extend(encoder.encode(lat[start:b], lon[start:b], [0, b - start], trip_ids=[7]))
+    np.testing.assert_array_equal(decode_points("".join(chunks)), np.delete(points, 5, axis=0))
+    # Un viaje nuevo empieza una Polyline independiente
+    text, = encoder.encode(lat[:2], lon[:2], [0, 2], trip_ids=[8])
+    np.testing.assert_array_equal(decode_points(text), points[:2])
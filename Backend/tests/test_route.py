@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from routing import Route, cumulative_lengths
+
+
+@pytest.fixture
+def route():
+    # Una L: 30 m al este en tres tramos de 10 m y luego 40 m al norte
+    return Route([(0, 0), (10, 0), (20, 0), (30, 0), (30, 40)])
+
+
+def test_cumulative_lengths():
+    assert cumulative_lengths(np.array([(0.0, 0.0), (3.0, 4.0), (3.0, 10.0)])).tolist() == [0.0, 5.0, 11.0]
+    assert cumulative_lengths(np.zeros((1, 2))).tolist() == [0.0]
+    assert len(cumulative_lengths(np.zeros((0, 2)))) == 0
+
+
+def test_route_length(route):
+    assert route.cum.tolist() == [0.0, 10.0, 20.0, 30.0, 70.0]
+    assert route.length == 70.0
+    assert route.last_index == 4
+
+
+def test_advance_inside_segment(route):
+    index, trajectory = route.advance(0, 25.0)
+    assert index == 2
+    np.testing.assert_allclose(trajectory, [(0, 0), (10, 0), (20, 0), (25, 0)])
+    # Desde un vértice intermedio y doblando la esquina
+    index, trajectory = route.advance(2, 30.0)
+    assert index == 3
+    np.testing.assert_allclose(trajectory, [(20, 0), (30, 0), (30, 20)])
+
+
+def test_advance_to_vertex_and_past_the_end(route):
+    # Caer justo en un vértice lo repite como punto final (la ruta no terminó)
+    index, trajectory = route.advance(1, 10.0)
+    assert index == 2
+    np.testing.assert_allclose(trajectory, [(10, 0), (20, 0), (20, 0)])
+    # Pasarse del final termina la ruta y devuelve una vista, sin copiar
+    index, trajectory = route.advance(1, 500.0)
+    assert index == route.last_index
+    np.testing.assert_allclose(trajectory, route.coords[1:])
+    assert np.shares_memory(trajectory, route.coords)
+
+
+def test_advance_without_distance(route):
+    for index, distance in ((2, 0.0), (2, -5.0), (4, 10.0)):
+        new_index, trajectory = route.advance(index, distance)
+        assert new_index == index
+        np.testing.assert_allclose(trajectory, route.coords[index:index + 1])
+
+
+def test_shifted_cum_only_uses_differences(route):
+    # Un tramo de una ruta más larga trae la distancia acumulada desplazada
+    shifted = Route(route.coords, cum=route.cum + 1000.0, energy=route.energy + 5.0)
+    assert shifted.length == route.length
+    assert shifted.advance(1, 25.0)[0] == route.advance(1, 25.0)[0]
+    assert shifted.energy_used(0, 40.0) == pytest.approx(route.energy_used(0, 40.0))
@@ -0,0 +1,103 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from sim_clock import TimingWheel, VirtualClock, VirtualScheduler, phase_offsets
+
+START = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def test_scheduler_orders_by_time_then_schedule_order():
+    clock = VirtualClock(START)
+    scheduler = VirtualScheduler(clock)
+    events = []
+
+    def every(name, interval):
+        def task(now):
+            events.append((clock.elapsed, name))
+            return interval
+        return task
+
+    # b y c tocan a la misma hora: van en el orden en que se agendaron, también al repetirse
+    scheduler.schedule(5.0, every('a', 10.0))
+    scheduler.schedule(0.0, every('b', 10.0))
+    scheduler.schedule(0.0, every('c', 10.0))
+    scheduler.run(25.0)
+    assert events == [(0.0, 'b'), (0.0, 'c'), (5.0, 'a'), (10.0, 'b'), (10.0, 'c'), (15.0, 'a'),
+                      (20.0, 'b'), (20.0, 'c')]
+    assert clock.elapsed == 25.0
+    # La que toca justo al final corre en la llamada siguiente
+    scheduler.run(5.0)
+    assert events[8:] == [(25.0, 'a')]
+
+
+def test_scheduler_stops_at_duration_and_resumes():
+    clock = VirtualClock(START)
+    scheduler = VirtualScheduler(clock)
+    seen = []
+    scheduler.schedule(0.0, lambda now: seen.append(now) or 60.0)
+    scheduler.run(90.0)
+    # El reloj llega al final pedido aunque la próxima tarea sea después
+    assert clock.elapsed == 90.0
+    assert [(t - START).total_seconds() for t in seen] == [0.0, 60.0]
+    scheduler.run(60.0)
+    assert [(t - START).total_seconds() for t in seen] == [0.0, 60.0, 120.0]
+    # 300 s con un intervalo de 60 s son 5 ticks
+    clock = VirtualClock(START)
+    scheduler = VirtualScheduler(clock)
+    seen = []
+    scheduler.schedule(0.0, lambda now: seen.append(now) or 60.0)
+    scheduler.run(300.0)
+    assert len(seen) == 5
+
+
+def test_scheduler_drops_finished_tasks():
+    clock = VirtualClock(START)
+    scheduler = VirtualScheduler(clock)
+    runs = []
+    scheduler.schedule(0.0, lambda now: runs.append(now) or (1.0 if len(runs) < 3 else None))
+    scheduler.run()
+    assert len(runs) == 3
+    assert clock.elapsed == 2.0
+
+
+def test_phase_offsets_spread_evenly():
+    assert phase_offsets(4, 2.0) == [0.0, 0.5, 1.0, 1.5]
+
+
+def test_timing_wheel_dispatches_in_phase_order():
+    order = []
+    lock = threading.Lock()
+
+    def make(name):
+        def task(lag):
+            with lock:
+                order.append(name)
+        return task
+
+    wheel = TimingWheel(0.4, slot_width=0.05, workers=1)
+    # Agendadas en desorden: la rueda las despacha por fase
+    wheel.add(make('c'), 0.3)
+    wheel.add(make('a'), 0.0)
+    wheel.add(make('b'), 0.15)
+    runner = threading.Thread(target=wheel.run)
+    runner.start()
+    time.sleep(0.7)
+    wheel.stop()
+    runner.join(5)
+    assert order[:5] == ['a', 'b', 'c', 'a', 'b']
+    assert wheel.overruns == 0
+
+
+def test_timing_wheel_reports_busy_overruns():
+    overruns = []
+    wheel = TimingWheel(0.1, slot_width=0.05, workers=2, on_overrun=lambda task, kind: overruns.append(kind))
+    # La tarea tarda más que un intervalo: la vuelta siguiente se salta en vez de encimarse
+    wheel.add(lambda lag: time.sleep(0.25))
+    runner = threading.Thread(target=wheel.run)
+    runner.start()
+    time.sleep(0.3)
+    wheel.stop()
+    runner.join(5)
+    assert 'busy' in overruns
+    assert wheel.overruns == len(overruns)
@@ -0,0 +1,102 @@
+import pytest
+
+import uplink
+from spool import ReadingSpool
+from thingspeak_stub import ThingSpeakStub
+from uplink import ThingSpeakUplink, make_update
+
+
+def _reading(k):
+    return make_update(20.0, 90.0, -33.04, -71.6, 4.2, "", 1, k, "2024-03-01T00:00:00-03:00")
+
+
+@pytest.fixture
+def stub():
+    stub = ThingSpeakStub().start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(uplink, 'BACKOFF_BASE', 0.0)
+
+
+def test_spool_survives_reopen(tmp_path):
+    path = str(tmp_path / 'spool.sqlite3')
+    spool = ReadingSpool(path)
+    spool.append_many(_reading(k) for k in range(1, 6))
+    seq = spool.peek(2)[-1][0]
+    assert spool.ack(seq) == 2
+    spool.close()
+
+    spool = ReadingSpool(path)
+    assert spool.depth() == 3
+    assert [update['field8'] for _, update in spool.peek(10)] == [3, 4, 5]
+    spool.close()
+
+
+def test_replay_in_order_after_rejections(tmp_path, stub):
+    path = str(tmp_path / 'spool.sqlite3')
+    spool = ReadingSpool(path)
+    # Atraso de una ejecución anterior
+    spool.append_many(_reading(k) for k in range(1, 251))
+    sink = ThingSpeakUplink(1, 'key', base_url=stub.base_url, batch_size=50, flush_interval=0, spool=spool,
+                            max_batches_per_flush=2)
+    stub.reject_next = 2
+    assert sink.flush() is False
+    assert sink.flush() is False
+    assert spool.depth() == 250 and not stub.entries
+
+    # En vivo: lo nuevo sale en el mismo POST que la cuota del atraso
+    for k in range(251, 261):
+        sink.submit(_reading(k))
+    assert sink.flush() is True
+    assert len(stub.entries) == 10 + 100
+
+    # Lo que falte queda en disco para el próximo arranque
+    spool.close()
+    spool = ReadingSpool(path)
+    sink = ThingSpeakUplink(1, 'key', base_url=stub.base_url, batch_size=50, flush_interval=0, spool=spool)
+    while spool.depth():
+        assert sink.flush() is True
+    assert [int(entry['field8']) for entry in stub.entries] == list(range(1, 261))
+    spool.close()
+
+
+def test_uplink_keeps_failed_batches(stub):
+    sink = ThingSpeakUplink(1, 'key', base_url=stub.base_url, batch_size=4, flush_interval=0)
+    for k in range(1, 11):
+        sink.submit(_reading(k))
+    stub.reject_next = 1
+    assert sink.flush() is False
+    assert sink.pending() == 10
+    for k in range(11, 16):
+        sink.submit(_reading(k))
+    # El lote rechazado sale primero, junto con lo que llegó después
+    assert sink.flush() is True
+    assert sink.pending() == 0
+    assert [int(entry['field8']) for entry in stub.entries] == list(range(1, 16))
+    assert stub.requests == 2
+
+
+def test_uplink_one_post_per_interval(stub):
+    sink = ThingSpeakUplink(1, 'key', base_url=stub.base_url, batch_size=4, flush_interval=60)
+    for k in range(1, 11):
+        sink.submit(_reading(k))
+    # Un solo POST con todo lo encolado, aunque supere `batch_size`
+    assert sink.flush() is True
+    assert len(stub.entries) == 10
+    for k in range(11, 16):
+        sink.submit(_reading(k))
+    # Hay un lote lleno esperando, pero el canal no admite otro POST hasta el próximo intervalo
+    assert sink.flush() is None
+    assert stub.requests == 1 and sink.pending() == 5
+
+
+def test_uplink_post_size_is_capped(stub):
+    sink = ThingSpeakUplink(1, 'key', base_url=stub.base_url, flush_interval=0)
+    for k in range(1, uplink.MAX_BULK_UPDATES + 11):
+        sink.submit(_reading(k))
+    assert sink.flush() is True
+    assert len(stub.entries) == uplink.MAX_BULK_UPDATES and sink.pending() == 10
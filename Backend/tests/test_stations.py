@@ -0,0 +1,56 @@
+import math
+
+import numpy as np
+import pytest
+
+from stations import StationNetwork, spread_stations
+
+
+@pytest.fixture(scope='module', params=['length', 'energy'])
+def network(request, graph):
+    return StationNetwork(graph, spread_stations(graph, 4), weight=request.param)
+
+
+def _sample(graph, count=80, seed=0):
+    return np.random.default_rng(seed).integers(0, graph.num_nodes, count).tolist()
+
+
+def test_field_matches_dijkstra_per_node(graph, network):
+    stations = network.station_index.tolist()
+    for node in _sample(graph):
+        dist, _ = graph.dijkstra(node, weight=network.weight)
+        costs = [dist.get(s, math.inf) for s in stations]
+        expected = min(costs)
+        if math.isinf(expected):
+            assert network.station[node] == -1
+            assert math.isinf(network.distance[node])
+            continue
+        assert network.distance[node] == pytest.approx(expected, rel=1e-9, abs=1e-9)
+        # La estación elegida es una de las más cercanas (puede haber empates)
+        assert costs[network.station[node]] == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_path_follows_the_field(graph, network):
+    weights = graph.weights if network.weight == 'length' else graph.energy
+    for node in _sample(graph, seed=1):
+        path = network.path_from(node)
+        if path is None:
+            continue
+        assert path[0] == node
+        assert path[-1] == network.station_index[network.station[node]]
+        cost = float(weights[graph.hop_edges(path)].sum()) if len(path) > 1 else 0.0
+        assert cost == pytest.approx(network.distance[node], rel=1e-9, abs=1e-9)
+
+
+def test_dispatch_is_a_batched_lookup(graph, network):
+    nodes = np.array(_sample(graph, seed=2))
+    station, routes = network.dispatch(graph.x[nodes], graph.y[nodes])
+    located = network.locate(graph.x[nodes], graph.y[nodes])
+    assert station.tolist() == network.station[located].tolist()
+    for node, s, route in zip(located.tolist(), station.tolist(), routes):
+        if s < 0 or network.path_from(node) == [node]:
+            assert route is None
+        else:
+            # La ruta termina en la estación
+            end = network.station_index[s]
+            np.testing.assert_allclose(route.coords[-1], (graph.x[end], graph.y[end]))
@@ -0,0 +1,82 @@
+import multiprocessing as mp
+import threading
+
+from trip_ids import TripIdAllocator
+
+
+def test_ids_survive_restart(tmp_path):
+    path = str(tmp_path / 'trip_ids.sqlite3')
+    allocator = TripIdAllocator(path, block_size=8)
+    first = [allocator.next_id() for _ in range(5)]
+    allocator.close()
+
+    allocator = TripIdAllocator(path, block_size=8)
+    # El resto del bloque anterior se pierde, pero ningún ID se repite
+    assert allocator.next_id() > max(first)
+    assert allocator.high_water_mark() == 16
+    allocator.close()
+
+
+def test_unique_across_threads(tmp_path):
+    allocator = TripIdAllocator(str(tmp_path / 'trip_ids.sqlite3'), block_size=4)
+    results = [[] for _ in range(4)]
+
+    def draw(out):
+        out.extend(allocator.next_id() for _ in range(50))
+
+    threads = [threading.Thread(target=draw, args=(out,)) for out in results]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = [trip_id for out in results for trip_id in out]
+    assert len(set(ids)) == len(ids) == 200
+    allocator.close()
+
+
+def _draw_ids(path, count, out):
+    allocator = TripIdAllocator(path, block_size=3)
+    out.put([allocator.next_id() for _ in range(count)])
+    allocator.close()
+
+
+def test_unique_across_processes(tmp_path):
+    path = str(tmp_path / 'trip_ids.sqlite3')
+    ctx = mp.get_context('fork')
+    out = ctx.Queue()
+    processes = [ctx.Process(target=_draw_ids, args=(path, 40, out)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    ids = [trip_id for _ in processes for trip_id in out.get(timeout=30)]
+    for process in processes:
+        process.join()
+    assert len(set(ids)) == len(ids) == 120
+
+
+def _draw_inherited(allocator, count, out):
+    out.put([allocator.next_id() for _ in range(count)])
+
+
+def test_inherited_allocator_after_fork(tmp_path):
+    # Abierto antes del fork (como `trip_ids` en data4.py) y con un bloque a medio usar
+    allocator = TripIdAllocator(str(tmp_path / 'trip_ids.sqlite3'), block_size=10)
+    parent = [allocator.next_id()]
+    ctx = mp.get_context('fork')
+    out = ctx.Queue()
+    process = ctx.Process(target=_draw_inherited, args=(allocator, 15, out))
+    process.start()
+    child = out.get(timeout=30)
+    process.join()
+    parent += [allocator.next_id() for _ in range(15)]
+    # El hijo no reparte lo que queda del bloque del padre
+    assert len(set(parent + child)) == len(parent) + len(child)
+    allocator.close()
+
+
+def test_reconcile_skips_remote_ids(tmp_path):
+    allocator = TripIdAllocator(str(tmp_path / 'trip_ids.sqlite3'), block_size=10)
+    assert allocator.next_id() == 1
+    assert allocator.reconcile(500) == 500
+    # El bloque que tenía el hilo queda descartado
+    assert allocator.next_id() == 501
+    allocator.close()
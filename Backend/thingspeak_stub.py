@@ -0,0 +1,136 @@
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# --- Servidor Local que Imita a ThingSpeak ---
+# Sirve para probar el simulador sin red ni API keys: apunta THINGSPEAK_BASE_URL a
+# `stub.base_url`. Implementa update.json, bulk_update.json y la lectura de feeds.json y
+# fields/N.json con los parámetros `results`, `start` y `end` (en UTC) de la API real.
+
+BULK_PATH = re.compile(r'^/channels/(\w+)/bulk_update\.json$')
+FIELD_PATH = re.compile(r'^/channels/(\w+)/fields/(\d)\.json$')
+FEEDS_PATH = re.compile(r'^/channels/(\w+)/feeds\.json$')
+# Formato de `created_at` en las respuestas (`start` / `end` van como 'YYYY-MM-DD HH:NN:SS')
+FEED_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _utc(created_at):
+    """`created_at` de una escritura (ISO 8601; sin zona se toma como UTC) -> hora UTC al segundo."""
+    when = datetime.fromisoformat(created_at) if created_at else datetime.now(timezone.utc)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc).replace(microsecond=0)
+
+
+class ThingSpeakStub:
+    """
+    Servidor HTTP en 127.0.0.1 que guarda las entradas recibidas en memoria.
+    `reject_next` hace que las próximas N escrituras se rechacen ("0" en update.json,
+    HTTP 429 en bulk_update), como cuando ThingSpeak limita la frecuencia.
+    """
+
+    def __init__(self, port=0):
+        self.entries = []
+        self.requests = 0
+        self.reject_next = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _make_handler(self))
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="thingspeak-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _should_reject(self):
+        with self.lock:
+            self.requests += 1
+            if self.reject_next > 0:
+                self.reject_next -= 1
+                return True
+            return False
+
+    def add_entries(self, updates):
+        with self.lock:
+            first_id = len(self.entries) + 1
+            for offset, update in enumerate(updates):
+                entry = {key: (str(value) if value is not None else None) for key, value in update.items() if key != 'api_key'}
+                # Como ThingSpeak: la hora queda en UTC (la de llegada si la escritura no trae una)
+                entry['created_at'] = _utc(entry.get('created_at')).strftime(FEED_TIME_FORMAT)
+                entry['entry_id'] = first_id + offset
+                self.entries.append(entry)
+            return len(self.entries)
+
+
+def _make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body, content_type='application/json'):
+            data = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            raw = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+            if path == '/update.json':
+                if stub._should_reject():
+                    return self._reply(200, "0", 'text/plain')
+                fields = {key: values[0] for key, values in parse_qs(raw, keep_blank_values=True).items()}
+                return self._reply(200, str(stub.add_entries([fields])), 'text/plain')
+            if BULK_PATH.match(path):
+                if stub._should_reject():
+                    return self._reply(429, {'success': False})
+                updates = json.loads(raw).get('updates', [])
+                stub.add_entries(updates)
+                return self._reply(202, {'success': True})
+            return self._reply(404, {'error': 'not found'})
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            params = parse_qs(parsed.query)
+            results = min(int(params.get('results', ['100'])[0]), 8000)
+            # `start` y `end` incluyen sus extremos; se devuelven las `results` más nuevas del rango
+            start = params['start'][0].replace(' ', 'T') + 'Z' if 'start' in params else None
+            end = params['end'][0].replace(' ', 'T') + 'Z' if 'end' in params else None
+            with stub.lock:
+                stub.requests += 1
+                feeds = [e for e in stub.entries if (start is None or e['created_at'] >= start)
+                         and (end is None or e['created_at'] <= end)][-results:]
+            match = FIELD_PATH.match(parsed.path)
+            if match:
+                field = f"field{match.group(2)}"
+                feeds = [{'entry_id': e['entry_id'], 'created_at': e.get('created_at'), field: e.get(field)} for e in feeds]
+                return self._reply(200, {'channel': {'id': match.group(1)}, 'feeds': feeds})
+            match = FEEDS_PATH.match(parsed.path)
+            if match:
+                return self._reply(200, {'channel': {'id': match.group(1), 'last_entry_id': len(stub.entries)}, 'feeds': feeds})
+            return self._reply(404, {'error': 'not found'})
+
+    return Handler
+
+
+if __name__ == "__main__":
+    stub = ThingSpeakStub(port=8351).start()
+    print(f"🧪 Stub de ThingSpeak escuchando en {stub.base_url} (CTRL+C para detener)")
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+
+import numpy as np
+import polyline
+
+from graph_store import read_meta
+from projection import project_coords
+from routing import Route, cumulative_lengths
+from spatial_index import NodeGrid
+
+# --- Trayectorias Predefinidas Ajustadas a la Red de Calles ---
+# Una trayectoria predefinida (Polyline) se ajusta al grafo una sola vez: cada punto se lleva
+# al nodo más cercano de la componente conexa principal y los nodos consecutivos se unen por
+# el camino más corto. El resultado (geometría, distancia acumulada, nodos y la posición de
+# cada punto original) se guarda junto al caché del grafo, en `<grafo>/trajectories/`. La
+# energía acumulada (depende de la elevación que se use) y la arista de cada punto se
+# calculan al cargarla, a partir de los nodos.
+# Los viajes sobre la trayectoria son tramos entre dos puntos originales: elegirlos es
+# sortear dos índices y tomar una vista del array.
+MIN_SUB_TRAJECTORY_POINTS = 10 # puntos originales mínimos por tramo
+
+
+class MatchedTrajectory:
+    """Trayectoria ajustada al grafo: `coords[point_index[k]]` es el punto original k ya ajustado."""
+
+    def __init__(self, coords, cum, nodes, point_index, energy=None, edges=None):
+        self.coords = coords
+        self.cum = cum
+        self.nodes = nodes
+        self.point_index = point_index
+        self.energy = energy
+        self.edges = edges
+        self.coords.flags.writeable = False
+
+    @property
+    def num_points(self):
+        return len(self.point_index)
+
+    def sample(self, rng, min_points=MIN_SUB_TRAJECTORY_POINTS):
+        """Tramo al azar de al menos `min_points` puntos originales, como `Route`, o `None`."""
+        n = self.num_points
+        if n < min_points:
+            return None
+        start = int(rng.random() * (n - min_points + 1))
+        end = start + min_points - 1 + int(rng.random() * (n - start - min_points + 1))
+        a, b = self.point_index[start], self.point_index[end]
+        if b <= a:
+            return None
+        return Route(self.coords[a:b + 1], self.cum[a:b + 1], self.energy[a:b + 1] if self.energy is not None else None,
+                     self.edges[a:b + 1] if self.edges is not None else None)
+
+    def save(self, path, graph_stamp):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, coords=self.coords, cum=self.cum, nodes=self.nodes, point_index=self.point_index,
+                 graph_stamp=np.array(graph_stamp))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, graph_stamp):
+        """Trayectoria guardada con `save`, o `None` si no existe o es de otra versión del grafo."""
+        try:
+            with np.load(path) as data:
+                if str(data['graph_stamp']) != graph_stamp:
+                    return None
+                return cls(data['coords'], data['cum'], data['nodes'], data['point_index'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def match_trajectory(graph, component, coords_xy):
+    """
+    Ajusta una polilínea proyectada (N, 2) a un `CSRGraph`. `component` son las etiquetas de
+    componente fuertemente conexa de los nodos (ver `CSRGraph.strongly_connected_components`).
+    """
+    # Sólo se ajusta a nodos de la componente más grande: entre ellos siempre hay camino
+    main = np.flatnonzero(component == np.bincount(component).argmax())
+    grid = NodeGrid(graph.x[main], graph.y[main])
+    snapped = np.array([main[grid.nearest(px, py)] for px, py in coords_xy], dtype=np.int64)
+
+    # Camino entre nodos ajustados consecutivos; puntos que caen en el mismo nodo lo comparten
+    path = [int(snapped[0])]
+    path_position = np.zeros(len(snapped), dtype=np.int64)
+    for k in range(1, len(snapped)):
+        if snapped[k] != path[-1]:
+            path.extend(graph.astar(path[-1], int(snapped[k]))[1:])
+        path_position[k] = len(path) - 1
+
+    # Geometría sin puntos repetidos: el nodo inicial y, por tramo, los puntos después del origen
+    first = np.array([[graph.x[path[0]], graph.y[path[0]]]])
+    hops = graph.hop_edges(path)
+    if len(path) < 2:
+        coords, node_vertex = first, np.zeros(1, dtype=np.int64)
+    else:
+        gather, counts = graph.hop_geometry(hops, with_edge_start=False)
+        coords = np.vstack((first, graph.geom_xy[gather]))
+        node_vertex = np.concatenate(([0], np.cumsum(counts)))
+    return MatchedTrajectory(np.ascontiguousarray(coords, dtype=np.float64), cumulative_lengths(coords),
+                             graph.node_ids[np.array(path)], node_vertex[path_position],
+                             energy=graph.path_energy(path, with_start=True, hops=hops),
+                             edges=graph.path_edges(path, with_start=True, hops=hops))
+
+
+def load_matched_trajectory(encoded, street_graph, graph, component):
+    """Trayectoria Polyline ajustada al grafo, desde el caché en disco o calculada (y guardada)."""
+    meta = read_meta(street_graph.path) if street_graph.path else None
+    digest = hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(street_graph.path, 'trajectories', f"{digest}.npz") if meta else None
+    stamp = f"{meta['key']}:{meta['created']}" if meta else ''
+    if path:
+        matched = MatchedTrajectory.load(path, stamp)
+        if matched is not None:
+            path = [graph.index_of(n) for n in matched.nodes.tolist()]
+            hops = graph.hop_edges(path)
+            matched.energy = graph.path_energy(path, with_start=True, hops=hops)
+            matched.edges = graph.path_edges(path, with_start=True, hops=hops)
+            return matched
+    coords_xy = project_coords(polyline.decode(encoded, precision=5), graph.crs)
+    matched = match_trajectory(graph, component, coords_xy)
+    if path:
+        matched.save(path, stamp)
+    return matched
+
+
+class PredefinedTrajectories:
+    """Conjunto de trayectorias predefinidas ajustadas; `sample` elige una y un tramo de ella."""
+
+    def __init__(self, trajectories):
+        self.trajectories = [t for t in trajectories if t.num_points >= MIN_SUB_TRAJECTORY_POINTS]
+
+    @classmethod
+    def from_polylines(cls, encoded_list, street_graph, graph, component=None):
+        component = graph.strongly_connected_components() if component is None else component
+        return cls([load_matched_trajectory(encoded, street_graph, graph, component) for encoded in encoded_list])
+
+    def __len__(self):
+        return len(self.trajectories)
+
+    def sample(self, rng):
+        """Ruta (`Route`) sobre un tramo de una trayectoria al azar, o `None` si no hay ninguna."""
+        if not self.trajectories:
+            return None
+        return self.trajectories[int(rng.random() * len(self.trajectories))].sample(rng)
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import threading
+import weakref
+
+# --- Asignación Local de IDs de Viaje ---
+# El máximo ID entregado (high-water mark) se guarda en un archivo SQLite compartido por
+# todos los procesos del simulador. Cada hilo reserva bloques de `block_size` IDs de una vez
+# y los consume sin volver a tocar el archivo; los IDs que queden sin usar de un bloque se
+# pierden (quedan huecos), pero nunca se repiten.
+DEFAULT_TRIP_ID_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'trip_ids.sqlite3')
+DEFAULT_BLOCK_SIZE = 32
+
+
+class TripIdAllocator:
+    """Entrega IDs de viaje únicos entre hilos y procesos sin consultar ThingSpeak."""
+
+    def __init__(self, path=DEFAULT_TRIP_ID_PATH, block_size=DEFAULT_BLOCK_SIZE):
+        self.path = path
+        self.block_size = max(1, block_size)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._generation = 0
+        self._inherited = []
+        self._open()
+        _allocators.add(self)
+
+    def _open(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # timeout: espera a que otro proceso suelte el archivo en vez de fallar de inmediato
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS high_water (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO high_water (id, value) VALUES (0, 0)")
+
+    def _after_fork(self):
+        """
+        En el proceso hijo de un fork: la conexión heredada no se usa ni se cierra (es del
+        padre) y se abre una propia. Los bloques ya reservados se descartan, porque el padre
+        los sigue entregando.
+        """
+        self._inherited.append(self._conn)
+        self._generation += 1
+        self._open()
+
+    def high_water_mark(self):
+        """Último ID reservado por cualquier proceso."""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM high_water WHERE id = 0").fetchone()[0]
+
+    def lease(self, count=None):
+        """Reserva `count` IDs consecutivos y devuelve el rango como `range`."""
+        count = count or self.block_size
+        with self._lock:
+            # BEGIN IMMEDIATE toma el bloqueo de escritura antes de leer: dos procesos no pueden
+            # leer el mismo valor y reservar el mismo bloque
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE high_water SET value = value + ? WHERE id = 0", (count,))
+                end = self._conn.execute("SELECT value FROM high_water WHERE id = 0").fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return range(end - count + 1, end + 1)
+
+    def next_id(self):
+        """Siguiente ID del bloque del hilo actual; reserva un bloque nuevo al agotarse."""
+        block = getattr(self._local, 'block', None)
+        trip_id = next(block, None) if block is not None and self._local.generation == self._generation else None
+        if trip_id is None:
+            self._local.generation = self._generation
+            self._local.block = iter(self.lease())
+            trip_id = next(self._local.block)
+        return trip_id
+
+    def reconcile(self, remote_max):
+        """Sube el high-water mark a `remote_max` si el canal remoto ya usó IDs mayores."""
+        with self._lock:
+            self._conn.execute("UPDATE high_water SET value = MAX(value, ?) WHERE id = 0", (int(remote_max),))
+            # Los bloques ya reservados por los hilos podrían quedar por debajo: se descartan
+            self._generation += 1
+        return self.high_water_mark()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Asignadores abiertos en este proceso, para reabrirlos en el hijo después de un fork
+_allocators = weakref.WeakSet()
+
+
+def _reopen_after_fork():
+    for allocator in list(_allocators):
+        allocator._after_fork()
+
+
+os.register_at_fork(after_in_child=_reopen_after_fork)
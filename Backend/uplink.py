@@ -0,0 +1,236 @@
+import json
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPLOAD_ERRORS, UPLOAD_REJECTIONS, UPLOAD_SECONDS, UPLOADED_READINGS
+from sim_log import log
+
+# --- Configuración del Envío por Lotes ---
+THINGSPEAK_BASE_URL = "https://api.thingspeak.com"
+# ThingSpeak acepta hasta 960 mensajes por llamada a bulk_update
+MAX_BULK_UPDATES = 960
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 15.0 # segundos (límite de bulk_update en cuentas gratuitas)
+# Reintentos: espera exponencial entre intentos fallidos. Con spool, tope del atraso que se
+# repone en cada POST, en lotes de `batch_size`
+BACKOFF_BASE = 2.0 # segundos
+BACKOFF_MAX = 300.0 # segundos
+DEFAULT_MAX_BATCHES_PER_FLUSH = 4
+
+
+def make_update(temp, bat, lat, lon, speed, trajectory_str, device_id, trip_id, created_at):
+    """Lectura en el formato de `bulk_update.json`, con el mismo orden de campos que `send_to_thingspeak`."""
+    return {
+        'created_at': created_at,
+        'field1': temp, 'field2': bat, 'field3': lat, 'field4': lon,
+        'field5': speed, 'field6': trajectory_str, 'field7': device_id, 'field8': trip_id,
+    }
+
+
+def make_session(pool_size=4):
+    """Sesión HTTP con conexiones keep-alive reutilizables."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ThingSpeakUplink:
+    """
+    Encola lecturas y las envía agrupadas a `channels/<id>/bulk_update.json` desde un hilo
+    propio, sobre una sesión HTTP persistente. ThingSpeak admite un bulk_update por canal
+    cada `flush_interval` segundos, así que nunca se hace más de un POST por intervalo, y
+    cada POST lleva todo lo encolado (hasta `MAX_BULK_UPDATES`): se envía antes de cumplirse
+    el intervalo sólo si ya se juntaron `batch_size` lecturas y el canal está libre. Un lote
+    que falla vuelve al frente de la cola y se reintenta con espera exponencial, en orden. Si
+    la cola crece más allá de lo que cabe en un POST, se avisa en el log.
+
+    Con un `spool` (ver spool.py) la cola es durable: cada lectura se escribe en disco antes
+    de subirse y se borra sólo cuando ThingSpeak la acepta. Cada POST lleva todo lo que llegó
+    desde el anterior (hasta `MAX_BULK_UPDATES`) más, si hay atraso por una caída o un
+    reinicio, a lo sumo `batch_size * max_batches_per_flush` lecturas atrasadas: la
+    reposición queda acotada sin frenar el tráfico en vivo.
+    """
+
+    def __init__(self, channel_id, write_api_key, base_url=THINGSPEAK_BASE_URL, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, session=None, timeout=10,
+                 spool=None, max_batches_per_flush=DEFAULT_MAX_BATCHES_PER_FLUSH):
+        self.url = f"{base_url.rstrip('/')}/channels/{channel_id}/bulk_update.json"
+        self.write_api_key = write_api_key
+        self.batch_size = max(1, min(batch_size, MAX_BULK_UPDATES))
+        self.flush_interval = flush_interval
+        self.session = session or make_session()
+        self.timeout = timeout
+        self.spool = spool
+        self.max_batches_per_flush = max_batches_per_flush
+        self.consecutive_failures = 0
+        self._retry_at = 0.0
+        self._next_post_at = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        # Lote que falló: se reintenta antes que lo que siga en la cola
+        self._held = []
+        # Tamaño de la cola a partir del cual se vuelve a avisar que el canal no da abasto
+        self._warn_depth = MAX_BULK_UPDATES
+        # Lecturas que llegaron al spool desde el último POST (tráfico en vivo)
+        self._arrived = 0
+        self._arrived_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="thingspeak-uplink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el hilo de envío después de mandar lo que quede en la cola, al ritmo del canal."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.spool is not None:
+            # Lo que no alcance a subir queda en el spool para el próximo arranque
+            self.flush()
+            return
+        if self.pending():
+            log.info(f"📤 [Uplink] Enviando {self.pending()} lecturas pendientes antes de salir "
+                     f"(hasta {MAX_BULK_UPDATES} cada {self.flush_interval:.0f}s).")
+        while self.pending():
+            time.sleep(max(0.0, self._next_allowed() - time.monotonic()))
+            if self.flush() is False:
+                log.error(f"❌ [Uplink] Se descartan {self.pending()} lecturas que no se pudieron enviar.")
+                return
+
+    def submit(self, update):
+        if self.spool is not None:
+            # Con spool el drenado va a ritmo fijo (un POST por `flush_interval`), también al ponerse al día
+            self.spool.append(update)
+            with self._arrived_lock:
+                self._arrived += 1
+            return
+        self._queue.put(update)
+        # Avisa una sola vez por lote lleno; el hilo igual respeta el intervalo del canal
+        if self._queue.qsize() == self.batch_size:
+            self._wake.set()
+
+    def pending(self):
+        return self.spool.depth() if self.spool is not None else self._queue.qsize() + len(self._held)
+
+    def _next_allowed(self):
+        return max(self._next_post_at, self._retry_at)
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self._next_allowed() - time.monotonic()
+            self._wake.wait(delay if delay > 0 else self.flush_interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.flush()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """
+        Envía un lote si el canal está libre (pasó `flush_interval` desde el último POST y la
+        espera tras un error). Devuelve True/False según ThingSpeak lo aceptó, o None si no
+        se envió nada.
+        """
+        with self._flush_lock:
+            now = time.monotonic()
+            if now < self._next_allowed():
+                return None
+            if self.spool is not None:
+                return self._flush_spool(now)
+            batch = self._held + self._drain(MAX_BULK_UPDATES - len(self._held))
+            if not batch:
+                return None
+            self._next_post_at = now + self.flush_interval
+            ok = self.post_batch(batch)
+            self._held = [] if ok else batch
+            self._after_post(ok)
+            self._check_backlog()
+            return ok
+
+    def _check_backlog(self):
+        """Avisa (cada vez que se duplica) si quedan más lecturas encoladas de las que caben en un POST."""
+        left = self.pending()
+        if left <= MAX_BULK_UPDATES:
+            self._warn_depth = MAX_BULK_UPDATES
+        elif left > self._warn_depth:
+            per_second = MAX_BULK_UPDATES / self.flush_interval if self.flush_interval else float('inf')
+            log.warning(f"⚠️ [Uplink] {left} lecturas encoladas: el canal sube a lo sumo {per_second:.0f} "
+                        f"lecturas/s y la cola está creciendo.")
+            self._warn_depth = left * 2
+
+    def _after_post(self, ok):
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.consecutive_failures - 1))
+        self._retry_at = time.monotonic() + delay
+        log.warning(f"⏳ [Uplink] {self.pending()} lecturas pendientes. Reintento en {delay:.0f}s.")
+
+    def _flush_spool(self, now):
+        """Reenvía en orden lo pendiente en el spool: lo recién llegado más una cuota del atraso."""
+        with self._arrived_lock:
+            arrived, self._arrived = self._arrived, 0
+        depth = self.spool.depth()
+        live = min(arrived, depth)
+        backlog = depth - live
+        replay = min(backlog, self.batch_size * self.max_batches_per_flush)
+        rows = self.spool.peek(min(MAX_BULK_UPDATES, live + replay))
+        if not rows:
+            return None
+        if backlog:
+            log.info(f"🔁 [Uplink] Reponiendo {replay} de {backlog} lecturas atrasadas del spool.")
+        self._next_post_at = now + self.flush_interval
+        ok = self.post_batch([update for _, update in rows])
+        if ok:
+            self.spool.ack(rows[-1][0])
+        self._after_post(ok)
+        return ok
+
+    def post_batch(self, batch):
+        """Envía un lote. Devuelve True si ThingSpeak lo aceptó."""
+        body = {'write_api_key': self.write_api_key, 'updates': batch}
+        self.requests += 1
+        try:
+            with UPLOAD_SECONDS.labels('bulk').time():
+                response = self.session.post(self.url, data=json.dumps(body), timeout=self.timeout,
+                                             headers={'Content-Type': 'application/json'})
+            response.raise_for_status()
+            accepted = response.json().get('success', False)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.failed += len(batch)
+            # HTTP 429: ThingSpeak limitó la frecuencia, igual que el "0" de update.json
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            (UPLOAD_REJECTIONS if status == 429 else UPLOAD_ERRORS).labels('bulk').inc()
+            log.error(f"❌ [Uplink] Error de conexión con ThingSpeak ({len(batch)} lecturas): {e}")
+            return False
+        if not accepted:
+            self.failed += len(batch)
+            UPLOAD_REJECTIONS.labels('bulk').inc()
+            log.error(f"❌ [Uplink] ThingSpeak rechazó el lote de {len(batch)} lecturas.")
+            return False
+        self.sent += len(batch)
+        UPLOADED_READINGS.labels('bulk').inc(len(batch))
+        log.info(f"✅ [Uplink] Lote enviado: {len(batch)} lecturas ({time.strftime('%H:%M:%S')}).")
+        return True